@@ -1,111 +1,1309 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, has_request_context, jsonify, request, send_from_directory, stream_with_context
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, UnicodeDammit
 import re
 import time
 import os
 import sys
 import logging
+import json
+import math
+import cProfile
+import pstats
+import base64
+import hashlib
+import sqlite3
+import threading
+import queue
+import shlex
+import shutil
+import signal
+import subprocess
+import atexit
+import fcntl
+from contextlib import contextmanager
+from functools import wraps
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timedelta, timezone
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess as prometheus_multiprocess
+except ImportError:
+    prometheus_client = None
+
+try:
+    import brotli  # noqa: F401 - lets urllib3 decode 'br' responses
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='.', static_url_path='')
+# Behind nginx/Apache, let the front server send files (X-Sendfile)
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes', 'on')
 CORS(app)
 
-class TorrentScraper:
-    def __init__(self):
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+def env_flag(name, default=False):
+    """Read a boolean switch from the environment"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def gevent_patched():
+    """True when a gevent worker has monkey-patched the standard library"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+# Under gunicorn's gevent worker blocking I/O yields to other requests, so
+# pools can be sized for many concurrent greenlets instead of a few threads
+ASYNC_WORKER = gevent_patched()
+
+# Prometheus metrics, exposed on /metrics. With several gunicorn workers set
+# PROMETHEUS_MULTIPROC_DIR so every worker's samples are aggregated.
+class NullMetric:
+    """Stand-in used when prometheus_client isn't installed"""
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    @contextmanager
+    def time(self):
+        yield
+
+def make_metric(kind, name, documentation, labels=(), **kwargs):
+    if prometheus_client is None:
+        return NullMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+REQUEST_SECONDS = make_metric(
+    'Histogram', 'streamvault_request_seconds', 'API request latency', ('endpoint', 'method', 'status')
+)
+MIRROR_FETCH_SECONDS = make_metric(
+    'Histogram', 'streamvault_mirror_fetch_seconds', 'Time to download a mirror search page', ('host', 'outcome'),
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 15, 30)
+)
+PARSE_SECONDS = make_metric(
+    'Histogram', 'streamvault_parse_seconds', 'Time to parse a search page', ('engine',),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+)
+PAGE_ROWS = make_metric(
+    'Histogram', 'streamvault_page_rows', 'Results parsed per search page',
+    buckets=(0, 1, 5, 10, 20, 30, 50, 100)
+)
+CACHE_LOOKUPS = make_metric(
+    'Counter', 'streamvault_cache_lookups_total', 'Cache lookups by result (hit ratio = hits / all)', ('cache', 'result')
+)
+PROXY_BYTES = make_metric(
+    'Histogram', 'streamvault_proxy_response_bytes', 'Body size of proxied responses', ('cache',),
+    buckets=(1024, 16384, 65536, 262144, 1048576, 4194304, 10485760)
+)
+ADMISSION_REJECTED = make_metric(
+    'Counter', 'streamvault_admission_rejected_total', 'Requests shed by admission control', ('endpoint', 'reason')
+)
+# Gauges are summed over the live workers in multiprocess mode
+ADMISSION_ACTIVE = make_metric(
+    'Gauge', 'streamvault_admission_active', 'Work units holding an admission slot', ('gate',),
+    multiprocess_mode='livesum'
+)
+ADMISSION_QUEUE_DEPTH = make_metric(
+    'Gauge', 'streamvault_admission_queue_depth', 'Callers waiting for an admission slot', ('gate',),
+    multiprocess_mode='livesum'
+)
+HLS_QUEUE_DEPTH = make_metric(
+    'Gauge', 'streamvault_hls_queue_depth', 'Transcode jobs waiting for an encoder', multiprocess_mode='livesum'
+)
+HLS_JOB_SECONDS = make_metric(
+    'Histogram', 'streamvault_hls_job_seconds', 'Wall time of HLS transcode jobs', ('mode', 'state'),
+    buckets=(1, 10, 30, 60, 300, 900, 1800, 3600, 7200, 14400)
+)
+
+@app.before_request
+def start_request_timer():
+    g.started_at = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started_at = g.get('started_at')
+    if started_at is not None and request.url_rule is not None:
+        # Streamed responses are timed to their first byte
+        REQUEST_SECONDS.labels(request.url_rule.rule, request.method, response.status_code).observe(
+            time.perf_counter() - started_at
+        )
+    return response
+
+# Opt-in profiling: searches slower than PROFILE_SLOW_SEARCH_MS milliseconds
+# dump their cProfile stats (request thread and scrape threads) to PROFILE_DIR
+PROFILE_SLOW_SEARCH_MS = float(os.environ.get('PROFILE_SLOW_SEARCH_MS', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/streamvault-profiles')
+# Profilers can't be nested: Python 3.12+ allows one per interpreter, and
+# greenlets sharing a thread would replace each other's. So one request is
+# profiled at a time per worker, and the others run unprofiled.
+_profiling = threading.Lock()
+
+class RequestProfile:
+    """
+    cProfile capture for one request. Work the request hands to pool
+    threads is included when submitted through wrap(). Stats are only
+    written if the request took longer than `threshold_ms`.
+    """
+    def __init__(self, name, threshold_ms):
+        self.name = name
+        self.threshold_ms = threshold_ms
+        self.lock = threading.Lock()
+        self.profiles = []
+
+    def wrap(self, fn):
+        def run(*args, **kwargs):
+            # A greenlet on the request's own thread is already seen by the
+            # request profiler, and on 3.12+ that one sees every thread
+            if self.main is None or sys.getprofile() is not None:
+                return fn(*args, **kwargs)
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self.lock:
+                    self.profiles.append(profile)
+        return run
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.main = cProfile.Profile()
+        try:
+            self.main.enable()
+        except ValueError:
+            # Something else (a debugger, coverage) is already profiling
+            self.main = None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.main is None:
+            return
+        self.main.disable()
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        if elapsed_ms < self.threshold_ms:
+            return
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{self.name}-{int(time.time())}-{os.getpid()}-{threading.get_ident()}.prof")
+            with self.lock:
+                stats = pstats.Stats(self.main)
+                for profile in self.profiles:
+                    stats.add(profile)
+            stats.dump_stats(path)
+            logger.warning(f"Slow {self.name} request took {elapsed_ms:.0f}ms, profile written to {path}")
+        except Exception as e:
+            logger.error(f"Could not write profile: {e}")
+
+def profile_slow_requests(name):
+    """Decorator: profile the view when PROFILE_SLOW_SEARCH_MS is set"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if PROFILE_SLOW_SEARCH_MS <= 0 or not _profiling.acquire(blocking=False):
+                return view(*args, **kwargs)
+            try:
+                with RequestProfile(name, PROFILE_SLOW_SEARCH_MS) as profile:
+                    g.profile = profile
+                    return view(*args, **kwargs)
+            finally:
+                _profiling.release()
+        return wrapper
+    return decorator
+
+def profiled(fn):
+    """`fn`, profiled as part of the current request if it is being profiled"""
+    profile = g.get('profile') if has_request_context() else None
+    return profile.wrap(fn) if profile else fn
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, holding at most `burst`
+    """
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """
+        Take one token, going into debt if the bucket is empty.
+        Returns how many seconds the caller has to wait before using it.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            if self.tokens >= 0 or self.rate <= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def try_acquire(self, tokens=1):
+        """
+        Take `tokens` tokens if there are that many. Returns 0.0 on success,
+        otherwise how many seconds until they will be available (nothing is
+        taken).
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def refund(self, tokens=1):
+        """Give back reserved tokens the caller ended up not using"""
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + tokens)
+
+class AdmissionRejected(Exception):
+    """A request turned away by admission control; maps to `status` with Retry-After"""
+    status = 503
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+class RateLimited(AdmissionRejected):
+    status = 429
+
+class Overloaded(AdmissionRejected):
+    status = 503
+
+def parse_rate_limits(spec):
+    """
+    {name: (rate, burst)} from "search=1/10,proxy=5/20": tokens per second
+    and bucket size per endpoint group. A rate of 0 disables the limit.
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        try:
+            name, value = item.split('=', 1)
+            rate, burst = value.split('/', 1)
+            limits[name.strip()] = (float(rate), float(burst))
+        except ValueError:
+            logger.error(f"Ignoring malformed rate limit {item!r}")
+    return limits
+
+class RateLimiter:
+    """
+    Token buckets per (client, endpoint group) and per endpoint group.
+    Buckets live in this worker only, so with several gunicorn workers a
+    client can get up to one budget per worker; the least recently seen
+    clients are forgotten beyond `max_clients` buckets.
+    """
+    def __init__(self, client_limits, endpoint_limits, max_clients=10000):
+        self.client_limits = client_limits
+        self.endpoint_limits = endpoint_limits
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.clients = OrderedDict()  # (client, endpoint) -> TokenBucket
+        self.endpoints = {
+            name: TokenBucket(rate, burst) for name, (rate, burst) in endpoint_limits.items() if rate > 0
         }
+        self.counters = {}  # endpoint -> {'admitted', 'client_limited', 'endpoint_limited'}
 
-    def preprocess_search_query(self, query):
+    def _count(self, endpoint, counter):
+        with self.lock:
+            counters = self.counters.setdefault(endpoint, {'admitted': 0, 'client_limited': 0, 'endpoint_limited': 0})
+            counters[counter] += 1
+
+    def _client_bucket(self, client, endpoint):
+        rate, burst = self.client_limits.get(endpoint, (0, 0))
+        if rate <= 0:
+            return None
+        key = (client, endpoint)
+        with self.lock:
+            bucket = self.clients.get(key)
+            if bucket is None:
+                bucket = self.clients[key] = TokenBucket(rate, burst)
+                while len(self.clients) > self.max_clients:
+                    self.clients.popitem(last=False)
+            else:
+                self.clients.move_to_end(key)
+        return bucket
+
+    def check(self, client, endpoint, cost=1):
         """
-        Preprocess search query to handle common misspellings and improve results
+        Take `cost` tokens for `client` on `endpoint`; raises RateLimited if
+        over budget. A cost above a bucket's burst takes the whole burst, so
+        large requests are throttled rather than impossible.
         """
-        # Common misspellings and corrections
-        corrections = {
-            'narto': 'naruto',
-            'naroto': 'naruto', 
-            'naurto': 'naruto',
-            'lord of ring': 'lord of rings',
-            'lord rings': 'lord of rings',
-            'jumanji jungle': 'jumanji welcome to the jungle',
-            'last us': 'last of us',
-            'sand man': 'sandman',
-            'avengers end game': 'avengers endgame',
-            'spiderman': 'spider-man',
-            'batman vs superman': 'batman v superman',
-            'starwars': 'star wars',
-            'harrypotter': 'harry potter',
-            'gameofthrones': 'game of thrones',
-            'breakingbad': 'breaking bad',
-            'walkingdead': 'walking dead'
+        client_bucket = self._client_bucket(client, endpoint)
+        client_cost = min(cost, client_bucket.burst) if client_bucket else 0
+        wait_for = client_bucket.try_acquire(client_cost) if client_bucket else 0.0
+        if wait_for:
+            self._count(endpoint, 'client_limited')
+            ADMISSION_REJECTED.labels(endpoint, 'client_rate').inc()
+            raise RateLimited(f"Too many {endpoint} requests, slow down", wait_for)
+
+        bucket = self.endpoints.get(endpoint)
+        wait_for = bucket.try_acquire(min(cost, bucket.burst)) if bucket else 0.0
+        if wait_for:
+            if client_bucket:
+                client_bucket.refund(client_cost)
+            self._count(endpoint, 'endpoint_limited')
+            ADMISSION_REJECTED.labels(endpoint, 'endpoint_rate').inc()
+            raise RateLimited(f"The server is receiving too many {endpoint} requests", wait_for)
+        self._count(endpoint, 'admitted')
+
+    def stats(self):
+        with self.lock:
+            return {
+                'client_limits': {name: {'rate': rate, 'burst': burst} for name, (rate, burst) in self.client_limits.items()},
+                'endpoint_limits': {name: {'rate': rate, 'burst': burst} for name, (rate, burst) in self.endpoint_limits.items()},
+                'tracked_clients': len(self.clients),
+                'endpoints': {name: dict(counters) for name, counters in self.counters.items()},
+            }
+
+class AdmissionGate:
+    """
+    Caps how many units of some expensive work run at once in this worker.
+    Up to `queue_size` callers may wait, each for at most `queue_timeout`
+    seconds, for a slot; anyone beyond that is rejected with Overloaded
+    straight away rather than left to pile up.
+    """
+    def __init__(self, name, limit, queue_size, queue_timeout, retry_after=5):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.counters = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timeouts': 0, 'peak_active': 0, 'peak_waiting': 0}
+
+    def saturated(self):
+        """True if new work would have to queue"""
+        with self.condition:
+            return self.limit > 0 and self.active >= self.limit
+
+    def _reject(self, counter, message):
+        self.counters[counter] += 1
+        ADMISSION_REJECTED.labels(self.name, counter).inc()
+        raise Overloaded(message, self.retry_after)
+
+    @contextmanager
+    def enter(self):
+        if self.limit <= 0:
+            yield
+            return
+        with self.condition:
+            if self.active >= self.limit:
+                if self.waiting >= self.queue_size:
+                    self._reject('rejected', f"Server is busy ({self.name}), try again shortly")
+                self.counters['queued'] += 1
+                self.waiting += 1
+                ADMISSION_QUEUE_DEPTH.labels(self.name).inc()
+                self.counters['peak_waiting'] = max(self.counters['peak_waiting'], self.waiting)
+                try:
+                    if not self.condition.wait_for(lambda: self.active < self.limit, self.queue_timeout):
+                        self._reject('timeouts', f"Server is busy ({self.name}), try again shortly")
+                finally:
+                    self.waiting -= 1
+                    ADMISSION_QUEUE_DEPTH.labels(self.name).dec()
+            self.active += 1
+            ADMISSION_ACTIVE.labels(self.name).inc()
+            self.counters['admitted'] += 1
+            self.counters['peak_active'] = max(self.counters['peak_active'], self.active)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                ADMISSION_ACTIVE.labels(self.name).dec()
+                self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self.counters)
+            stats.update(active=self.active, queue_depth=self.waiting, limit=self.limit,
+                         queue_size=self.queue_size, queue_timeout=self.queue_timeout)
+        return stats
+
+class SqliteConnections:
+    """
+    Per-thread connections to a sqlite file shared by every gunicorn worker.
+    WAL lets readers carry on while another worker writes; `on_connect` is
+    called with each new connection (to register functions, for example).
+    """
+    def __init__(self, db_path, on_connect=None):
+        self.db_path = db_path
+        self.on_connect = on_connect
+        self.local = threading.local()
+
+    def get(self):
+        """This thread's connection, opened on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if self.on_connect:
+                self.on_connect(conn)
+            self.local.conn = conn
+        return conn
+
+class ResultCache:
+    """
+    Two-tier cache for JSON-serialisable values: an in-process LRU bounded by
+    entry count and approximate size, backed by an optional sqlite file that
+    every gunicorn worker can read.
+
+    Entries are fresh for `ttl` seconds and may then be served stale for a
+    further `stale_ttl` seconds while a background refresh runs.
+    """
+    def __init__(self, name, ttl=300, stale_ttl=0, max_entries=512, max_bytes=32 * 1024 * 1024, db_path=None):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, stored_at, size)
+        self.bytes = 0
+        self.refreshing = set()
+        self.connections = SqliteConnections(db_path)
+        self.writes = 0
+        self.counters = {
+            'hits': 0,
+            'disk_hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expired': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
         }
-        
-        processed = query.lower().strip()
-        
-        # Apply corrections
-        for wrong, correct in corrections.items():
-            if wrong in processed:
-                processed = processed.replace(wrong, correct)
-                
-        return processed
+        if self.db_path:
+            try:
+                self.connections.get().execute(
+                    'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)'
+                )
+            except sqlite3.Error as e:
+                logger.error(f"Disabling disk tier for {name} cache: {e}")
+                self.db_path = None
 
-    def scrape_site(self, query, category=None):
+    def _state(self, stored_at, now):
+        age = now - stored_at
+        if age <= self.ttl:
+            return 'fresh'
+        if age <= self.ttl + self.stale_ttl:
+            return 'stale'
+        return None
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def get(self, key, count_hits=True, count_misses=True):
         """
-        Scrape torrent data from The Pirate Bay
+        Look up `key`. Returns (value, state) where state is 'fresh', 'stale'
+        or None on a miss. Callers that look one request up more than once
+        turn the hit/miss counters off for all but one of the lookups.
         """
-        results = []
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, stored_at, size = entry
+                state = self._state(stored_at, now)
+                if state is not None:
+                    self.entries.move_to_end(key)
+                    if count_hits:
+                        self.counters['hits' if state == 'fresh' else 'stale_hits'] += 1
+                        CACHE_LOOKUPS.labels(self.name, 'hit' if state == 'fresh' else 'stale').inc()
+                    return value, state
+                del self.entries[key]
+                self.bytes -= size
+                self.counters['expired'] += 1
+
+        if self.db_path:
+            try:
+                row = self.connections.get().execute('SELECT value, stored_at FROM cache WHERE key = ?', (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"{self.name} cache read error: {e}")
+                row = None
+            if row is not None:
+                state = self._state(row[1], now)
+                if state is not None:
+                    value = json.loads(row[0])
+                    self._store_memory(key, value, row[1], len(row[0]))
+                    if count_hits:
+                        self._count('disk_hits' if state == 'fresh' else 'stale_hits')
+                        CACHE_LOOKUPS.labels(self.name, 'hit' if state == 'fresh' else 'stale').inc()
+                    return value, state
+
+        if count_misses:
+            self._count('misses')
+            CACHE_LOOKUPS.labels(self.name, 'miss').inc()
+        return None, None
+
+    def peek(self, key):
+        """get() without touching the hit/miss counters"""
+        return self.get(key, count_hits=False, count_misses=False)
+
+    def set(self, key, value):
+        """Store `value` under `key` in both tiers"""
+        payload = json.dumps(value)
+        stored_at = time.time()
+        self._store_memory(key, value, stored_at, len(payload))
+
+        if self.db_path:
+            try:
+                db = self.connections.get()
+                db.execute('INSERT OR REPLACE INTO cache (key, value, stored_at) VALUES (?, ?, ?)', (key, payload, stored_at))
+                self.writes += 1
+                if self.writes % 100 == 0:
+                    db.execute('DELETE FROM cache WHERE stored_at < ?', (stored_at - self.ttl - self.stale_ttl,))
+            except sqlite3.Error as e:
+                logger.error(f"{self.name} cache write error: {e}")
+
+    def _store_memory(self, key, value, stored_at, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self.entries[key] = (value, stored_at, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.counters['evictions'] += 1
+
+    def refresh(self, key, loader):
+        """
+        Recompute `key` with `loader()` on a background thread. Only one
+        refresh per key runs at a time; empty results are not stored.
+        """
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+            self.counters['refreshes'] += 1
+
+        def run():
+            try:
+                value = loader()
+                if value:
+                    self.set(key, value)
+            except Exception as e:
+                logger.error(f"Error refreshing {self.name} cache entry {key!r}: {e}")
+                self._count('refresh_errors')
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.bytes
+        lookups = stats['hits'] + stats['disk_hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 3) if lookups else None
+        stats['disk_tier'] = bool(self.db_path)
+        return stats
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls so only one of them does the work.
+
+    Within a worker, callers that arrive while a call for the same key is
+    running wait for its result. Across gunicorn workers (when `lock_dir`
+    is set) the running call holds an flock on a per-key file; callers in
+    other workers wait for it and then try `lookup()`, which should read
+    what the first call stored in a shared cache, before doing the work
+    themselves.
+    """
+    def __init__(self, name, lock_dir=None, wait=30, poll_interval=0.05):
+        self.name = name
+        self.lock_dir = lock_dir
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.flights = {}  # key -> Future
+        self.counters = {
+            'calls': 0,
+            'executed': 0,
+            'coalesced': 0,
+            'shared': 0,
+            'lock_waits': 0,
+            'lock_timeouts': 0,
+            'errors': 0,
+        }
+        if self.lock_dir:
+            try:
+                os.makedirs(self.lock_dir, exist_ok=True)
+            except OSError as e:
+                logger.error(f"Disabling cross-worker coalescing for {name}: {e}")
+                self.lock_dir = None
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def running(self, key):
+        """True if a call for `key` is in flight in this worker"""
+        with self.lock:
+            return key in self.flights
+
+    def do(self, key, fn, lookup=None):
+        """Return fn(), sharing the result with concurrent calls for `key`"""
+        with self.lock:
+            self.counters['calls'] += 1
+            future = self.flights.get(key)
+            leader = future is None
+            if leader:
+                future = self.flights[key] = Future()
+            else:
+                self.counters['coalesced'] += 1
+        if not leader:
+            return future.result()
 
         try:
-            # The Pirate Bay search URLs
-            search_urls = [
-                f"https://thepiratebay.org/search/{query}/1/99/0",
-                f"https://piratebay.party/search/{query}/1/99/0",
-                f"https://tpb.party/search/{query}/1/99/0",
-            ]
+            value = self._run(key, fn, lookup)
+        except Exception as e:
+            self._count('errors')
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self.lock:
+                self.flights.pop(key, None)
 
-            for url in search_urls:
+    def _execute(self, fn, lookup):
+        # A call that finished just before this one started may already have
+        # stored the result
+        if lookup is not None:
+            value = lookup()
+            if value is not None:
+                self._count('shared')
+                return value
+        self._count('executed')
+        return fn()
+
+    def _run(self, key, fn, lookup):
+        """Run `fn` under the cross-worker lock for `key`, if enabled"""
+        if not self.lock_dir:
+            return self._execute(fn, lookup)
+
+        path = os.path.join(self.lock_dir, f"{self.name}-{hashlib.sha1(key.encode()).hexdigest()}.lock")
+        with open(path, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is on it. Poll rather than block so a
+                # gevent worker keeps serving its other requests meanwhile.
+                self._count('lock_waits')
+                if not self._wait_for_lock(f):
+                    self._count('lock_timeouts')
+                    return self._execute(fn, lookup)
+
+            try:
+                return self._execute(fn, lookup)
+            finally:
+                # Later callers start a new file; anyone already waiting on
+                # this one gets the lock next and finds the stored result
                 try:
-                    response = requests.get(url, headers=self.headers, timeout=15)
-                    if response.status_code == 200:
-                        soup = BeautifulSoup(response.content, 'html.parser')
-                        site_results = self.parse_piratebay_results(soup, url)
-                        results.extend(site_results)
-                        if site_results:  # If we got results, no need to try other mirrors
-                            break
+                    if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                        os.unlink(path)
+                except OSError:
+                    pass
 
-                    # Be respectful - add delay between requests
-                    time.sleep(2)
+    def _wait_for_lock(self, f):
+        deadline = time.monotonic() + self.wait
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                pass
+        return False
 
-                except Exception as e:
-                    logger.error(f"Error scraping {url}: {e}")
-                    continue
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['in_flight'] = len(self.flights)
+        saved = stats['coalesced'] + stats['shared']
+        stats['coalescing_ratio'] = round(saved / stats['calls'], 3) if stats['calls'] else None
+        stats['cross_worker'] = bool(self.lock_dir)
+        return stats
 
-        except Exception as e:
-            logger.error(f"General scraping error: {e}")
+class HttpCache:
+    """
+    Shared cache of upstream HTTP responses, kept in a sqlite file that
+    every gunicorn worker opens. Freshness follows Cache-Control (s-maxage,
+    max-age, no-cache, no-store, private) and Expires; ETag and
+    Last-Modified are kept so stale entries can be revalidated with a
+    conditional request instead of downloaded again.
+    """
+    def __init__(self, db_path, max_entry_bytes=1024 * 1024, max_bytes=256 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_entry_bytes = max_entry_bytes
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connections = SqliteConnections(db_path)
+        self.writes = 0
+        self.counters = {
+            'hits': 0,
+            'revalidated': 0,
+            'misses': 0,
+            'stored': 0,
+            'uncacheable': 0,
+        }
+        try:
+            self.connections.get().execute(
+                'CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, status INTEGER NOT NULL, '
+                'headers TEXT NOT NULL, body BLOB NOT NULL, size INTEGER NOT NULL, '
+                'stored_at REAL NOT NULL, expires_at REAL NOT NULL)'
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Disabling HTTP cache: {e}")
+            self.db_path = None
 
-        return results
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
 
-    def parse_piratebay_results(self, soup, source_url):
+    @staticmethod
+    def lifetime(headers):
         """
-        Parse Pirate Bay HTML and extract torrent information
+        Seconds a response may be served without revalidation, 0 if it must
+        always be revalidated, or None if a shared cache must not store it
         """
-        results = []
+        directives = {}
+        for part in headers.get('Cache-Control', '').split(','):
+            name, _, value = part.strip().partition('=')
+            if name:
+                directives[name.lower()] = value.strip('"')
+        if 'no-store' in directives or 'private' in directives:
+            return None
+        if headers.get('Vary', '').strip().lower() not in ('', 'accept-encoding'):
+            return None
+        has_validators = bool(headers.get('ETag') or headers.get('Last-Modified'))
+        if 'no-cache' in directives:
+            return 0 if has_validators else None
+        for name in ('s-maxage', 'max-age'):
+            if directives.get(name, '').isdigit():
+                return int(directives[name])
+        if headers.get('Expires'):
+            try:
+                expires = parsedate_to_datetime(headers['Expires']).timestamp()
+                date = parsedate_to_datetime(headers['Date']).timestamp() if headers.get('Date') else time.time()
+                return max(0, int(expires - date))
+            except (TypeError, ValueError):
+                return 0
+        return 0 if has_validators else None
+
+    def get(self, url):
+        """
+        Stored response for `url` as a dict (status, headers, body, age,
+        fresh), or None
+        """
+        try:
+            row = self.connections.get().execute(
+                'SELECT status, headers, body, stored_at, expires_at FROM responses WHERE url = ?', (url,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"HTTP cache read error: {e}")
+            row = None
+        if row is None:
+            self._count('misses')
+            CACHE_LOOKUPS.labels('proxy', 'miss').inc()
+            return None
+        now = time.time()
+        entry = {
+            'status': row[0],
+            # Header names keep the upstream's spelling, so look them up case-insensitively
+            'headers': CaseInsensitiveDict(json.loads(row[1])),
+            'body': row[2],
+            'age': int(now - row[3]),
+            'fresh': now < row[4],
+        }
+        if entry['fresh']:
+            self._count('hits')
+        CACHE_LOOKUPS.labels('proxy', 'hit' if entry['fresh'] else 'stale').inc()
+        return entry
+
+    @staticmethod
+    def validators(entry):
+        """Conditional request headers for revalidating `entry`"""
+        headers = {}
+        if entry['headers'].get('ETag'):
+            headers['If-None-Match'] = entry['headers']['ETag']
+        if entry['headers'].get('Last-Modified'):
+            headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+        return headers
+
+    def store(self, url, status, headers, body):
+        """Store a complete response if its headers allow it. Returns True if stored."""
+        lifetime = self.lifetime(headers)
+        if status != 200 or lifetime is None or len(body) > self.max_entry_bytes:
+            self._count('uncacheable')
+            return False
+        now = time.time()
+        try:
+            db = self.connections.get()
+            db.execute(
+                'INSERT OR REPLACE INTO responses (url, status, headers, body, size, stored_at, expires_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, status, json.dumps(dict(headers)), body, len(body), now, now + lifetime)
+            )
+            self.writes += 1
+            if self.writes % 50 == 0:
+                self._trim(db)
+        except sqlite3.Error as e:
+            logger.error(f"HTTP cache write error: {e}")
+            return False
+        self._count('stored')
+        return True
+
+    def revalidated(self, url, entry, headers):
+        """
+        Apply a 304 Not Modified: refresh the stored headers and expiry.
+        Returns the updated entry.
+        """
+        merged = CaseInsensitiveDict(entry['headers'])
+        for name in ('Cache-Control', 'Expires', 'Date', 'ETag', 'Last-Modified'):
+            if headers.get(name):
+                merged[name] = headers[name]
+        lifetime = self.lifetime(merged) or 0
+        now = time.time()
+        try:
+            self.connections.get().execute(
+                'UPDATE responses SET headers = ?, stored_at = ?, expires_at = ? WHERE url = ?',
+                (json.dumps(dict(merged)), now, now + lifetime, url)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"HTTP cache write error: {e}")
+        self._count('revalidated')
+        return dict(entry, headers=merged, age=0, fresh=True)
+
+    def _trim(self, db):
+        # Drop the least recently stored responses beyond the size budget
+        db.execute(
+            'DELETE FROM responses WHERE url IN (SELECT url FROM (SELECT url, SUM(size) OVER '
+            '(ORDER BY stored_at DESC) AS total FROM responses) WHERE total > ?)',
+            (self.max_bytes,)
+        )
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        try:
+            entries, size = self.connections.get().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+            stats['entries'] = entries
+            stats['bytes'] = size
+        except sqlite3.Error:
+            pass
+        return stats
+
+class SearchIndex:
+    """
+    Local full-text index of every parsed search result, keyed by infohash
+    and kept in a sqlite file shared by all workers. Titles and categories
+    go into an FTS5 table, so searching and category filtering both use the
+    index. Matches are ranked by BM25 with a bonus for well-seeded torrents.
+    Torrents not seen for `max_age` seconds, and the least recently seen
+    ones beyond `max_entries`, are pruned as new pages come in.
+    """
+    def __init__(self, db_path, seeder_weight=1.0, max_entries=500000, max_age=90 * 86400):
+        self.db_path = db_path
+        self.seeder_weight = seeder_weight
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.connections = SqliteConnections(
+            db_path, on_connect=lambda conn: conn.create_function('log1p', 1, math.log1p, deterministic=True)
+        )
+        # One writer thread per process keeps indexing off the request path
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-index')
+        self.counters = {
+            'indexed': 0,
+            'pruned': 0,
+            'searches': 0,
+            'hits': 0,
+            'write_errors': 0,
+        }
+        try:
+            self.connections.get().executescript(
+                """
+                CREATE TABLE IF NOT EXISTS torrents (
+                    infohash TEXT PRIMARY KEY, title TEXT NOT NULL, category TEXT NOT NULL,
+                    size TEXT, seeders INTEGER NOT NULL, leechers INTEGER NOT NULL,
+                    result TEXT NOT NULL, updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS torrents_updated_at ON torrents (updated_at);
+                CREATE VIRTUAL TABLE IF NOT EXISTS torrents_fts USING fts5(
+                    title, category, content='torrents', tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS torrents_ai AFTER INSERT ON torrents BEGIN
+                    INSERT INTO torrents_fts (rowid, title, category) VALUES (new.rowid, new.title, new.category);
+                END;
+                CREATE TRIGGER IF NOT EXISTS torrents_ad AFTER DELETE ON torrents BEGIN
+                    INSERT INTO torrents_fts (torrents_fts, rowid, title, category) VALUES ('delete', old.rowid, old.title, old.category);
+                END;
+                CREATE TRIGGER IF NOT EXISTS torrents_au AFTER UPDATE OF title, category ON torrents BEGIN
+                    INSERT INTO torrents_fts (torrents_fts, rowid, title, category) VALUES ('delete', old.rowid, old.title, old.category);
+                    INSERT INTO torrents_fts (rowid, title, category) VALUES (new.rowid, new.title, new.category);
+                END;
+                """
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Disabling search index: {e}")
+            self.db_path = None
+
+    def _count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] += n
+
+    def add(self, results):
+        """Index a page of results in the background"""
+        if self.db_path and results:
+            self.writer.submit(self._write, list(results))
+
+    def _write(self, results):
+        rows = []
+        for result in results:
+            infohash = extract_infohash(result.get('magnet_link'))
+            if not infohash:
+                continue
+            rows.append((
+                infohash, result['title'], result['category'], result.get('size'),
+                parse_count(result.get('seeders')), parse_count(result.get('leechers')),
+                json.dumps(result), time.time()
+            ))
+        if not rows:
+            return
+        try:
+            db = self.connections.get()
+            db.execute('BEGIN IMMEDIATE')
+            # Upsert keeps the rowid, so unchanged titles don't touch the FTS table
+            db.executemany(
+                'INSERT INTO torrents (infohash, title, category, size, seeders, leechers, result, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (infohash) DO UPDATE SET '
+                'title = excluded.title, category = excluded.category, size = excluded.size, '
+                'seeders = excluded.seeders, leechers = excluded.leechers, '
+                'result = excluded.result, updated_at = excluded.updated_at',
+                rows
+            )
+            self.writes += 1
+            if self.writes % 50 == 0:
+                self._prune(db)
+            db.execute('COMMIT')
+            self._count('indexed', len(rows))
+        except sqlite3.Error as e:
+            logger.error(f"Search index write error: {e}")
+            self._count('write_errors')
+            try:
+                db.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+
+    def _prune(self, db):
+        # The delete trigger keeps the FTS table in step
+        pruned = db.execute('DELETE FROM torrents WHERE updated_at < ?', (time.time() - self.max_age,)).rowcount
+        pruned += db.execute(
+            'DELETE FROM torrents WHERE rowid IN (SELECT rowid FROM torrents ORDER BY updated_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        ).rowcount
+        self._count('pruned', pruned)
+
+    @staticmethod
+    def match_expression(query, categories=None):
+        """FTS5 query for the words of `query`, optionally limited to categories"""
+        words = re.findall(r'\w+', query.lower())
+        if not words:
+            return None
+        expression = '{title}: (' + ' '.join(f'"{word}"' for word in words) + ')'
+        if categories and 'all' not in categories:
+            names = ' OR '.join(f'"{c.lower()}"' for c in categories if re.fullmatch(r'\w+', c))
+            if names:
+                expression += f' AND {{category}}: ({names})'
+        return expression
+
+    def search(self, query, categories=None, limit=100):
+        """Indexed results for `query`, best first"""
+        if not self.db_path:
+            return []
+        expression = self.match_expression(query, categories)
+        if expression is None:
+            return []
+        self._count('searches')
+        try:
+            rows = self.connections.get().execute(
+                'SELECT t.result FROM torrents_fts JOIN torrents t ON t.rowid = torrents_fts.rowid '
+                'WHERE torrents_fts MATCH ? '
+                'ORDER BY bm25(torrents_fts, 1.0, 0.0) - ? * log1p(t.seeders) LIMIT ?',
+                (expression, self.seeder_weight, limit)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Search index query error: {e}")
+            return []
+        if rows:
+            self._count('hits')
+        return [json.loads(row[0]) for row in rows]
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        if self.db_path:
+            try:
+                stats['entries'] = self.connections.get().execute('SELECT COUNT(*) FROM torrents').fetchone()[0]
+            except sqlite3.Error:
+                pass
+        return stats
+
+# Patterns used while parsing search result rows, compiled once
+MAGNET_HREF_RE = re.compile(r'^magnet:')
+INFOHASH_RE = re.compile(r'xt=urn:btih:([0-9a-fA-F]{40}|[A-Za-z2-7]{32})(?![0-9A-Za-z])')
+NON_DIGIT_RE = re.compile(r'[^\d]')
+SIZE_PATTERNS = [
+    re.compile(r'Size[\s:]+([0-9.]+\s*[KMGT]?i?B)', re.IGNORECASE),
+    re.compile(r'([0-9.]+\s*[KMGT]?i?B)', re.IGNORECASE),
+    re.compile(r'Size\s*([0-9.]+\s*[KMGT]B)', re.IGNORECASE),
+    re.compile(r',\s*Size\s+([^,]+)', re.IGNORECASE),
+]
+UPLOAD_PATTERNS = [
+    re.compile(r'Uploaded[\s:]+([^,]+)', re.IGNORECASE),
+    re.compile(r'Uploaded\s+([^,]+),', re.IGNORECASE),
+    re.compile(r'(\d{2}-\d{2}\s+\d{4})', re.IGNORECASE),
+    re.compile(r'(\d{4}-\d{2}-\d{2})', re.IGNORECASE),
+    re.compile(r'(Today|Yesterday|\d+\s+mins?\s+ago|\d+\s+hours?\s+ago)', re.IGNORECASE),
+]
+FONT_SIZE_RE = re.compile(r'([0-9.]+\s*[KMGT]?i?B)', re.IGNORECASE)
+FONT_DATE_RE = re.compile(r'(\d{2}-\d{2}\s+\d{4}|\d{4}-\d{2}-\d{2}|Today|Yesterday)', re.IGNORECASE)
+
+def extract_infohash(magnet_link):
+    """
+    BitTorrent infohash from a magnet link as 40 lowercase hex characters,
+    or None. Base32 hashes are converted to hex.
+    """
+    match = INFOHASH_RE.search(magnet_link or '')
+    if not match:
+        return None
+    infohash = match.group(1)
+    if len(infohash) == 32:
+        infohash = base64.b32decode(infohash.upper()).hex()
+    return infohash.lower()
+
+class RawRow:
+    """
+    The pieces of one search result row a parser engine extracts before
+    they are turned into a result dict. `font_texts` is a callable so the
+    font elements are only collected when the description is incomplete.
+    """
+    __slots__ = ('title', 'href', 'magnet_link', 'desc_text', 'font_texts', 'seeders_text', 'leechers_text')
+
+    def __init__(self, title, href, magnet_link, desc_text, font_texts, seeders_text, leechers_text):
+        self.title = title
+        self.href = href
+        self.magnet_link = magnet_link
+        self.desc_text = desc_text
+        self.font_texts = font_texts
+        self.seeders_text = seeders_text
+        self.leechers_text = leechers_text
+
+# Normalising display sizes and upload dates into numbers
+SIZE_VALUE_RE = re.compile(r'([0-9]+(?:\.[0-9]+)?)\s*([KMGTP]?)(i?)B', re.IGNORECASE)
+UPLOADED_RE = [
+    (re.compile(r'(\d{4})-(\d{2})-(\d{2})'), lambda m, now: datetime(int(m[1]), int(m[2]), int(m[3]), tzinfo=timezone.utc)),
+    (re.compile(r'(\d{2})-(\d{2})\s+(\d{4})'), lambda m, now: datetime(int(m[3]), int(m[1]), int(m[2]), tzinfo=timezone.utc)),
+    (re.compile(r'(\d{2})-(\d{2})\s+(\d{2}):(\d{2})'), lambda m, now: datetime(now.year, int(m[1]), int(m[2]), int(m[3]), int(m[4]), tzinfo=timezone.utc)),
+    (re.compile(r'today(?:\s+(\d{2}):(\d{2}))?', re.IGNORECASE), lambda m, now: now.replace(hour=int(m[1] or 0), minute=int(m[2] or 0), second=0, microsecond=0)),
+    (re.compile(r'(?:y-day|yesterday)(?:\s+(\d{2}):(\d{2}))?', re.IGNORECASE), lambda m, now: (now - timedelta(days=1)).replace(hour=int(m[1] or 0), minute=int(m[2] or 0), second=0, microsecond=0)),
+    (re.compile(r'(\d+)\s+mins?\s+ago', re.IGNORECASE), lambda m, now: now - timedelta(minutes=int(m[1]))),
+    (re.compile(r'(\d+)\s+hours?\s+ago', re.IGNORECASE), lambda m, now: now - timedelta(hours=int(m[1]))),
+]
+
+def parse_size_bytes(size):
+    """'1.5 GiB' -> 1610612736; None if the size can't be read"""
+    match = SIZE_VALUE_RE.search(size or '')
+    if not match:
+        return None
+    base = 1024 if match.group(3) or match.group(2) == '' else 1000
+    return int(float(match.group(1)) * base ** ' KMGTP'.index(match.group(2).upper() or ' '))
+
+def parse_uploaded_ts(uploaded, now=None):
+    """Unix timestamp for a Pirate Bay upload date ('03-14 2021', 'Today 12:34', ...), or None"""
+    now = now or datetime.now(timezone.utc)
+    for pattern, build in UPLOADED_RE:
+        match = pattern.search(uploaded or '')
+        if match:
+            try:
+                return build(match, now).timestamp()
+            except ValueError:
+                return None
+    return None
+
+def parse_count(text):
+    try:
+        return int(NON_DIGIT_RE.sub('', str(text)) or 0)
+    except ValueError:
+        return 0
+
+class TorrentResult:
+    """
+    One search result with numeric fields normalised: size in bytes, upload
+    date as a timestamp, integer peer counts and the magnet link's infohash.
+    `sources` lists every page the torrent was seen on and `scraped_at`
+    when its peer counts were read. Serialised with to_dict() for caches
+    and responses.
+    """
+    __slots__ = ('id', 'title', 'magnet_link', 'infohash', 'details_url', 'size', 'size_bytes',
+                 'seeders', 'leechers', 'uploaded', 'uploaded_ts', 'source', 'sources', 'scraped_at', 'category')
+
+    def __init__(self, id, title, magnet_link, details_url, size, seeders, leechers, uploaded, source, category,
+                 infohash=None, size_bytes=None, uploaded_ts=None, sources=None, scraped_at=None):
+        self.id = id
+        self.title = title
+        self.magnet_link = magnet_link
+        self.infohash = infohash or extract_infohash(magnet_link)
+        self.details_url = details_url
+        self.size = size
+        self.size_bytes = size_bytes if size_bytes is not None else parse_size_bytes(size)
+        self.seeders = parse_count(seeders)
+        self.leechers = parse_count(leechers)
+        self.uploaded = uploaded
+        self.uploaded_ts = uploaded_ts if uploaded_ts is not None else parse_uploaded_ts(uploaded)
+        self.source = source
+        self.sources = sources or [source]
+        self.scraped_at = scraped_at or time.time()
+        self.category = category
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a result from to_dict() output (or a cached result in the older string format)"""
+        return cls(
+            data.get('id'), data.get('title', ''), data.get('magnet_link', ''), data.get('details_url'),
+            data.get('size', 'Unknown'), data.get('seeders'), data.get('leechers'), data.get('uploaded', 'Unknown'),
+            data.get('source'), data.get('category', 'Other'), data.get('infohash'), data.get('size_bytes'),
+            data.get('uploaded_ts'), data.get('sources'), data.get('scraped_at')
+        )
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class ResultMerger:
+    """
+    Merges results from several mirrors or pages in one pass, using a hash
+    index on infohash (title and size for results without a magnet link).
+    Duplicates keep the freshest peer counts, fill in missing fields and
+    add their source to `sources`; merged results are renumbered so ids
+    are unique.
+    """
+    def __init__(self):
+        self.index = {}
+        self.results = []
+        self.duplicates = 0
+
+    @staticmethod
+    def key(result):
+        infohash = result.get('infohash') or extract_infohash(result.get('magnet_link'))
+        if infohash:
+            return infohash
+        return ('title', result.get('title', '').lower(), result.get('size'))
+
+    def add(self, result):
+        """
+        Merge `result` in. Returns the merged copy if this is the first time
+        the torrent was seen, otherwise None.
+        """
+        key = self.key(result)
+        existing = self.index.get(key)
+        if existing is None:
+            merged = dict(result, id=len(self.results) + 1)
+            merged['sources'] = list(result.get('sources') or [result.get('source')])
+            self.index[key] = merged
+            self.results.append(merged)
+            return merged
+
+        self.duplicates += 1
+        for source in result.get('sources') or [result.get('source')]:
+            if source not in existing['sources']:
+                existing['sources'].append(source)
+        if (result.get('scraped_at') or 0) >= (existing.get('scraped_at') or 0):
+            existing['seeders'] = result.get('seeders', existing.get('seeders'))
+            existing['leechers'] = result.get('leechers', existing.get('leechers'))
+            existing['scraped_at'] = result.get('scraped_at')
+        for field in ('magnet_link', 'infohash', 'details_url', 'size_bytes', 'uploaded_ts'):
+            if not existing.get(field) and result.get(field):
+                existing[field] = result[field]
+        return None
+
+class SoupParserEngine:
+    """
+    Reference parser built on BeautifulSoup's html.parser. Always available.
+    """
+    name = 'bs4'
+
+    def iter_rows(self, content):
+        """Yield (row_index, RawRow) for every usable row of a search page"""
+        soup = content if isinstance(content, BeautifulSoup) else BeautifulSoup(content, 'html.parser')
 
         # Find the main search results table - look for table with id searchResult or class searchResult
         search_table = soup.find('table', {'id': 'searchResult'}) or soup.find('table', {'class': 'searchResult'})
-        
+
         if not search_table:
             # Try alternative selectors
             search_table = soup.find('table')
-        
+
         if not search_table:
             logger.warning("No search results table found")
-            return results
+            return
 
         # Find all torrent rows, skip the header
         torrent_rows = search_table.find_all('tr')[1:]  # Skip header row
@@ -119,7 +1317,7 @@ class TorrentScraper:
 
                 # First td usually contains category info, second contains name and details
                 name_td = tds[1] if len(tds) > 1 else tds[0]
-                
+
                 # Find the title link - it's usually the first or second link in the name td
                 title_elem = name_td.find('a', {'class': 'detLink'})
                 if not title_elem:
@@ -128,165 +1326,925 @@ class TorrentScraper:
                     if not title_elem:
                         continue
 
-                title = title_elem.get_text().strip()
-                details_url = title_elem.get('href', '')
-                if details_url and not details_url.startswith('http'):
-                    details_url = source_url.split('/search')[0] + details_url
-
                 # Find magnet link - look for magnet: href
-                magnet_link = ''
-                magnet_links = row.find_all('a', href=re.compile(r'^magnet:'))
-                if magnet_links:
-                    magnet_link = magnet_links[0].get('href')
-
-                # Parse description for size and upload info
+                magnet_elem = row.find('a', href=MAGNET_HREF_RE)
                 desc_elem = name_td.find('font', {'class': 'detDesc'})
-                size = 'Unknown'
-                uploaded = 'Unknown'
-                
-                if desc_elem:
-                    desc_text = desc_elem.get_text()
-                    
-                    # Extract size - try multiple patterns
-                    size_patterns = [
-                        r'Size[\s:]+([0-9.]+\s*[KMGT]?i?B)',
-                        r'([0-9.]+\s*[KMGT]?i?B)',
-                        r'Size\s*([0-9.]+\s*[KMGT]B)',
-                        r',\s*Size\s+([^,]+)',
-                    ]
-                    
-                    for pattern in size_patterns:
-                        size_match = re.search(pattern, desc_text, re.IGNORECASE)
-                        if size_match:
-                            size = size_match.group(1).strip()
-                            break
-                    
-                    # Extract upload date - try multiple patterns
-                    upload_patterns = [
-                        r'Uploaded[\s:]+([^,]+)',
-                        r'Uploaded\s+([^,]+),',
-                        r'(\d{2}-\d{2}\s+\d{4})',
-                        r'(\d{4}-\d{2}-\d{2})',
-                        r'(Today|Yesterday|\d+\s+mins?\s+ago|\d+\s+hours?\s+ago)',
-                    ]
-                    
-                    for pattern in upload_patterns:
-                        upload_match = re.search(pattern, desc_text, re.IGNORECASE)
-                        if upload_match:
-                            uploaded = upload_match.group(1).strip()
-                            break
-                
-                # Try alternative extraction from other elements if not found in detDesc
-                if size == 'Unknown' or uploaded == 'Unknown':
-                    # Look for size and date in other font elements or text nodes
-                    all_fonts = name_td.find_all('font')
-                    for font in all_fonts:
-                        font_text = font.get_text()
-                        
-                        # Try to extract size from any font element
-                        if size == 'Unknown':
-                            size_match = re.search(r'([0-9.]+\s*[KMGT]?i?B)', font_text, re.IGNORECASE)
-                            if size_match:
-                                size = size_match.group(1)
-                        
-                        # Try to extract date from any font element
-                        if uploaded == 'Unknown':
-                            date_match = re.search(r'(\d{2}-\d{2}\s+\d{4}|\d{4}-\d{2}-\d{2}|Today|Yesterday)', font_text, re.IGNORECASE)
-                            if date_match:
-                                uploaded = date_match.group(1)
-
-                # Get seeders and leechers from the last two columns
-                seeders = '0'
-                leechers = '0'
-                
-                if len(tds) >= 3:
-                    try:
-                        # Seeders are usually in the second to last column
-                        seeders_td = tds[-2]
-                        seeders = re.sub(r'[^\d]', '', seeders_td.get_text().strip()) or '0'
-                        
-                        # Leechers are usually in the last column
-                        leechers_td = tds[-1]
-                        leechers = re.sub(r'[^\d]', '', leechers_td.get_text().strip()) or '0'
-                    except:
-                        pass
-
-                result = {
-                    'id': i + 1,
-                    'title': title,
-                    'magnet_link': magnet_link,
-                    'details_url': details_url,
-                    'size': size,
-                    'seeders': seeders,
-                    'leechers': leechers,
-                    'uploaded': uploaded,
-                    'source': source_url,
-                    'description': f"Torrent: {title}",
-                    'files': [],
-                    'category': self.guess_category(title)
-                }
-                results.append(result)
-                logger.info(f"Found torrent: {title} | Size: {size} | Uploaded: {uploaded} | Seeders: {seeders}")
+
+                yield i, RawRow(
+                    title_elem.get_text(),
+                    title_elem.get('href', ''),
+                    magnet_elem.get('href') if magnet_elem else '',
+                    desc_elem.get_text() if desc_elem else None,
+                    lambda name_td=name_td: [font.get_text() for font in name_td.find_all('font')],
+                    tds[-2].get_text(),
+                    tds[-1].get_text()
+                )
 
             except Exception as e:
                 logger.error(f"Error parsing row {i}: {e}")
                 continue
 
+class LxmlParserEngine:
+    """
+    Faster parser using lxml with precompiled XPath selectors. Produces the
+    same rows as SoupParserEngine.
+    """
+    name = 'lxml'
+
+    def __init__(self):
+        self.search_table = etree.XPath('//table[@id="searchResult"]')
+        self.search_table_by_class = etree.XPath('//table[contains(concat(" ", normalize-space(@class), " "), " searchResult ")]')
+        self.any_table = etree.XPath('//table')
+        self.det_link = etree.XPath('.//a[contains(concat(" ", normalize-space(@class), " "), " detLink ")]')
+        self.any_link = etree.XPath('.//a')
+        self.magnet_link = etree.XPath('.//a[starts-with(@href, "magnet:")]')
+        self.det_desc = etree.XPath('.//font[contains(concat(" ", normalize-space(@class), " "), " detDesc ")]')
+
+    def iter_rows(self, content):
+        """Yield (row_index, RawRow) for every usable row of a search page"""
+        # Decode the same way BeautifulSoup does so both engines see identical text
+        markup = UnicodeDammit(content, is_html=True).unicode_markup if isinstance(content, bytes) else content
+        try:
+            doc = lxml.html.document_fromstring(markup)
+        except ValueError:
+            # Unicode input with an XML encoding declaration
+            doc = lxml.html.document_fromstring(content)
+        except etree.ParserError:
+            doc = None
+
+        tables = doc is not None and (self.search_table(doc) or self.search_table_by_class(doc) or self.any_table(doc))
+        if not tables:
+            logger.warning("No search results table found")
+            return
+
+        torrent_rows = list(tables[0].iter('tr'))[1:]  # Skip header row
+
+        for i, row in enumerate(torrent_rows):
+            try:
+                tds = list(row.iter('td'))
+                if len(tds) < 4:
+                    continue
+
+                name_td = tds[1]
+                title_elems = self.det_link(name_td) or self.any_link(name_td)
+                if not title_elems:
+                    continue
+                title_elem = title_elems[0]
+
+                magnet_elems = self.magnet_link(row)
+                desc_elems = self.det_desc(name_td)
+
+                yield i, RawRow(
+                    title_elem.text_content(),
+                    title_elem.get('href', ''),
+                    magnet_elems[0].get('href') if magnet_elems else '',
+                    desc_elems[0].text_content() if desc_elems else None,
+                    lambda name_td=name_td: [font.text_content() for font in name_td.iter('font')],
+                    tds[-2].text_content(),
+                    tds[-1].text_content()
+                )
+
+            except Exception as e:
+                logger.error(f"Error parsing row {i}: {e}")
+                continue
+
+PARSER_ENGINES = {
+    'bs4': SoupParserEngine,
+    'lxml': LxmlParserEngine,
+}
+
+def get_parser_engine(name='auto'):
+    """
+    Pick a parser engine by name. 'auto' prefers lxml and falls back to
+    BeautifulSoup when lxml isn't installed.
+    """
+    if name == 'auto':
+        name = 'lxml' if lxml is not None else 'bs4'
+    if name == 'lxml' and lxml is None:
+        logger.warning("lxml is not installed, falling back to the BeautifulSoup parser")
+        name = 'bs4'
+    if name not in PARSER_ENGINES:
+        raise ValueError(f"Unknown parser engine: {name}")
+    return PARSER_ENGINES[name]()
+
+# Title keywords per category, in priority order: a title matching
+# keywords of several categories gets the first one
+CATEGORY_KEYWORDS = [
+    ('Video', [
+        'movie', 'film', '1080p', '720p', '4k', 'bluray', 'dvd', 'mkv', 'mp4',
+        'avi', 'mov', 'wmv', 'flv', 'webm', 'm4v', 'series', 'episode', 'season',
+        'tv', 'show', 'documentary', 'anime', 'cartoon', 'netflix', 'hulu',
+        'amazon', 'disney', 'hbo', 'streaming', 'webrip', 'brrip', 'hdtv'
+    ]),
+    ('Audio', [
+        'album', 'music', 'mp3', 'flac', 'song', 'band', 'artist', 'soundtrack',
+        'audio', 'wav', 'aac', 'ogg', 'vinyl', 'cd', 'single', 'ep', 'lp',
+        'remix', 'live', 'concert', 'acoustic', 'instrumental'
+    ]),
+    ('Games', [
+        'game', 'pc', 'xbox', 'ps4', 'ps5', 'nintendo', 'crack', 'steam',
+        'gaming', 'console', 'playstation', 'switch', 'repack', 'gog',
+        'origin', 'uplay', 'epic', 'rpg', 'fps', 'mmo', 'indie'
+    ]),
+    ('Applications', [
+        'software', 'app', 'program', 'tool', 'windows', 'mac', 'linux',
+        'application', 'utility', 'portable', 'installer', 'setup', 'patch',
+        'update', 'driver', 'plugin', 'extension', 'addon', 'framework'
+    ]),
+]
+
+TITLE_WORD_RE = re.compile(r'[a-z0-9]+')
+
+class KeywordClassifier:
+    """
+    Title classifier compiled from keyword lists. Every keyword is a single
+    word, so a title is split into words once and each word (or its
+    singular) is looked up in a keyword -> category table. Keywords match
+    whole words only, so 'ep' no longer matches inside 'deep'.
+    """
+    def __init__(self, categories, default='Other'):
+        self.names = [name for name, _ in categories] + [default]
+        self.ranks = {}
+        for rank, (_, keywords) in enumerate(categories):
+            for keyword in keywords:
+                if not TITLE_WORD_RE.fullmatch(keyword):
+                    raise ValueError(f"Category keyword {keyword!r} is not a single lowercase word")
+                self.ranks.setdefault(keyword, rank)
+
+    def _rank(self, title_lower):
+        ranks = self.ranks
+        best = len(self.names) - 1
+        for word in TITLE_WORD_RE.findall(title_lower):
+            rank = ranks.get(word)
+            if rank is None and word.endswith('s'):
+                rank = ranks.get(word[:-1])
+                if rank is None and word.endswith('es'):
+                    rank = ranks.get(word[:-2])
+            if rank is not None and rank < best:
+                best = rank
+                if rank == 0:
+                    break
+        return best
+
+    def classify(self, title):
+        return self.names[self._rank(title.lower())]
+
+    def classify_many(self, titles):
+        """Classify a whole page of titles in one call"""
+        names = self.names
+        rank = self._rank
+        return [names[rank(title.lower())] for title in titles]
+
+def word_alternation(words):
+    """Regex alternation of `words`, longest first, matching whole words only"""
+    alternation = '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+    return r'(?<![a-z0-9])(?:' + alternation + r')(?![a-z0-9])'
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def deletions(word, max_distance):
+    """`word` and every string made by deleting up to `max_distance` of its characters"""
+    found = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))} - found
+        found |= frontier
+    return found
+
+class DeletionIndex:
+    """
+    Symmetric-deletion lookup (as in SymSpell): every vocabulary word is
+    indexed under the strings left after deleting up to `max_distance` of
+    its characters. Two words within that edit distance always share one
+    of those strings, so a lookup costs a few dict probes plus an exact
+    distance check on the handful of candidates, however big the vocabulary.
+    """
+    def __init__(self, words=(), max_distance=1):
+        self.max_distance = max_distance
+        self.keys = {}
+        for word in words:
+            for key in deletions(word, max_distance):
+                self.keys.setdefault(key, set()).add(word)
+
+    def search(self, word, max_distance=None):
+        """(distance, word) pairs within `max_distance`, closest first"""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        candidates = set()
+        for key in deletions(word, max_distance):
+            candidates |= self.keys.get(key, set())
+        found = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(word)) <= max_distance:
+                distance = edit_distance(word, candidate)
+                if distance <= max_distance:
+                    found.append((distance, candidate))
+        return sorted(found)
+
+class QueryCorrector:
+    """
+    Search query spelling fixes. Words of `min_fuzzy_length` to
+    `max_fuzzy_length` characters within `max_distance` edits of exactly
+    one vocabulary word are replaced by it, then known misspelled phrases
+    are corrected in a single regex pass.
+
+    A fuzzy lookup probes len(word) + 1 deletion keys per unit of
+    `max_distance` (so it grows roughly as length ** max_distance) and is
+    still several times slower than the exact lookups; corrected queries are
+    cached, so only the first sight of a query pays for it.
+    """
+    def __init__(self, corrections, vocabulary=(), min_fuzzy_length=6, max_fuzzy_length=24, max_distance=1):
+        self.corrections = {wrong.lower().strip(): right for wrong, right in corrections.items()}
+        self.pattern = re.compile(word_alternation(self.corrections)) if self.corrections else None
+        self.vocabulary = {word.lower() for word in vocabulary}
+        self.index = DeletionIndex(self.vocabulary, max_distance)
+        self.max_distance = max_distance
+        # Longer runs are hashes and codec strings rather than misspelled words
+        self.word_re = re.compile(r'(?<![a-z0-9])[a-z0-9]{%d,%d}(?![a-z0-9])' % (min_fuzzy_length, max_fuzzy_length))
+        # Popular queries repeat, so corrected queries are remembered
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_size = 4096
+
+    def _fuzzy_word(self, match):
+        word = match.group(0)
+        if word in self.vocabulary or word in self.corrections:
+            return word
+        candidates = self.index.search(word, self.max_distance)
+        # Ambiguous matches are left alone
+        if len(candidates) == 1 or (candidates and candidates[0][0] < candidates[1][0]):
+            return candidates[0][1]
+        return word
+
+    def correct(self, query):
+        with self.lock:
+            if query in self.cache:
+                self.cache.move_to_end(query)
+                return self.cache[query]
+        processed = query.lower().strip()
+        if self.vocabulary:
+            processed = self.word_re.sub(self._fuzzy_word, processed)
+        if self.pattern:
+            processed = self.pattern.sub(lambda m: self.corrections[m.group(0)], processed)
+        with self.lock:
+            self.cache[query] = processed
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return processed
+
+def load_query_corrector():
+    """
+    Build the query corrector from the JSON file in CORRECTIONS_FILE
+    (corrections.json next to this module by default)
+    """
+    path = os.environ.get('CORRECTIONS_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corrections.json')
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read query corrections {path}: {e}")
+        data = {}
+    return QueryCorrector(data.get('corrections', {}), data.get('fuzzy_vocabulary', []))
+
+DEFAULT_MIRRORS = [
+    'https://thepiratebay.org',
+    'https://piratebay.party',
+    'https://tpb.party',
+]
+
+def load_mirror_config():
+    """
+    Mirror base URLs from SCRAPER_MIRRORS (comma separated) or from the JSON
+    list in SCRAPER_MIRRORS_FILE, falling back to the built-in list
+    """
+    mirrors = None
+    mirrors_file = os.environ.get('SCRAPER_MIRRORS_FILE')
+    if mirrors_file:
+        try:
+            with open(mirrors_file) as f:
+                mirrors = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read mirror config {mirrors_file}: {e}")
+    elif os.environ.get('SCRAPER_MIRRORS'):
+        mirrors = os.environ['SCRAPER_MIRRORS'].split(',')
+
+    mirrors = [m.strip().rstrip('/') for m in mirrors or [] if m.strip()]
+    return mirrors or list(DEFAULT_MIRRORS)
+
+class MirrorRegistry:
+    """
+    Rolling health for each mirror. Orders mirrors fastest-healthy-first and
+    trips a circuit breaker after `failure_threshold` consecutive failures.
+    Tripped mirrors are skipped until a background probe (or, once
+    `cooldown` seconds have passed, a live request) succeeds again.
+    """
+    def __init__(self, urls, window=20, failure_threshold=3, cooldown=60, probe_interval=30):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self.lock = threading.Lock()
+        self.mirrors = OrderedDict((urlparse(url).netloc, self._new_state(url)) for url in urls)
+        self.prober_pid = None
+        self.default_latency = 1.0
+
+    def _new_state(self, url):
+        return {
+            'url': url,
+            'samples': deque(maxlen=self.window),  # (outcome, latency)
+            'circuit': 'closed',
+            'opened_at': None,
+            'consecutive_failures': 0,
+            'requests': 0,
+            'ok': 0,
+            'empty': 0,
+            'errors': 0,
+            'cancelled': 0,
+            'wins': 0,
+            'last_latency': None,
+            'last_error': None,
+        }
+
+    def urls(self):
+        return [state['url'] for state in self.mirrors.values()]
+
+    def _score(self, state):
+        """Expected cost of asking this mirror; lower is better"""
+        samples = state['samples']
+        if not samples:
+            return 0.0  # Unknown mirrors go first so we learn about them
+        # Failures are often instant, so only answered requests count towards latency
+        latencies = [latency for outcome, latency in samples if outcome != 'errors' and latency is not None]
+        avg_latency = sum(latencies) / len(latencies) if latencies else self.default_latency
+        error_rate = sum(1 for outcome, _ in samples if outcome == 'errors') / len(samples)
+        empty_rate = sum(1 for outcome, _ in samples if outcome == 'empty') / len(samples)
+        return avg_latency * (1 + 4 * error_rate + 2 * empty_rate)
+
+    def ordered(self):
+        """
+        Base URLs worth trying, best first. Tripped mirrors whose cooldown
+        has expired are appended as half-open trials. If every mirror is
+        tripped, all of them are returned rather than none.
+        """
+        now = time.monotonic()
+        with self.lock:
+            closed = [s for s in self.mirrors.values() if s['circuit'] == 'closed']
+            closed.sort(key=self._score)
+            half_open = [
+                s for s in self.mirrors.values()
+                if s['circuit'] == 'open' and now - s['opened_at'] >= self.cooldown
+            ]
+            candidates = closed + half_open
+            if not candidates:
+                candidates = list(self.mirrors.values())
+            return [s['url'] for s in candidates]
+
+    def record(self, host, outcome, latency=None, error=None):
+        """
+        Record one fetch outcome: 'ok', 'empty', 'errors' or 'cancelled'.
+        Returns True if the mirror's circuit is open afterwards.
+        """
+        tripped = False
+        with self.lock:
+            state = self.mirrors.get(host)
+            if state is None:
+                return False
+            state['requests'] += 1
+            state[outcome] += 1
+            if latency is not None:
+                state['last_latency'] = latency
+            if outcome == 'cancelled':
+                return state['circuit'] == 'open'
+
+            state['samples'].append((outcome, latency))
+            if outcome == 'errors':
+                state['last_error'] = str(error) if error is not None else None
+                state['consecutive_failures'] += 1
+                if state['consecutive_failures'] >= self.failure_threshold:
+                    tripped = state['circuit'] != 'open'
+                    state['circuit'] = 'open'
+                    state['opened_at'] = time.monotonic()
+            else:
+                if state['circuit'] == 'open':
+                    logger.info(f"Mirror {host} recovered, closing circuit")
+                state['consecutive_failures'] = 0
+                state['circuit'] = 'closed'
+                state['opened_at'] = None
+            is_open = state['circuit'] == 'open'
+
+        if tripped:
+            logger.warning(f"Mirror {host} failed {self.failure_threshold} times in a row, opening circuit")
+        return is_open
+
+    def record_win(self, host):
+        with self.lock:
+            if host in self.mirrors:
+                self.mirrors[host]['wins'] += 1
+
+    def start_prober(self, probe):
+        """
+        Start the background thread that re-probes tripped mirrors with
+        `probe(url) -> bool`. Safe to call repeatedly and after a fork.
+        """
+        with self.lock:
+            if self.prober_pid == os.getpid():
+                return
+            self.prober_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(self.probe_interval)
+                with self.lock:
+                    tripped = [(host, s['url']) for host, s in self.mirrors.items() if s['circuit'] == 'open']
+                for host, url in tripped:
+                    started = time.monotonic()
+                    try:
+                        healthy = probe(url)
+                        error = None if healthy else 'probe failed'
+                    except Exception as e:
+                        healthy, error = False, e
+                    self.record(host, 'ok' if healthy else 'errors', time.monotonic() - started, error)
+
+        threading.Thread(target=run, name='mirror-prober', daemon=True).start()
+
+    def report(self):
+        """
+        Health and latency report for every mirror, in current preference order
+        """
+        order = {url: rank for rank, url in enumerate(self.ordered())}
+        report = {}
+        with self.lock:
+            states = sorted(self.mirrors.items(), key=lambda item: order.get(item[1]['url'], len(order)))
+            for host, state in states:
+                samples = state['samples']
+                latencies = [latency for _, latency in samples if latency is not None]
+                report[host] = {
+                    'url': state['url'],
+                    'rank': order.get(state['url']),
+                    'circuit': state['circuit'],
+                    'consecutive_failures': state['consecutive_failures'],
+                    'requests': state['requests'],
+                    'ok': state['ok'],
+                    'empty': state['empty'],
+                    'errors': state['errors'],
+                    'cancelled': state['cancelled'],
+                    'wins': state['wins'],
+                    'success_rate': round(sum(1 for o, _ in samples if o != 'errors') / len(samples), 3) if samples else None,
+                    'empty_rate': round(sum(1 for o, _ in samples if o == 'empty') / len(samples), 3) if samples else None,
+                    'avg_latency_ms': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+                    'last_latency_ms': round(state['last_latency'] * 1000, 1) if state['last_latency'] is not None else None,
+                    'last_error': state['last_error'],
+                }
+        return report
+
+class TorrentScraper:
+    def __init__(self):
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        self.registry = MirrorRegistry(
+            load_mirror_config(),
+            window=int(os.environ.get('MIRROR_HEALTH_WINDOW', 20)),
+            failure_threshold=int(os.environ.get('MIRROR_FAILURE_THRESHOLD', 3)),
+            cooldown=float(os.environ.get('MIRROR_COOLDOWN', 60)),
+            probe_interval=float(os.environ.get('MIRROR_PROBE_INTERVAL', 30))
+        )
+
+        # Separate connect and read timeouts for every outbound request
+        self.connect_timeout = float(os.environ.get('SCRAPER_CONNECT_TIMEOUT', 5))
+        self.timeout = float(os.environ.get('SCRAPER_TIMEOUT', 15))
+        self.session = self._build_session()
+        # Proxied URLs are fetched once: the caller asked for that exact
+        # response, and retrying arbitrary hosts only holds the slot longer
+        self.proxy_session = self._build_session(retries=False)
+        self.parser = get_parser_engine(os.environ.get('SCRAPER_PARSER', 'auto'))
+        self.classifier = KeywordClassifier(CATEGORY_KEYWORDS)
+        # Local SearchIndex fed with every parsed page, if configured
+        self.index = None
+        self.corrector = load_query_corrector()
+
+        # Fan-out mode queries the best SCRAPER_FANOUT_WIDTH mirrors at once
+        # and keeps the first one that returns results; otherwise mirrors are
+        # tried one after another in health order. SCRAPER_FANOUT_MODE=merge
+        # keeps every mirror that answers within SCRAPER_MERGE_WAIT seconds
+        # of the first one and merges their results.
+        self.fanout = env_flag('SCRAPER_FANOUT', True)
+        self.fanout_width = int(os.environ.get('SCRAPER_FANOUT_WIDTH', 0)) or None
+        self.merge_mirrors = os.environ.get('SCRAPER_FANOUT_MODE', 'first') == 'merge'
+        self.merge_wait = float(os.environ.get('SCRAPER_MERGE_WAIT', 1.0))
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get('SCRAPER_MAX_WORKERS', 64 if ASYNC_WORKER else 8)),
+            thread_name_prefix='mirror'
+        )
+
+        # Per-host politeness budget (replaces the old fixed 2s sleep):
+        # on average one request every 2 seconds per host, with a small burst.
+        # SCRAPER_HOST_RATE=0 turns the budget off
+        self.host_rate = float(os.environ.get('SCRAPER_HOST_RATE', 0.5))
+        self.host_burst = float(os.environ.get('SCRAPER_HOST_BURST', 3))
+        self._host_budgets = {}
+        self._budget_lock = threading.Lock()
+
+    def _build_session(self, retries=True):
+        """
+        Shared keep-alive session used for all outbound fetches. Mirrors get
+        their own connection pools so proxy traffic can't starve searches.
+        """
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+        # A 429/503 Retry-After can ask for minutes, which would hold the
+        # worker and its outbound slot; retries only use the short backoff
+        retry = Retry(
+            total=int(os.environ.get('HTTP_RETRIES', 2)),
+            backoff_factor=float(os.environ.get('HTTP_RETRY_BACKOFF', 0.3)),
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=False,
+            raise_on_status=False
+        ) if retries else 0
+        default_adapter = HTTPAdapter(
+            pool_connections=int(os.environ.get('HTTP_POOL_HOSTS', 16)),
+            pool_maxsize=int(os.environ.get('HTTP_POOL_SIZE', 16 if ASYNC_WORKER else 4)),
+            max_retries=retry
+        )
+        session.mount('http://', default_adapter)
+        session.mount('https://', default_adapter)
+        if not retries:
+            return session
+
+        mirror_pool_size = int(os.environ.get('HTTP_MIRROR_POOL_SIZE', 32 if ASYNC_WORKER else 8))
+        for mirror in self.registry.urls():
+            session.mount(mirror + '/', HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=mirror_pool_size,
+                max_retries=retry
+            ))
+        return session
+
+    def fetch(self, url, retries=True, **kwargs):
+        """GET `url` through the shared connection pool"""
+        kwargs.setdefault('timeout', (self.connect_timeout, self.timeout))
+        session = self.session if retries else self.proxy_session
+        return session.get(url, **kwargs)
+
+    def get_pool_stats(self):
+        """
+        Connection pool usage per host, for sizing pools against worker count
+        """
+        stats = {}
+        adapters = [('', adapter) for adapter in set(self.session.adapters.values())]
+        adapters += [('proxy ', adapter) for adapter in set(self.proxy_session.adapters.values())]
+        for prefix, adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+                stats[f"{prefix}{pool.scheme}://{pool.host}:{pool.port}"] = {
+                    'maxsize': pool.pool.maxsize if pool.pool else 0,
+                    'connections_opened': pool.num_connections,
+                    'requests': pool.num_requests,
+                    'idle': idle,
+                }
+        return stats
+
+    def _host_budget(self, host):
+        with self._budget_lock:
+            budget = self._host_budgets.get(host)
+            if budget is None:
+                budget = self._host_budgets[host] = TokenBucket(self.host_rate, self.host_burst)
+            return budget
+
+    def _wait_for_host(self, host, cancel_event=None):
+        """
+        Wait until the politeness budget for `host` allows another request.
+        Returns False if the fetch was cancelled while waiting, and raises
+        Overloaded if the wait would exceed the request timeout. Either way
+        the reserved token is given back, so abandoned waits don't leave
+        the budget in debt.
+        """
+        budget = self._host_budget(host)
+        delay = budget.reserve()
+        if delay > self.timeout:
+            budget.refund()
+            raise Overloaded(f"Request budget for {host} is exhausted", delay - self.timeout)
+        if delay > 0:
+            if cancel_event is not None:
+                cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+        if cancel_event is not None and cancel_event.is_set():
+            budget.refund()
+            return False
+        return True
+
+    def _record_mirror(self, host, outcome, latency=None, error=None):
+        """Record the outcome of one mirror fetch in the health registry"""
+        if self.registry.record(host, outcome, latency, error):
+            self.registry.start_prober(self._probe_mirror)
+
+    def _probe_mirror(self, url):
+        """Background health check for a tripped mirror"""
+        response = self.fetch(url)
+        return response.status_code < 500
+
+    def get_mirror_report(self):
+        """
+        Per-mirror health, latency and error report
+        """
+        return self.registry.report()
+
+    def preprocess_search_query(self, query):
+        """
+        Preprocess search query to handle common misspellings and improve results
+        """
+        return self.corrector.correct(query)
+
+    def scrape_site(self, query, category=None):
+        """
+        Scrape torrent data from The Pirate Bay
+        """
+        results = []
+
+        try:
+            results = list(self.iter_scrape_site(query))
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"General scraping error: {e}")
+
+        return results
+
+    def iter_scrape_site(self, query):
+        """
+        Generator version of scrape_site: yields each result as soon as it
+        is parsed from the first mirror that returns any.
+
+        In fan-out mode every mirror is requested at once and pages are
+        parsed in the order they arrive; otherwise mirrors are tried one
+        after another. Results are deduplicated by infohash; in merge mode
+        later mirrors only add torrents not seen yet (and refresh the peer
+        counts of those already yielded). Closing the generator cancels
+        outstanding fetches.
+
+        Raises Overloaded if nothing was found and at least one mirror was
+        skipped because its politeness budget ran out, so callers can answer
+        "try again later" instead of an empty result list.
+        """
+        # The Pirate Bay search URLs
+        mirrors = self.registry.ordered()
+        search_urls = [f"{mirror}/search/{query}/1/99/0" for mirror in mirrors]
+        merger = ResultMerger()
+        throttled = []
+
+        def download(url, cancel_event=None):
+            try:
+                return self._download(url, cancel_event)
+            except Overloaded as e:
+                throttled.append(e)
+                return None
+
+        try:
+            yield from self._iter_mirrors(search_urls, merger, download)
+        finally:
+            if merger.duplicates:
+                logger.info(f"Merged {merger.duplicates} duplicate results into {len(merger.results)}")
+        if throttled and not merger.results:
+            raise min(throttled, key=lambda e: e.retry_after)
+
+    def _iter_mirrors(self, search_urls, merger, download):
+        """Body of iter_scrape_site: fetch mirror pages with `download` and yield their results"""
+        if not self.fanout:
+            for url in search_urls:
+                found = yield from self._iter_mirror_results(url, download(url), merger)
+                if found:  # If we got results, no need to try other mirrors
+                    return
+            return
+
+        cancel_event = threading.Event()
+        futures = {
+            self.executor.submit(download, url, cancel_event): url
+            for url in search_urls[:self.fanout_width]
+        }
+        pending = set(futures)
+        deadline = time.monotonic() + self.timeout * 2
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    if not merger.results:
+                        logger.warning(f"No mirror answered within {self.timeout * 2:.0f}s")
+                    return
+                for future in done:
+                    found = yield from self._iter_mirror_results(futures[future], future.result(), merger)
+                    if found and not self.merge_mirrors:
+                        return
+                    if found:
+                        deadline = min(deadline, time.monotonic() + self.merge_wait)
+        finally:
+            cancel_event.set()
+            for future in futures:
+                future.cancel()
+
+    def _iter_mirror_results(self, url, downloaded, merger=None):
+        """
+        Parse a downloaded mirror page, yielding results (only those new to
+        `merger`, if given). Returns the number of results found so callers
+        can stop at the first good mirror.
+        """
+        if downloaded is None:
+            return 0
+
+        content, latency = downloaded
+        host = urlparse(url).netloc
+        found = 0
+        page = []
+        for result in self.iter_search_page(content, url):
+            found += 1
+            page.append(result)
+            merged = merger.add(result) if merger else result
+            if merged is not None:
+                yield merged
+
+        if self.index:
+            self.index.add(page)
+        self._record_mirror(host, 'ok' if found else 'empty', latency)
+        if found:
+            self.registry.record_win(host)
+        logger.info(f"Total results found: {found}")
+        return found
+
+    def _download(self, url, cancel_event=None):
+        """
+        Fetch a single mirror search page. Returns (content, latency), or None
+        on failure or cancellation; failures are logged and recorded in the
+        mirror report. Raises Overloaded if the host's politeness budget
+        can't cover another request within the timeout.
+        """
+        host = urlparse(url).netloc
+        try:
+            if not self._wait_for_host(host, cancel_event):
+                self._record_mirror(host, 'cancelled')
+                return None
+        except Overloaded:
+            self._record_mirror(host, 'cancelled')
+            raise
+
+        started = time.monotonic()
+        try:
+            response = self.fetch(url)
+            latency = time.monotonic() - started
+            if cancel_event is not None and cancel_event.is_set():
+                MIRROR_FETCH_SECONDS.labels(host, 'cancelled').observe(latency)
+                self._record_mirror(host, 'cancelled', latency)
+                return None
+            if response.status_code != 200:
+                MIRROR_FETCH_SECONDS.labels(host, 'http_error').observe(latency)
+                self._record_mirror(host, 'errors', latency, f"HTTP {response.status_code}")
+                return None
+            MIRROR_FETCH_SECONDS.labels(host, 'ok').observe(latency)
+            return response.content, latency
+
+        except Exception as e:
+            logger.error(f"Error scraping {url}: {e}")
+            MIRROR_FETCH_SECONDS.labels(host, 'error').observe(time.monotonic() - started)
+            self._record_mirror(host, 'errors', time.monotonic() - started, e)
+            return None
+
+    def iter_search_page(self, content, source_url, engine=None):
+        """
+        Parse a raw search page with the configured parser engine, yielding
+        result dicts one row at a time
+        """
+        engine = engine or self.parser
+        # Only time spent in here counts, not the consumer's work between rows
+        started = time.perf_counter()
+        rows = engine.iter_rows(content)
+        parse_time = 0.0
+        count = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    # Rows are pulled, classified and built one at a time so
+                    # the first result goes out before the page is finished
+                    row = next(rows, None)
+                    if row is None:
+                        break
+                    i, raw = row
+                    count += 1
+                    try:
+                        category = self.classifier.classify((raw.title or '').strip())
+                        result = self._build_result(i, raw, source_url, category)
+                    except Exception as e:
+                        logger.error(f"Error parsing row {i}: {e}")
+                        continue
+                finally:
+                    parse_time += time.perf_counter() - started
+                yield result
+        finally:
+            rows.close()
+            PAGE_ROWS.observe(count)
+            PARSE_SECONDS.labels(engine.name).observe(parse_time)
+
+    def parse_search_page(self, content, source_url, engine=None):
+        """
+        Parse a raw search page with the configured parser engine
+        """
+        results = list(self.iter_search_page(content, source_url, engine))
         logger.info(f"Total results found: {len(results)}")
         return results
 
+    def parse_piratebay_results(self, soup, source_url):
+        """
+        Parse Pirate Bay HTML and extract torrent information
+        """
+        return self.parse_search_page(soup, source_url, SoupParserEngine())
+
+    def _build_result(self, i, raw, source_url, category=None):
+        """
+        Turn the pieces of a search row into a result dict
+        """
+        title = raw.title.strip()
+        details_url = raw.href
+        if details_url and not details_url.startswith('http'):
+            details_url = source_url.split('/search')[0] + details_url
+
+        # Parse description for size and upload info
+        size = 'Unknown'
+        uploaded = 'Unknown'
+
+        if raw.desc_text is not None:
+            # Extract size - try multiple patterns
+            for pattern in SIZE_PATTERNS:
+                size_match = pattern.search(raw.desc_text)
+                if size_match:
+                    size = size_match.group(1).strip()
+                    break
+
+            # Extract upload date - try multiple patterns
+            for pattern in UPLOAD_PATTERNS:
+                upload_match = pattern.search(raw.desc_text)
+                if upload_match:
+                    uploaded = upload_match.group(1).strip()
+                    break
+
+        # Try alternative extraction from other elements if not found in detDesc
+        if size == 'Unknown' or uploaded == 'Unknown':
+            # Look for size and date in other font elements or text nodes
+            for font_text in raw.font_texts():
+                # Try to extract size from any font element
+                if size == 'Unknown':
+                    size_match = FONT_SIZE_RE.search(font_text)
+                    if size_match:
+                        size = size_match.group(1)
+
+                # Try to extract date from any font element
+                if uploaded == 'Unknown':
+                    date_match = FONT_DATE_RE.search(font_text)
+                    if date_match:
+                        uploaded = date_match.group(1)
+
+        # Seeders and leechers come from the last two columns
+        result = TorrentResult(
+            id=i + 1,
+            title=title,
+            magnet_link=raw.magnet_link,
+            details_url=details_url,
+            size=size,
+            seeders=raw.seeders_text,
+            leechers=raw.leechers_text,
+            uploaded=uploaded,
+            source=source_url,
+            category=category or self.guess_category(title)
+        )
+        logger.debug(f"Found torrent: {title} | Size: {size} | Uploaded: {uploaded} | Seeders: {result.seeders}")
+        return result.to_dict()
+
     def guess_category(self, title):
         """
         Guess category based on title with improved keyword detection
         """
-        title_lower = title.lower()
-        
-        # Video keywords (expanded)
-        video_keywords = [
-            'movie', 'film', '1080p', '720p', '4k', 'bluray', 'dvd', 'mkv', 'mp4', 
-            'avi', 'mov', 'wmv', 'flv', 'webm', 'm4v', 'series', 'episode', 'season',
-            'tv', 'show', 'documentary', 'anime', 'cartoon', 'netflix', 'hulu', 
-            'amazon', 'disney', 'hbo', 'streaming', 'webrip', 'brrip', 'hdtv'
-        ]
-        
-        # Audio keywords (expanded)
-        audio_keywords = [
-            'album', 'music', 'mp3', 'flac', 'song', 'band', 'artist', 'soundtrack', 
-            'audio', 'wav', 'aac', 'ogg', 'vinyl', 'cd', 'single', 'ep', 'lp',
-            'remix', 'live', 'concert', 'acoustic', 'instrumental'
-        ]
-        
-        # Games keywords (expanded)
-        games_keywords = [
-            'game', 'pc', 'xbox', 'ps4', 'ps5', 'nintendo', 'crack', 'steam', 
-            'gaming', 'console', 'playstation', 'switch', 'repack', 'gog', 
-            'origin', 'uplay', 'epic', 'rpg', 'fps', 'mmo', 'indie'
-        ]
-        
-        # Applications keywords (expanded)
-        apps_keywords = [
-            'software', 'app', 'program', 'tool', 'windows', 'mac', 'linux',
-            'application', 'utility', 'portable', 'installer', 'setup', 'patch',
-            'update', 'driver', 'plugin', 'extension', 'addon', 'framework'
-        ]
-        
-        if any(word in title_lower for word in video_keywords):
-            return 'Video'
-        elif any(word in title_lower for word in audio_keywords):
-            return 'Audio'
-        elif any(word in title_lower for word in games_keywords):
-            return 'Games'
-        elif any(word in title_lower for word in apps_keywords):
-            return 'Applications'
-        else:
-            return 'Other'
+        return self.classifier.classify(title)
 
     def get_torrent_details(self, torrent_url):
         """
         Get detailed information about a specific torrent from Pirate Bay
         """
         try:
-            response = requests.get(torrent_url, headers=self.headers, timeout=15)
+            response = self.fetch(torrent_url)
             if response.status_code == 200:
                 soup = BeautifulSoup(response.content, 'html.parser')
 
@@ -326,11 +2284,386 @@ class TorrentScraper:
 # Initialize scraper
 scraper = TorrentScraper()
 
+# Every scraped result is indexed locally so searches can still be answered
+# when mirrors are slow or down. Set SEARCH_INDEX_DB to '' to disable.
+search_index = None
+if os.environ.get('SEARCH_INDEX_DB', '/tmp/search-index.sqlite'):
+    search_index = SearchIndex(
+        os.environ.get('SEARCH_INDEX_DB', '/tmp/search-index.sqlite'),
+        seeder_weight=float(os.environ.get('SEARCH_INDEX_SEEDER_WEIGHT', 1.0)),
+        max_entries=int(os.environ.get('SEARCH_INDEX_MAX_ENTRIES', 500000)),
+        max_age=float(os.environ.get('SEARCH_INDEX_MAX_AGE_DAYS', 90)) * 86400
+    )
+    scraper.index = search_index
+# How long a search waits for the mirrors before answering from the index
+SEARCH_INDEX_WAIT = float(os.environ.get('SEARCH_INDEX_WAIT', 3))
+SEARCH_INDEX_LIMIT = int(os.environ.get('SEARCH_INDEX_LIMIT', 100))
+search_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('SEARCH_MAX_WORKERS', 64 if ASYNC_WORKER else 8)),
+    thread_name_prefix='search'
+)
+
+# Search results keyed on the preprocessed query. Set SEARCH_CACHE_DB to a
+# sqlite path to share the cache between gunicorn workers (gunicorn.conf.py
+# does so by default).
+search_cache = ResultCache(
+    'search',
+    ttl=int(os.environ.get('SEARCH_CACHE_TTL', 300)),
+    stale_ttl=int(os.environ.get('SEARCH_CACHE_STALE_TTL', 900)),
+    max_entries=int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', 512)),
+    max_bytes=int(os.environ.get('SEARCH_CACHE_MAX_MB', 32)) * 1024 * 1024,
+    db_path=os.environ.get('SEARCH_CACHE_DB') or None
+)
+
+# Torrent file lists never change, so details are kept for a long time.
+# Entries are stored under both the details URL and the infohash.
+details_cache = ResultCache(
+    'details',
+    ttl=int(os.environ.get('DETAILS_CACHE_TTL', 7 * 24 * 3600)),
+    max_entries=int(os.environ.get('DETAILS_CACHE_MAX_ENTRIES', 4096)),
+    max_bytes=int(os.environ.get('DETAILS_CACHE_MAX_MB', 64)) * 1024 * 1024,
+    db_path=os.environ.get('DETAILS_CACHE_DB') or None
+)
+details_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('DETAILS_MAX_WORKERS', 64 if ASYNC_WORKER else 8)),
+    thread_name_prefix='details'
+)
+
+# Admission control: per-client and per-endpoint request budgets, plus a cap
+# on concurrent outbound work (scrapes, detail fetches, proxied requests).
+# Rejections are fast 429s/503s with Retry-After instead of queued requests.
+CLIENT_RATE_LIMITS = parse_rate_limits(
+    os.environ.get('CLIENT_RATE_LIMITS', 'search=1/10,details=5/50,proxy=5/30,hls=0.1/5')
+)
+ENDPOINT_RATE_LIMITS = parse_rate_limits(os.environ.get('ENDPOINT_RATE_LIMITS', ''))
+rate_limiter = RateLimiter(
+    CLIENT_RATE_LIMITS, ENDPOINT_RATE_LIMITS,
+    max_clients=int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', 10000))
+)
+OUTBOUND_MAX_CONCURRENCY = int(os.environ.get('OUTBOUND_MAX_CONCURRENCY', 32 if ASYNC_WORKER else 8))
+outbound_gate = AdmissionGate(
+    'outbound',
+    limit=OUTBOUND_MAX_CONCURRENCY,
+    queue_size=int(os.environ.get('OUTBOUND_QUEUE_SIZE', OUTBOUND_MAX_CONCURRENCY)),
+    queue_timeout=float(os.environ.get('OUTBOUND_QUEUE_TIMEOUT', 5))
+)
+
+# Behind a load balancer (Render) the client address is in X-Forwarded-For
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+def rate_limited(endpoint):
+    """Decorator: charge each request to the client's `endpoint` budget"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            rate_limiter.check(request.remote_addr or 'unknown', endpoint)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.errorhandler(AdmissionRejected)
+def admission_rejected(e):
+    response = jsonify({'success': False, 'error': str(e), 'retryAfter': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, e.status
+
+# Concurrent identical scrapes and detail fetches share one upstream request.
+# Across workers this only pays off when the caches have a disk tier for
+# the waiting workers to read the result from.
+SINGLE_FLIGHT_DIR = os.environ.get('SINGLE_FLIGHT_DIR', '/tmp/streamvault-flights')
+SINGLE_FLIGHT_WAIT = float(os.environ.get('SINGLE_FLIGHT_WAIT', 30))
+search_flights = SingleFlight(
+    'search', lock_dir=SINGLE_FLIGHT_DIR if search_cache.db_path else None, wait=SINGLE_FLIGHT_WAIT
+)
+details_flights = SingleFlight(
+    'details', lock_dir=SINGLE_FLIGHT_DIR if details_cache.db_path else None, wait=SINGLE_FLIGHT_WAIT
+)
+
+def fresh_cached(cache, key):
+    # The caller's own lookup already counted this request's miss
+    value, cache_state = cache.peek(key)
+    return value if cache_state == 'fresh' else None
+
+def scrape_query(query):
+    """
+    scraper.scrape_site(query) through search_flights. Results are cached
+    before waiting callers are released.
+    """
+    def scrape():
+        with outbound_gate.enter():
+            results = scraper.scrape_site(query)
+        if results:
+            search_cache.set(query, results)
+        return results
+    return search_flights.do(query, scrape, lambda: fresh_cached(search_cache, query))
+
+def fetch_details(torrent_url, infohash=None):
+    """
+    Torrent details through the details cache. Returns (details, cache_state);
+    details is None if the page could not be fetched.
+    """
+    keys = [f"url:{torrent_url}"]
+    if infohash:
+        keys.insert(0, f"btih:{infohash.lower()}")
+    for key in keys:
+        # One request is one lookup: only the last key's miss counts
+        details, cache_state = details_cache.get(key, count_misses=key == keys[-1])
+        if cache_state is not None:
+            return details, cache_state
+
+    def load():
+        with outbound_gate.enter():
+            details = scraper.get_torrent_details(torrent_url)
+        if details:
+            details_cache.set(f"url:{torrent_url}", details)
+            found_infohash = extract_infohash(details.get('magnet_link')) or infohash
+            if found_infohash:
+                details_cache.set(f"btih:{found_infohash.lower()}", details)
+        return details
+
+    key = f"url:{torrent_url}"
+    return details_flights.do(key, load, lambda: fresh_cached(details_cache, key)), None
+
 @app.route('/')
 def index():
     return send_from_directory('.', 'index.html')
 
+def scrape_or_index(query, categories):
+    """
+    Scrape the mirrors for `query`. If they haven't answered within
+    SEARCH_INDEX_WAIT seconds, or found nothing, answer from the local index
+    instead and let the scrape finish (and refresh the cache) in the
+    background. Returns (results, cache_state).
+
+    When outbound work is saturated, indexed results are served straight
+    away rather than queueing for a scrape slot; with nothing indexed the
+    search queues, and raises Overloaded if no slot frees up.
+    """
+    if search_index and outbound_gate.saturated():
+        indexed = search_index.search(query, categories, SEARCH_INDEX_LIMIT)
+        if indexed:
+            logger.info(f"Outbound work saturated, answering {query!r} from the local index")
+            return indexed, 'index'
+
+    future = search_executor.submit(profiled(scrape_query), query)
+    try:
+        results = future.result(timeout=SEARCH_INDEX_WAIT if search_index else None)
+    except FuturesTimeoutError:
+        results = None
+    except Overloaded:
+        indexed = search_index.search(query, categories, SEARCH_INDEX_LIMIT) if search_index else []
+        if indexed:
+            return indexed, 'index'
+        raise
+    if results:
+        return results, None
+
+    indexed = search_index.search(query, categories, SEARCH_INDEX_LIMIT) if search_index else []
+    if not indexed:
+        return future.result(), None
+
+    def finished(done):
+        # scrape_query has already cached the results
+        if done.exception():
+            logger.error(f"Background scrape for {query!r} failed: {done.exception()}")
+
+    if not future.done():
+        logger.info(f"Mirrors slow for {query!r}, answering from the local index")
+        future.add_done_callback(finished)
+    return indexed, 'index'
+
+# Deep search: extra result pages are fetched from the mirror that answered
+# page 1, a few at a time, and cached one page per entry
+SEARCH_PAGE_SIZE = 30  # rows on a full Pirate Bay results page
+SEARCH_MAX_PAGES = int(os.environ.get('SEARCH_MAX_PAGES', 10))
+SEARCH_PAGE_CONCURRENCY = int(os.environ.get('SEARCH_PAGE_CONCURRENCY', 3))
+
+def download_search_page(base_url, query, page, cancel_event=None):
+    """Scrape one results page from one mirror; None if it couldn't be fetched"""
+    url = f"{base_url}/search/{query}/{page}/99/0"
+    with outbound_gate.enter():
+        downloaded = scraper._download(url, cancel_event)
+    if downloaded is None:
+        return None
+    results = list(scraper.iter_search_page(downloaded[0], url))
+    if search_index:
+        search_index.add(results)
+    return results
+
+def search_page_key(query, page):
+    return f"{query}\x00page={page}"
+
+def cached_search_page(base_url, query, page):
+    """Results page `page` of `query` from the search cache, or None"""
+    key = search_page_key(query, page)
+    results, cache_state = search_cache.get(key)
+    if cache_state == 'stale':
+        search_cache.refresh(key, lambda: download_search_page(base_url, query, page))
+    return results
+
+def load_search_page(base_url, query, page, cancel_event=None):
+    """Download results page `page` of `query` and cache it (empty pages too)"""
+    results = download_search_page(base_url, query, page, cancel_event)
+    if results is not None:
+        search_cache.set(search_page_key(query, page), results)
+    return results
+
+def deep_search(query, first_page, pages, limit=None):
+    """
+    Extend the page 1 results with pages 2..`pages`, fetched concurrently
+    (SEARCH_PAGE_CONCURRENCY at a time). Stops once `limit` results are
+    in, or at the first short or missing page. Returns the results in rank
+    order, deduplicated across pages.
+    """
+    wanted = limit or pages * SEARCH_PAGE_SIZE
+    base_url = first_page[0]['source'].split('/search')[0]
+    by_page = {1: first_page}
+    last_page = pages if len(first_page) >= SEARCH_PAGE_SIZE else 1
+
+    def ready():
+        # Results available in rank order, i.e. from consecutive pages
+        count = 0
+        page = 1
+        while page in by_page and page <= last_page:
+            count += len(by_page[page])
+            page += 1
+        return count
+
+    cancel_event = threading.Event()
+    in_flight = {}
+    next_page = 2
+    try:
+        while ready() < wanted:
+            while next_page <= last_page and len(in_flight) < SEARCH_PAGE_CONCURRENCY and ready() < wanted:
+                cached = cached_search_page(base_url, query, next_page)
+                if cached is not None:
+                    by_page[next_page] = cached
+                    if len(cached) < SEARCH_PAGE_SIZE:
+                        last_page = next_page
+                else:
+                    future = search_executor.submit(profiled(load_search_page), base_url, query, next_page, cancel_event)
+                    in_flight[future] = next_page
+                next_page += 1
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = in_flight.pop(future)
+                try:
+                    by_page[page] = future.result() or []
+                except Overloaded:
+                    by_page[page] = []  # Shed; settle for the pages we have
+                if len(by_page[page]) < SEARCH_PAGE_SIZE:
+                    last_page = min(last_page, page)
+            # Pages past a short page are empty; don't wait for them
+            for future, page in list(in_flight.items()):
+                if page > last_page:
+                    future.cancel()
+                    del in_flight[future]
+    finally:
+        cancel_event.set()
+        for future in in_flight:
+            future.cancel()
+
+    merger = ResultMerger()
+    for page in range(1, last_page + 1):
+        for result in by_page.get(page, []):
+            merger.add(result)
+    logger.info(f"Deep search for {query!r}: {len(merger.results)} results from {min(last_page, len(by_page))} pages")
+    return merger.results[:wanted]
+
+def matches_categories(result, categories):
+    """True if a result passes the request's category filter"""
+    if not categories or 'all' in categories:
+        return True
+    return result['category'].lower() in [c.lower() for c in categories]
+
+# Server-side sorting for /api/search: request value -> result field
+SEARCH_SORT_FIELDS = {
+    'seeders': 'seeders',
+    'leechers': 'leechers',
+    'size': 'size_bytes',
+    'uploaded': 'uploaded_ts',
+    'title': 'title',
+}
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 200))
+
+def view_results(results, query, categories, options):
+    """
+    Apply the request's filters (min_seeders, min_size, max_size in bytes),
+    sort/order and page_size/cursor to `results`. Returns (page, total,
+    next_cursor); raises ValueError for invalid options.
+    """
+    results = [r if 'size_bytes' in r else TorrentResult.from_dict(r).to_dict() for r in results]
+
+    min_seeders = options.get('min_seeders')
+    min_size = options.get('min_size')
+    max_size = options.get('max_size')
+    if min_seeders is not None:
+        results = [r for r in results if r['seeders'] >= int(min_seeders)]
+    if min_size is not None:
+        results = [r for r in results if r['size_bytes'] is not None and r['size_bytes'] >= int(min_size)]
+    if max_size is not None:
+        results = [r for r in results if r['size_bytes'] is not None and r['size_bytes'] <= int(max_size)]
+
+    sort = options.get('sort') or 'relevance'
+    order = options.get('order') or ('asc' if sort == 'title' else 'desc')
+    if sort != 'relevance':
+        if sort not in SEARCH_SORT_FIELDS or order not in ('asc', 'desc'):
+            raise ValueError(f"Can't sort by {sort!r} {order!r}")
+        field = SEARCH_SORT_FIELDS[sort]
+        # Results without a value (unknown size or date) always go last
+        known = [r for r in results if r[field] is not None]
+        known.sort(key=lambda r: r[field].lower() if field == 'title' else r[field], reverse=order == 'desc')
+        results = known + [r for r in results if r[field] is None]
+
+    total = len(results)
+    page_size = options.get('page_size')
+    if not page_size:
+        return results, total, None
+
+    page_size = max(1, min(int(page_size), SEARCH_MAX_PAGE_SIZE))
+    # Cursors only make sense for the search they came from
+    fingerprint = hashlib.sha1(json.dumps(
+        [query, sorted(categories or []), min_seeders, min_size, max_size, sort, order, page_size]
+    ).encode()).hexdigest()[:12]
+    offset = 0
+    if options.get('cursor'):
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(options['cursor'].encode()))
+            offset = int(cursor['offset'])
+        except (ValueError, TypeError, KeyError):
+            raise ValueError('Invalid cursor')
+        if cursor.get('search') != fingerprint:
+            raise ValueError('Cursor belongs to a different search')
+
+    page = results[offset:offset + page_size]
+    next_cursor = None
+    if offset + page_size < total:
+        next_cursor = base64.urlsafe_b64encode(json.dumps(
+            {'offset': offset + page_size, 'search': fingerprint}
+        ).encode()).decode()
+    return page, total, next_cursor
+
+def positive_int_option(options, name):
+    """options[name] as a positive integer, None if absent; raises ValueError otherwise"""
+    value = options.get(name)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+        if isinstance(value, bool) or (isinstance(value, float) and value != number):
+            raise ValueError
+    except (TypeError, ValueError):
+        number = 0
+    if number < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return number
+
 @app.route('/api/search', methods=['POST'])
+@profile_slow_requests('search')
 def search_torrents():
     try:
         data = request.get_json()
@@ -340,136 +2673,581 @@ def search_torrents():
         if not query:
             return jsonify({'success': False, 'error': 'Query is required'})
         
+        try:
+            pages, limit = positive_int_option(data, 'pages'), positive_int_option(data, 'limit')
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
         # Preprocess the query
         processed_query = scraper.preprocess_search_query(query)
         logger.info(f"Searching for: {processed_query}")
         
-        # Scrape torrents
-        results = scraper.scrape_site(processed_query)
+        # Serve from cache when possible; stale entries are returned right
+        # away and refreshed in the background
+        results, cache_state = search_cache.get(processed_query)
+        if cache_state == 'stale':
+            search_cache.refresh(processed_query, lambda: scrape_query(processed_query))
+        elif cache_state is None:
+            # Only searches that have to scrape count against the client's budget
+            rate_limiter.check(request.remote_addr or 'unknown', 'search')
+            results, cache_state = scrape_or_index(processed_query, categories)
+        
+        # Deep search: `pages` result pages, or enough pages for `limit` results
+        if (pages or limit) and results and cache_state != 'index':
+            pages = pages or math.ceil(limit / SEARCH_PAGE_SIZE)
+            pages = max(1, min(pages, SEARCH_MAX_PAGES))
+            if pages > 1:
+                results = deep_search(processed_query, results, pages, limit)
+        if limit:
+            results = results[:limit]
         
         # Filter by categories if specified
         if categories and 'all' not in categories:
-            results = [r for r in results if r['category'].lower() in [c.lower() for c in categories]]
+            results = [r for r in results if matches_categories(r, categories)]
+        
+        # Optional server-side filters, sorting and pagination
+        try:
+            results, total, next_cursor = view_results(results, processed_query, categories, data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         return jsonify({
             'success': True,
             'results': results,
-            'total': len(results),
-            'query': processed_query
+            'total': total,
+            'next_cursor': next_cursor,
+            'query': processed_query,
+            'cache': cache_state or 'miss'
         })
         
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"Search error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/search/stream', methods=['POST'])
+def stream_search_torrents():
+    """
+    Streaming variant of /api/search. Responds with NDJSON: one
+    {"type": "result"} line per torrent as soon as it is parsed, followed by
+    a {"type": "done"} line (or {"type": "error"} if the search fails).
+    """
+    data = request.get_json()
+    query = data.get('query', '').strip()
+    categories = data.get('categories', [])
+
+    if not query:
+        return jsonify({'success': False, 'error': 'Query is required'})
+
+    processed_query = scraper.preprocess_search_query(query)
+    logger.info(f"Streaming search for: {processed_query}")
+
+    cached, cache_state = search_cache.get(processed_query)
+    if cache_state == 'stale':
+        search_cache.refresh(processed_query, lambda: scrape_query(processed_query))
+    # The same search already running here is waited for instead of
+    # scraping the mirrors a second time, and doesn't count against the
+    # client's budget
+    if cache_state is None and not search_flights.running(processed_query):
+        # Rejections happen before the stream starts so they get a real status
+        rate_limiter.check(request.remote_addr or 'unknown', 'search')
+        if search_index and outbound_gate.saturated():
+            cached = search_index.search(processed_query, categories, SEARCH_INDEX_LIMIT)
+            cache_state = 'index' if cached else None
+
+    feed = None
+    if cache_state is None:
+        # The scrape runs as the search's flight leader on a pool thread and
+        # hands results over as they are parsed, so it holds its outbound
+        # slot only as long as the mirrors take, however slowly this client
+        # reads. Results are cached even if the client goes away.
+        feed = queue.Queue()
+        streamed = []
+
+        def scrape():
+            streamed.append(True)
+            results = []
+            with outbound_gate.enter():
+                for result in scraper.iter_scrape_site(processed_query):
+                    results.append(result)
+                    feed.put(result)
+            if results:
+                search_cache.set(processed_query, results)
+            return results
+
+        def lead():
+            try:
+                return search_flights.do(processed_query, scrape, lambda: fresh_cached(search_cache, processed_query))
+            finally:
+                feed.put(None)
+
+        flight = search_executor.submit(profiled(lead))
+
+    def generate():
+        nonlocal cached, cache_state
+        total = 0
+        try:
+            if feed is not None:
+                for result in iter(feed.get, None):
+                    if matches_categories(result, categories):
+                        total += 1
+                        yield json.dumps({'type': 'result', 'result': result}) + '\n'
+                results = flight.result()
+                if not streamed:
+                    # Another call for this search did the work
+                    cached, cache_state = results or [], 'coalesced'
+
+            if cached is not None and cache_state is not None:
+                for result in cached:
+                    if matches_categories(result, categories):
+                        total += 1
+                        yield json.dumps({'type': 'result', 'result': result}) + '\n'
+
+            yield json.dumps({
+                'type': 'done',
+                'total': total,
+                'query': processed_query,
+                'cache': cache_state or 'miss'
+            }) + '\n'
+
+        except AdmissionRejected as e:
+            yield json.dumps({'type': 'error', 'error': str(e), 'retryAfter': e.retry_after}) + '\n'
+        except Exception as e:
+            logger.error(f"Streaming search error: {e}")
+            yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # Stop reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/api/details', methods=['POST'])
+@rate_limited('details')
 def get_torrent_details():
     try:
-        data = request.get_json()
-        torrent_url = data.get('url', '').strip()
-        
-        if not torrent_url:
-            return jsonify({'success': False, 'error': 'URL is required'})
-        
-        details = scraper.get_torrent_details(torrent_url)
-        
-        if details:
-            return jsonify({
-                'success': True,
-                'details': details
-            })
-        else:
-            return jsonify({'success': False, 'error': 'Could not fetch details'})
-            
-    except Exception as e:
-        logger.error(f"Details error: {e}")
-        return jsonify({'success': False, 'error': str(e)})
+        data = request.get_json()
+        torrent_url = data.get('url', '').strip()
+        
+        if not torrent_url:
+            return jsonify({'success': False, 'error': 'URL is required'})
+        
+        details, cache_state = fetch_details(torrent_url, data.get('infohash'))
+        
+        if details:
+            return jsonify({
+                'success': True,
+                'details': details,
+                'cache': cache_state or 'miss'
+            })
+        else:
+            return jsonify({'success': False, 'error': 'Could not fetch details'})
+            
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error(f"Details error: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/details/batch', methods=['POST'])
+def get_torrent_details_batch():
+    """
+    Fetch details for many torrents at once. Takes {"urls": [...]} or
+    {"items": [{"url": ..., "infohash": ...}]} and responds with NDJSON:
+    one {"type": "details"} line per torrent in completion order, then a
+    {"type": "done"} line. Each URL costs one token of the client's
+    details budget, as it would through /api/details.
+    """
+    try:
+        data = request.get_json()
+        items = data.get('items') or [{'url': url} for url in data.get('urls', [])]
+        max_items = int(os.environ.get('DETAILS_BATCH_MAX', 50))
+        concurrency = max(1, min(int(data.get('concurrency', 8)), int(os.environ.get('DETAILS_BATCH_CONCURRENCY', 8))))
+
+        # Drop blanks and duplicates, keeping request order
+        requested = OrderedDict()
+        for item in items:
+            url = (item.get('url') or '').strip() if isinstance(item, dict) else ''
+            if url and url not in requested:
+                requested[url] = item.get('infohash')
+
+    except Exception as e:
+        logger.error(f"Batch details error: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+    if not requested:
+        return jsonify({'success': False, 'error': 'At least one URL is required'})
+    if len(requested) > max_items:
+        return jsonify({'success': False, 'error': f'At most {max_items} URLs per batch'})
+    rate_limiter.check(request.remote_addr or 'unknown', 'details', cost=len(requested))
+
+    def generate():
+        pending = iter(requested.items())
+        in_flight = {}
+        fetched = failed = 0
+
+        def submit_next():
+            for url, infohash in pending:
+                in_flight[details_executor.submit(fetch_details, url, infohash)] = url
+                return
+
+        for _ in range(concurrency):
+            submit_next()
+
+        try:
+            while in_flight:
+                future = next(as_completed(in_flight))
+                url = in_flight.pop(future)
+                submit_next()
+                error = 'Could not fetch details'
+                try:
+                    details, cache_state = future.result()
+                except AdmissionRejected as e:
+                    details, cache_state, error = None, None, str(e)
+                except Exception as e:
+                    logger.error(f"Batch details error for {url}: {e}")
+                    details, cache_state = None, None
+
+                if details:
+                    fetched += 1
+                    line = {'type': 'details', 'url': url, 'success': True, 'details': details, 'cache': cache_state or 'miss'}
+                else:
+                    failed += 1
+                    line = {'type': 'details', 'url': url, 'success': False, 'error': error}
+                yield json.dumps(line) + '\n'
+
+            yield json.dumps({'type': 'done', 'total': len(requested), 'fetched': fetched, 'failed': failed}) + '\n'
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Proxy limits: responses larger than PROXY_MAX_MB or slower than
+# PROXY_TIMEOUT seconds overall are cut off
+PROXY_MAX_BYTES = int(os.environ.get('PROXY_MAX_MB', 10)) * 1024 * 1024
+PROXY_TIMEOUT = float(os.environ.get('PROXY_TIMEOUT', 30))
+PROXY_CHUNK_SIZE = 64 * 1024
+PROXY_FORWARD_HEADERS = ('Content-Type', 'Cache-Control', 'Expires', 'ETag', 'Last-Modified', 'Content-Disposition')
+
+proxy_cache = None
+if os.environ.get('PROXY_CACHE_DB', '/tmp/proxy-cache.sqlite'):
+    proxy_cache = HttpCache(
+        os.environ.get('PROXY_CACHE_DB', '/tmp/proxy-cache.sqlite'),
+        max_entry_bytes=int(os.environ.get('PROXY_CACHE_MAX_ENTRY_KB', 1024)) * 1024,
+        max_bytes=int(os.environ.get('PROXY_CACHE_MAX_MB', 256)) * 1024 * 1024
+    )
+
+# Passed-through bodies are served from our own origin, so anything that
+# isn't plain data is sandboxed and downloaded rather than rendered
+PROXY_INLINE_TYPES = ('application/json', 'image/')
+PROXY_ATTACHMENT_TYPES = ('image/svg+xml',)
+
+class ProxyLimitExceeded(Exception):
+    """Upstream body went over the proxy's size or time budget"""
+
+def proxy_safety_headers(response):
+    content_type = (response.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+    inline = content_type.startswith(PROXY_INLINE_TYPES) and content_type not in PROXY_ATTACHMENT_TYPES
+    if not inline:
+        response.headers['Content-Disposition'] = 'attachment'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = 'sandbox'
+    return response
+
+def proxy_cached_response(entry, cache_state):
+    PROXY_BYTES.labels(cache_state.lower()).observe(len(entry['body']))
+    response = Response(entry['body'], status=entry['status'])
+    for name in PROXY_FORWARD_HEADERS:
+        if entry['headers'].get(name):
+            response.headers[name] = entry['headers'][name]
+    proxy_safety_headers(response)
+    response.headers['Age'] = str(entry['age'])
+    response.headers['X-Cache'] = cache_state
+    return response
+
+def proxy_stream(url):
+    """
+    Pass the upstream response through in chunks with its own status and
+    content type. Small cacheable responses are collected on the way and
+    stored in the shared HTTP cache; stale entries are revalidated.
+    """
+    deadline = time.monotonic() + PROXY_TIMEOUT
+    cached = proxy_cache.get(url) if proxy_cache else None
+    if cached and cached['fresh']:
+        return proxy_cached_response(cached, 'HIT')
+
+    headers = HttpCache.validators(cached) if cached else {}
+    # The slot covers connecting and the response headers; the body is
+    # bounded by PROXY_TIMEOUT and PROXY_MAX_BYTES instead
+    with outbound_gate.enter():
+        upstream = scraper.fetch(url, retries=False, stream=True, headers=headers,
+                                 timeout=(scraper.connect_timeout, min(scraper.timeout, PROXY_TIMEOUT)))
+    if upstream.status_code == 304 and cached:
+        upstream.close()
+        return proxy_cached_response(proxy_cache.revalidated(url, cached, upstream.headers), 'REVALIDATED')
+
+    length = upstream.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > PROXY_MAX_BYTES:
+        upstream.close()
+        return jsonify({'success': False, 'error': f'Upstream response is larger than {PROXY_MAX_BYTES} bytes'}), 413
+
+    def generate():
+        received = 0
+        # Only collect the body if it could be cached
+        collected = [] if proxy_cache and upstream.status_code == 200 else None
+        try:
+            for chunk in upstream.iter_content(PROXY_CHUNK_SIZE):
+                received += len(chunk)
+                if received > PROXY_MAX_BYTES:
+                    raise ProxyLimitExceeded(f"{url} is larger than {PROXY_MAX_BYTES} bytes")
+                if time.monotonic() > deadline:
+                    raise ProxyLimitExceeded(f"{url} took longer than {PROXY_TIMEOUT}s")
+                if collected is not None:
+                    collected.append(chunk)
+                    if received > proxy_cache.max_entry_bytes:
+                        collected = None
+                yield chunk
+            if collected is not None:
+                proxy_cache.store(url, upstream.status_code, upstream.headers, b''.join(collected))
+        except ProxyLimitExceeded as e:
+            # Raising aborts the connection so the client can't mistake the
+            # partial body for a complete one
+            logger.warning(f"Proxy aborted: {e}")
+            raise
+        finally:
+            PROXY_BYTES.labels('miss').observe(received)
+            upstream.close()
+
+    response = Response(stream_with_context(generate()), status=upstream.status_code)
+    for name in PROXY_FORWARD_HEADERS:
+        if upstream.headers.get(name):
+            response.headers[name] = upstream.headers[name]
+    proxy_safety_headers(response)
+    # requests decodes gzip/br, so the upstream length only holds for identity bodies
+    if length.isdigit() and not upstream.headers.get('Content-Encoding'):
+        response.headers['Content-Length'] = length
+    response.headers['X-Cache'] = 'MISS'
+    return response
+
+def proxy_json(url):
+    """
+    The upstream body wrapped in JSON, read under the same PROXY_MAX_BYTES
+    and PROXY_TIMEOUT limits as proxy_stream()
+    """
+    deadline = time.monotonic() + PROXY_TIMEOUT
+    with outbound_gate.enter():
+        upstream = scraper.fetch(url, retries=False, stream=True,
+                                 timeout=(scraper.connect_timeout, min(scraper.timeout, PROXY_TIMEOUT)))
+    received = 0
+    chunks = []
+    def too_large():
+        logger.warning(f"Proxy refused: {url} is larger than {PROXY_MAX_BYTES} bytes")
+        return jsonify({'success': False, 'error': f'Upstream response is larger than {PROXY_MAX_BYTES} bytes'}), 413
+    try:
+        length = upstream.headers.get('Content-Length', '')
+        if length.isdigit() and int(length) > PROXY_MAX_BYTES:
+            return too_large()
+        for chunk in upstream.iter_content(PROXY_CHUNK_SIZE):
+            received += len(chunk)
+            if received > PROXY_MAX_BYTES:
+                return too_large()
+            if time.monotonic() > deadline:
+                logger.warning(f"Proxy refused: {url} took longer than {PROXY_TIMEOUT}s")
+                return jsonify({'success': False, 'error': f'Upstream took longer than {PROXY_TIMEOUT}s'}), 504
+            chunks.append(chunk)
+    finally:
+        PROXY_BYTES.labels('miss').observe(received)
+        upstream.close()
 
-@app.route('/api/proxy', methods=['POST'])
+    return jsonify({
+        'success': True,
+        'content': b''.join(chunks).decode(upstream.encoding or 'utf-8', errors='replace'),
+        'status_code': upstream.status_code
+    })
+
+@app.route('/api/proxy', methods=['GET', 'POST'])
+@rate_limited('proxy')
 def proxy_request():
-    """Proxy requests to avoid CORS issues"""
+    """
+    Proxy requests to avoid CORS issues. POST returns the body wrapped in
+    JSON (mode "json", the default) or passes it through (mode "stream");
+    GET ?url= always passes it through.
+    """
     try:
-        data = request.get_json()
-        url = data.get('url', '').strip()
+        if request.method == 'GET':
+            url = request.args.get('url', '').strip()
+            mode = 'stream'
+        else:
+            data = request.get_json()
+            url = data.get('url', '').strip()
+            mode = data.get('mode', 'json')
         
         if not url:
             return jsonify({'success': False, 'error': 'URL is required'})
         
-        response = requests.get(url, headers=scraper.headers, timeout=15)
-        
-        return jsonify({
-            'success': True,
-            'content': response.text,
-            'status_code': response.status_code
-        })
+        if mode == 'stream':
+            return proxy_stream(url)
+        return proxy_json(url)
         
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"Proxy error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
 # HLS Streaming with FFmpeg
+# Stream IDs are make_stream_id() hashes and name directories under
+# HLS_ROOT, so anything else is rejected before touching the filesystem
+STREAM_ID_RE = re.compile(r'[0-9a-f]{16}')
+
+def valid_stream_route(view):
+    """404 for HLS routes asked for a stream ID make_stream_id() could not have produced"""
+    @wraps(view)
+    def wrapper(stream_id, *args, **kwargs):
+        if not STREAM_ID_RE.fullmatch(stream_id):
+            return jsonify({'success': False, 'error': 'Stream not found'}), 404
+        return view(stream_id, *args, **kwargs)
+    return wrapper
+
 @app.route('/api/create-hls-stream', methods=['POST'])
+@rate_limited('hls')
 def create_hls_stream():
     try:
         data = request.get_json()
         magnet = data.get('magnet', '').strip()
         file_name = data.get('fileName', '')
-        file_index = data.get('fileIndex', 0)
         title = data.get('title', 'Unknown')
         
-        if not magnet or not magnet.startswith('magnet:'):
-            return jsonify({'success': False, 'error': 'Valid magnet link required'})
+        # Both end up as arguments of the torrent command, so only accept
+        # values that can't be mistaken for options
+        try:
+            file_index = int(data.get('fileIndex', 0))
+        except (TypeError, ValueError):
+            file_index = -1
+        if file_index < 0:
+            return jsonify({'success': False, 'error': 'fileIndex must be a non-negative integer'}), 400
+        
+        # Local files and direct URLs are only accepted when explicitly enabled
+        # (useful for testing the pipeline against sample media)
+        source = data.get('source', '').strip()
+        if source and env_flag('HLS_ALLOW_DIRECT_SOURCES'):
+            magnet = source
+        elif not magnet.startswith('magnet:?'):
+            return jsonify({'success': False, 'error': 'Valid magnet link required'}), 400
+
+        missing = transcoder.missing_tools(magnet)
+        if missing:
+            return jsonify({'success': False, 'error': f"Streaming is unavailable: {', '.join(missing)} not installed"})
+        
+        # Adaptive streams get a master playlist over a rendition ladder:
+        # `renditions` picks rungs from HLS_RENDITIONS, `abr: true` uses all of them
+        ladder = None
+        if data.get('renditions') or data.get('abr'):
+            names = data.get('renditions') or list(HLS_RENDITION_LADDER)
+            unknown = [name for name in names if name not in HLS_RENDITION_LADDER]
+            if unknown:
+                return jsonify({
+                    'success': False,
+                    'error': f"Unknown renditions: {', '.join(unknown)}"
+                }), 400
+            ladder = [name for name in HLS_RENDITION_LADDER if name in names]
         
-        # Create unique stream ID
-        import hashlib
-        import time
-        stream_id = hashlib.md5(f"{magnet}{file_name}{time.time()}".encode()).hexdigest()[:16]
+        # Same torrent file and ladder -> same stream, shared by every viewer
+        rendition_key = 'abr:' + '+'.join(ladder) if ladder else 'default'
+        stream_id = make_stream_id(magnet, file_index, rendition_key)
         
         # Start HLS transcoding process
-        result = start_hls_transcoding(magnet, file_name, file_index, stream_id, title)
+        result = start_hls_transcoding(magnet, file_name, file_index, stream_id, title, ladder)
         
         if result['success']:
+            playlist = 'master.m3u8' if ladder else 'playlist.m3u8'
             return jsonify({
                 'success': True,
                 'streamId': stream_id,
-                'playlistUrl': f'/api/hls-stream/{stream_id}/playlist.m3u8'
+                'shared': result['shared'],
+                'playlistUrl': f'/api/hls-stream/{stream_id}/{playlist}'
             })
         else:
             return jsonify({'success': False, 'error': result['error']})
             
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"HLS stream creation error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/hls-stream/<stream_id>/playlist.m3u8')
+@valid_stream_route
 def serve_hls_playlist(stream_id):
     try:
-        playlist_path = f'/tmp/hls-{stream_id}/playlist.m3u8'
-        if os.path.exists(playlist_path):
-            with open(playlist_path, 'r') as f:
-                playlist_content = f.read()
-            
-            response = app.response_class(
-                playlist_content,
-                mimetype='application/vnd.apple.mpegurl'
-            )
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            return response
-        else:
-            return jsonify({'error': 'Playlist not found'}), 404
+        return playlist_response(stream_id, os.path.join(hls_output_path(stream_id), 'playlist.m3u8'))
             
     except Exception as e:
         logger.error(f"Error serving HLS playlist: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/hls-stream/<stream_id>/master.m3u8')
+@valid_stream_route
+def serve_hls_master_playlist(stream_id):
+    try:
+        return playlist_response(stream_id, os.path.join(hls_output_path(stream_id), 'master.m3u8'))
+
+    except Exception as e:
+        logger.error(f"Error serving HLS master playlist: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/hls-stream/<stream_id>/<rendition>/playlist.m3u8')
+@valid_stream_route
+def serve_hls_rendition_playlist(stream_id, rendition):
+    try:
+        # Renditions are only encoded once a player asks for them
+        if not transcoder.activate_rendition(stream_id, rendition):
+            return jsonify({'error': 'Playlist not found'}), 404
+        playlist_path = os.path.join(hls_output_path(stream_id), rendition, 'playlist.m3u8')
+        return playlist_response(stream_id, playlist_path, rendition)
+
+    except TranscodeQueueFull:
+        response = jsonify({'error': 'Too many streams are being prepared, try again shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    except Exception as e:
+        logger.error(f"Error serving HLS rendition playlist: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/hls-stream/<stream_id>/<rendition>/<segment>')
+@valid_stream_route
+def serve_hls_rendition_segment(stream_id, rendition, segment):
+    try:
+        if rendition not in HLS_RENDITION_LADDER:
+            return jsonify({'error': 'Segment not found'}), 404
+        return segment_response(stream_id, os.path.join(hls_output_path(stream_id), rendition), segment)
+
+    except Exception as e:
+        logger.error(f"Error serving HLS segment: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/hls-stream/<stream_id>/status')
+@valid_stream_route
+def hls_stream_status(stream_id):
+    """State of the transcoding job behind a stream"""
+    job = transcoder.get(stream_id)
+    state = read_stream_state(hls_output_path(stream_id))
+    if job is None and not state:
+        return jsonify({'success': False, 'error': 'Stream not found'}), 404
+    if job is not None:
+        state.update(job.to_dict())
+    return jsonify({'success': True, 'job': state})
+
 @app.route('/api/hls-stream/<stream_id>/<segment>')
+@valid_stream_route
 def serve_hls_segment(stream_id, segment):
     try:
-        segment_path = f'/tmp/hls-{stream_id}/{segment}'
-        if os.path.exists(segment_path):
-            return send_from_directory(f'/tmp/hls-{stream_id}', segment, mimetype='video/mp2t')
-        else:
-            return jsonify({'error': 'Segment not found'}), 404
+        return segment_response(stream_id, hls_output_path(stream_id), segment)
             
     except Exception as e:
         logger.error(f"Error serving HLS segment: {e}")
@@ -482,6 +3260,8 @@ def cleanup_hls_stream():
         stream_id = data.get('streamId', '')
         
         if stream_id:
+            if not isinstance(stream_id, str) or not STREAM_ID_RE.fullmatch(stream_id):
+                return jsonify({'success': False, 'error': 'Invalid streamId'}), 400
             cleanup_hls_files(stream_id)
             
         return jsonify({'success': True})
@@ -490,85 +3270,1215 @@ def cleanup_hls_stream():
         logger.error(f"HLS cleanup error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
-def start_hls_transcoding(magnet, file_name, file_index, stream_id, title):
-    """Start FFmpeg HLS transcoding process"""
+HLS_ROOT = os.environ.get('HLS_ROOT', '/tmp')
+HLS_PLAYLIST_WAIT = float(os.environ.get('HLS_PLAYLIST_WAIT', 20))
+HLS_BLOCKING_RELOAD_TIMEOUT = float(os.environ.get('HLS_BLOCKING_RELOAD_TIMEOUT', 18))
+HLS_SEGMENT_MAX_AGE = int(os.environ.get('HLS_SEGMENT_MAX_AGE', 86400))
+FFMPEG = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+FFPROBE = os.environ.get('FFPROBE_PATH', 'ffprobe')
+
+# Streams a torrent file to stdout. {magnet} and {file_index} are filled in
+# per argument, so nothing passes through a shell; the magnet goes after
+# "--" so it is never parsed as an option.
+TORRENT_STREAM_COMMAND = os.environ.get(
+    'HLS_TORRENT_COMMAND',
+    'webtorrent download --select {file_index} --stdout --quiet -- {magnet}'
+)
+
+# Codecs that can go into MPEG-TS HLS segments without re-encoding
+HLS_VIDEO_CODECS = {'h264'}
+HLS_AUDIO_CODECS = {'aac', 'mp3'}
+FFMPEG_STREAM_RE = re.compile(r'Stream #\d+:\d+.*?: (Video|Audio): (\w+)')
+HLS_MEDIA_SEQUENCE_RE = re.compile(rb'#EXT-X-MEDIA-SEQUENCE:(\d+)')
+HLS_TARGET_DURATION_RE = re.compile(rb'#EXT-X-TARGETDURATION:(\d+)')
+
+# Adaptive bitrate ladder: "name:WIDTHxHEIGHT:video_kbps:audio_kbps,..."
+Rendition = namedtuple('Rendition', 'name width height video_kbps audio_kbps')
+
+def load_rendition_ladder():
+    ladder = OrderedDict()
+    spec = os.environ.get('HLS_RENDITIONS', '1080p:1920x1080:5000:192,720p:1280x720:2800:128,480p:854x480:1400:128,360p:640x360:800:96')
+    for item in spec.split(','):
+        try:
+            name, size, video_kbps, audio_kbps = item.strip().split(':')
+            width, height = size.lower().split('x')
+            ladder[name] = Rendition(name, int(width), int(height), int(video_kbps), int(audio_kbps))
+        except ValueError:
+            logger.error(f"Ignoring malformed HLS rendition {item!r}")
+    return ladder
+
+HLS_RENDITION_LADDER = load_rendition_ladder()
+# Renditions encoded as soon as an ABR stream starts; the rest are encoded
+# the first time a player asks for them
+HLS_DEFAULT_RENDITIONS = [
+    name for name in os.environ.get('HLS_DEFAULT_RENDITIONS', '480p').split(',')
+    if name in HLS_RENDITION_LADDER
+] or list(HLS_RENDITION_LADDER)[-1:]
+
+# Only media files are served from a stream directory (not its lock/state files)
+HLS_SEGMENT_RE = re.compile(r'^[\w-]+\.(ts|m4s|mp4|aac)$')
+HLS_SEGMENT_MIMETYPES = {
+    'ts': 'video/mp2t',
+    'm4s': 'video/iso.segment',
+    'mp4': 'video/mp4',
+    'aac': 'audio/aac',
+}
+
+def hls_output_path(stream_id):
+    """Output directory of a stream; raises ValueError for anything but a make_stream_id() ID"""
+    if not isinstance(stream_id, str) or not STREAM_ID_RE.fullmatch(stream_id):
+        raise ValueError(f'Invalid stream ID {stream_id!r}')
+    root = os.path.realpath(HLS_ROOT)
+    path = os.path.realpath(os.path.join(root, f'hls-{stream_id}'))
+    if os.path.dirname(path) != root:
+        raise ValueError(f'Stream {stream_id} resolves outside {HLS_ROOT}')
+    return path
+
+def make_stream_id(source, file_index, rendition='default'):
+    """
+    Content-addressed stream ID: the same file of the same torrent at the
+    same rendition always maps to the same stream, whichever magnet
+    variant (trackers, display name) the client sent
+    """
+    key = extract_infohash(source) if source.startswith('magnet:') else None
+    return hashlib.sha1(f"{key or source}:{file_index}:{rendition}".encode()).hexdigest()[:16]
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def pid_alive(pid):
     try:
-        import subprocess
-        import threading
-        
-        # Create output directory
-        output_path = f'/tmp/hls-{stream_id}'
-        os.makedirs(output_path, exist_ok=True)
-        
-        # Start transcoding in background thread
-        def transcode():
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+@contextmanager
+def stream_lock(output_path, create=True):
+    """
+    Exclusive lock on a stream directory, shared by every gunicorn worker.
+    The directory is created if needed (unless `create` is False, which
+    raises FileNotFoundError instead); if it is deleted while we wait for
+    the lock, the lock is retaken on the new one.
+
+    The lock is polled rather than blocked on: under gevent a blocking
+    flock would stall the whole worker, including the greenlet holding it.
+    Holders must not wait on anything slow (killing jobs, FFmpeg exiting).
+    """
+    lock_path = os.path.join(output_path, '.lock')
+    while True:
+        if create:
+            os.makedirs(output_path, exist_ok=True)
+        elif not os.path.isdir(output_path):
+            raise FileNotFoundError(output_path)
+        try:
+            f = open(lock_path, 'a')
+        except FileNotFoundError:
+            if not create:
+                raise
+            continue
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(0.01)
+        try:
+            if os.path.exists(lock_path) and os.stat(lock_path).st_ino == os.fstat(f.fileno()).st_ino:
+                break
+        except OSError:
+            pass
+        f.close()
+    try:
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+def write_master_playlist(output_path, renditions):
+    """
+    Master playlist listing each rendition as a variant stream. Players
+    start on the first variant, so list the ones already being encoded first.
+    """
+    lines = ['#EXTM3U', '#EXT-X-VERSION:6', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for rendition in renditions:
+        bandwidth = (rendition.video_kbps + rendition.audio_kbps) * 1000
+        lines.append(
+            f'#EXT-X-STREAM-INF:BANDWIDTH={int(bandwidth * 1.1)},AVERAGE-BANDWIDTH={bandwidth},'
+            f'RESOLUTION={rendition.width}x{rendition.height}'
+        )
+        lines.append(f'{rendition.name}/playlist.m3u8')
+    tmp_path = os.path.join(output_path, 'master.m3u8.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, os.path.join(output_path, 'master.m3u8'))
+
+def read_stream_state(output_path):
+    """Shared per-stream state (viewers, owning worker, job state) or {}"""
+    try:
+        with open(os.path.join(output_path, 'stream.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_stream_state(output_path, state):
+    tmp_path = os.path.join(output_path, f'stream.json.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, os.path.join(output_path, 'stream.json'))
+
+def probe_media(source, stdin=None):
+    """
+    Codec names of the first video and audio stream in `source`, or None if
+    it can't be probed. Uses ffprobe, falling back to parsing `ffmpeg -i`.
+    For source 'pipe:0', the media is read from `stdin`.
+    """
+    codecs = {}
+    try:
+        if shutil.which(FFPROBE):
+            probe = subprocess.run(
+                [FFPROBE, '-v', 'error', '-show_entries', 'stream=codec_type,codec_name', '-of', 'json', source],
+                stdin=stdin, capture_output=True, timeout=30
+            )
+            for stream in json.loads(probe.stdout or b'{}').get('streams', []):
+                codecs.setdefault(stream.get('codec_type'), stream.get('codec_name'))
+        else:
+            probe = subprocess.run([FFMPEG, '-hide_banner', '-i', source], stdin=stdin, capture_output=True, timeout=30)
+            for kind, codec in FFMPEG_STREAM_RE.findall(probe.stderr.decode(errors='replace')):
+                codecs.setdefault(kind.lower(), codec)
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        logger.warning(f"Could not probe {source}: {e}")
+        return None
+
+    if 'video' not in codecs:
+        return None
+    return {'video': codecs.get('video'), 'audio': codecs.get('audio')}
+
+class PlaylistCache:
+    """
+    In-memory copies of HLS playlists. A playlist is only re-read when its
+    mtime or size changes, so polling players cost one stat() per request.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.counters = {'hits': 0, 'reloads': 0}
+
+    def get(self, path):
+        """Cached playlist entry for `path`, or None if the file doesn't exist"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.entries.pop(path, None)
+            return None
+
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry['version'] == version:
+                self.entries.move_to_end(path)
+                self.counters['hits'] += 1
+                return entry
+
+        with open(path, 'rb') as f:
+            content = f.read()
+        entry = self._parse(content)
+        entry.update(
+            version=version,
+            etag=f'{stat.st_mtime_ns:x}-{stat.st_size:x}',
+            last_modified=stat.st_mtime
+        )
+        with self.lock:
+            self.entries[path] = entry
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.counters['reloads'] += 1
+        return entry
+
+    def _parse(self, content):
+        media_sequence = 0
+        target_duration = 6
+        sequence_match = HLS_MEDIA_SEQUENCE_RE.search(content)
+        if sequence_match:
+            media_sequence = int(sequence_match.group(1))
+        target_match = HLS_TARGET_DURATION_RE.search(content)
+        if target_match:
+            target_duration = int(target_match.group(1))
+        segments = content.count(b'#EXTINF')
+        ended = b'#EXT-X-ENDLIST' in content
+
+        # Tell players they may block on the next segment instead of polling
+        if not ended and target_match and b'#EXT-X-SERVER-CONTROL' not in content:
+            insert_at = target_match.end()
+            content = content[:insert_at] + b'\n#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES' + content[insert_at:]
+
+        return {
+            'content': content,
+            'ended': ended,
+            'target_duration': target_duration,
+            # Media sequence number of the newest segment (-1 if none yet)
+            'last_msn': media_sequence + segments - 1,
+        }
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries))
+
+playlist_cache = PlaylistCache()
+
+def playlist_response(stream_id, playlist_path, rendition=None):
+    """
+    Serve an HLS playlist from the in-memory cache with ETag/Last-Modified
+    validation. `_HLS_msn=N` blocks (LL-HLS style) until segment N exists,
+    the playlist ends, or three target durations pass.
+    """
+    # FFmpeg only writes the playlist once the first segment is done, so
+    # give a queued or running job a moment before answering 404
+    deadline = time.monotonic() + HLS_PLAYLIST_WAIT
+    entry = playlist_cache.get(playlist_path)
+    while entry is None and time.monotonic() < deadline:
+        state = read_stream_state(hls_output_path(stream_id))
+        if rendition:
+            state = state.get('renditions', {}).get(rendition, {})
+        if state.get('state') not in ('queued', 'running'):
+            break
+        time.sleep(0.25)
+        entry = playlist_cache.get(playlist_path)
+
+    if entry is None:
+        return jsonify({'error': 'Playlist not found'}), 404
+
+    msn = request.args.get('_HLS_msn', type=int)
+    if msn is not None:
+        deadline = time.monotonic() + min(HLS_BLOCKING_RELOAD_TIMEOUT, 3 * entry['target_duration'])
+        while not entry['ended'] and entry['last_msn'] < msn and time.monotonic() < deadline:
+            time.sleep(0.2)
+            entry = playlist_cache.get(playlist_path) or entry
+
+    transcoder.touch(stream_id)
+    response = app.response_class(entry['content'], mimetype='application/vnd.apple.mpegurl')
+    response.set_etag(entry['etag'])
+    response.last_modified = entry['last_modified']
+    # Live playlists must be revalidated (cheap 304s); finished ones barely change
+    response.headers['Cache-Control'] = 'public, max-age=60' if entry['ended'] else 'no-cache'
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response.make_conditional(request)
+
+def segment_response(stream_id, directory, segment):
+    """
+    Serve a media segment. send_from_directory handles ETag, 304s and byte
+    ranges, and hands the file to the server's sendfile via wsgi.file_wrapper.
+    """
+    match = HLS_SEGMENT_RE.match(segment)
+    if not match or not os.path.isfile(os.path.join(directory, segment)):
+        return jsonify({'error': 'Segment not found'}), 404
+
+    transcoder.touch(stream_id)
+    # Segment names are never reused within a stream, so clients can keep them
+    return send_from_directory(
+        directory, segment,
+        mimetype=HLS_SEGMENT_MIMETYPES[match.group(1)],
+        max_age=HLS_SEGMENT_MAX_AGE
+    )
+
+class TranscodeQueueFull(Exception):
+    pass
+
+class TranscodeJob:
+    """
+    One FFmpeg run filling an HLS output directory.
+
+    For adaptive streams a job encodes a list of `renditions` (one
+    decode, one encode per rendition) into subdirectories. The first job
+    of a stream is its primary job; renditions requested later run as
+    extra jobs with primary=False.
+    """
+    def __init__(self, stream_id, source, file_index=0, title='', renditions=None, primary=True):
+        self.stream_id = stream_id
+        self.source = source
+        self.file_index = file_index
+        self.title = title
+        self.renditions = renditions
+        self.primary = primary
+        self.key = stream_id if primary else f"{stream_id}:{'+'.join(renditions)}"
+        self.output_path = hls_output_path(stream_id)
+        self.state = 'queued'
+        self.mode = None
+        self.attempts = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.processes = []
+        self.ffmpeg_pid = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def playlist_path(self):
+        if self.renditions:
+            return os.path.join(self.output_path, self.renditions[0], 'playlist.m3u8')
+        return os.path.join(self.output_path, 'playlist.m3u8')
+
+    @property
+    def active(self):
+        return self.state in ('queued', 'running')
+
+    def to_dict(self):
+        return {
+            'streamId': self.stream_id,
+            'title': self.title,
+            'state': self.state,
+            'mode': self.mode,
+            'attempts': self.attempts,
+            'error': self.error,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+        }
+
+class EncoderSlots:
+    """
+    Machine-wide cap on concurrent FFmpeg jobs, shared by every gunicorn
+    worker: one lock file per slot, and a job holds a slot while it holds
+    an flock on its file. The kernel drops the lock if a worker dies, so
+    slots can't leak.
+    """
+    def __init__(self, directory, count, poll_interval=0.25):
+        self.directory = directory
+        self.count = count
+        self.poll_interval = poll_interval
+
+    def _try_acquire(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for n in range(self.count):
+            f = open(os.path.join(self.directory, f'slot-{n}.lock'), 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except BlockingIOError:
+                f.close()
+        return None
+
+    @contextmanager
+    def hold(self, cancel_event):
+        """
+        Wait for a free slot and hold it for the block. Yields False instead
+        if `cancel_event` is set first.
+        """
+        if self.count <= 0:
+            yield True
+            return
+        f = self._try_acquire()
+        while f is None:
+            if cancel_event.wait(self.poll_interval):
+                yield False
+                return
+            f = self._try_acquire()
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def in_use(self):
+        """Slots currently held by any process"""
+        held = 0
+        if not os.path.isdir(self.directory):
+            return held
+        for n in range(self.count):
+            try:
+                with open(os.path.join(self.directory, f'slot-{n}.lock'), 'a') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            except BlockingIOError:
+                held += 1
+        return held
+
+class TranscodeManager:
+    """
+    Bounded queue of HLS transcoding jobs served by a fixed pool of workers.
+    Jobs only start once they get one of the machine-wide `encoder_slots`,
+    so FFmpeg runs are capped across every gunicorn worker, not per process.
+
+    Each worker supervises one FFmpeg process (plus the torrent streamer
+    feeding it) at a time: a job that exits with an error or stops
+    producing segments is restarted up to `max_restarts` times, and jobs
+    running longer than `job_timeout` or cancelled via cleanup are killed.
+    """
+    def __init__(self, max_workers, queue_size, encoder_slots=None, segment_seconds=6, job_timeout=4 * 3600,
+                 stall_timeout=180, max_restarts=2):
+        self.max_workers = max_workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.slots = encoder_slots or EncoderSlots(os.path.join(HLS_ROOT, 'streamvault-encoder-slots'), 0)
+        self.segment_seconds = segment_seconds
+        self.job_timeout = job_timeout
+        self.stall_timeout = stall_timeout
+        self.max_restarts = max_restarts
+        self.preset = os.environ.get('HLS_X264_PRESET', 'veryfast')
+        self.disk_budget = int(os.environ.get('HLS_DISK_BUDGET_MB', 10240)) * 1024 * 1024
+        self.evict_grace = float(os.environ.get('HLS_EVICT_GRACE', 120))
+        self.idle_ttl = float(os.environ.get('HLS_IDLE_TTL', 1800))
+        self.janitor_interval = float(os.environ.get('HLS_JANITOR_INTERVAL', 60))
+        self.janitor_enabled = env_flag('HLS_JANITOR', True)
+        # Streams transcoding or waiting for a slot across every worker; 0 = no cap
+        self.max_active_streams = int(os.environ.get('HLS_MAX_ACTIVE_STREAMS', 2 * max(1, self.slots.count)))
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.touched = {}
+        self.workers_pid = None
+        self.janitor_pid = None
+        self.last_sweep = None
+        self.counters = {
+            'submitted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'restarts': 0,
+            'remuxed': 0,
+            'evicted': 0,
+            'reaped_idle': 0,
+            'reaped_orphans': 0,
+            'killed_orphan_ffmpeg': 0,
+        }
+
+    def missing_tools(self, source):
+        """Executables needed to transcode `source` that aren't installed"""
+        tools = [FFMPEG]
+        if source.startswith('magnet:'):
+            tools.append(shlex.split(TORRENT_STREAM_COMMAND)[0])
+        return [tool for tool in tools if shutil.which(tool) is None]
+
+    def _ensure_workers(self):
+        # Workers are threads, so they have to be started in each gunicorn worker process
+        with self.lock:
+            if self.workers_pid == os.getpid():
+                return
+            self.workers_pid = os.getpid()
+        for n in range(self.max_workers):
+            threading.Thread(target=self._worker, name=f'transcode-{n}', daemon=True).start()
+        self.start_janitor()
+
+    def submit(self, job):
+        """
+        Queue `job`. Raises TranscodeQueueFull when the backlog is at capacity.
+        Use acquire() to start streams; this bypasses viewer tracking.
+        """
+        self._ensure_workers()
+        os.makedirs(job.output_path, exist_ok=True)
+        with self.lock:
+            try:
+                self.queue.put_nowait(job)
+                HLS_QUEUE_DEPTH.set(self.queue.qsize())
+            except queue.Full:
+                self.counters['rejected'] += 1
+                raise TranscodeQueueFull(f"{self.queue.maxsize} transcodes already waiting")
+            self.jobs[job.key] = job
+            self.counters['submitted'] += 1
+        return job
+
+    def get(self, stream_id):
+        with self.lock:
+            return self.jobs.get(stream_id)
+
+    def _detach(self, stream_id):
+        """Forget every job (queued or running) of a stream; _stop() them after"""
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if job.stream_id == stream_id]
+            for job in jobs:
+                del self.jobs[job.key]
+        return jobs
+
+    def _stop(self, jobs):
+        for job in jobs:
+            job.cancel_event.set()
+            self._kill(job)
+            if job.state == 'queued':
+                # Not persisted: jobs are only stopped while the stream is being deleted
+                job.state = 'cancelled'
+                self._count('cancelled')
+
+    def shutdown(self):
+        """Kill every FFmpeg process; registered with atexit"""
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            job.cancel_event.set()
+            self._kill(job)
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def _update(self, job, **fields):
+        """Change job fields and mirror them into stream.json for other workers"""
+        for name, value in fields.items():
+            setattr(job, name, value)
+        try:
+            with stream_lock(job.output_path, create=False):
+                state = read_stream_state(job.output_path)
+                if job.primary:
+                    state.update(job.to_dict())
+                for name in job.renditions or ():
+                    state.setdefault('renditions', {}).setdefault(name, {}).update(
+                        state=job.state, error=job.error, owner_pid=os.getpid()
+                    )
+                # Lets the janitor kill FFmpeg left running by a crashed worker
+                state.setdefault('ffmpeg', {})[job.key] = {'pid': job.ffmpeg_pid, 'owner_pid': os.getpid()}
+                write_stream_state(job.output_path, state)
+        except FileNotFoundError:
+            pass  # Stream was removed
+        except OSError as e:
+            logger.warning(f"Could not save state for stream {job.stream_id}: {e}")
+
+    def acquire(self, stream_id, source, file_index=0, title='', ladder=None):
+        """
+        Register a viewer for `stream_id`, starting a transcode only if no
+        worker already has one queued, running or finished for it. Adaptive
+        streams (`ladder` lists rendition names) only start the rungs in
+        HLS_DEFAULT_RENDITIONS, or the lowest rung if none of those apply.
+        Returns True if the viewer attached to existing output.
+        """
+        output_path = hls_output_path(stream_id)
+        with stream_lock(output_path):
+            state = read_stream_state(output_path)
+            local_job = self.get(stream_id)
+            owner_pid = state.get('owner_pid')
+            in_progress = state.get('state') in ('queued', 'running') and owner_pid and pid_alive(owner_pid)
+            attached = bool((local_job and local_job.active) or in_progress or state.get('state') == 'done')
+
+            if not attached:
+                if self.max_active_streams and self.active_streams() >= self.max_active_streams:
+                    self.counters['rejected'] += 1
+                    ADMISSION_REJECTED.labels('hls', 'active_streams').inc()
+                    raise Overloaded(f"Transcoding limit of {self.max_active_streams} streams reached", 30)
+                self._reset_output_path(output_path)
+                renditions = None
+                if ladder:
+                    renditions = [name for name in ladder if name in HLS_DEFAULT_RENDITIONS] or ladder[-1:]
+                    ordered = renditions + [name for name in ladder if name not in renditions]
+                    write_master_playlist(output_path, [HLS_RENDITION_LADDER[name] for name in ordered])
+                self.submit(TranscodeJob(stream_id, source, file_index, title, renditions))
+                state = dict(
+                    self.get(stream_id).to_dict(),
+                    owner_pid=os.getpid(),
+                    ladder=ladder,
+                    source=source,
+                    fileIndex=file_index,
+                    renditions={name: {'state': 'queued', 'owner_pid': os.getpid()} for name in renditions or ()}
+                )
+
+            state['viewers'] = state.get('viewers', 0) + 1
+            write_stream_state(output_path, state)
+            # Touched under the lock so the janitor can't see it idle in between
+            self.touch(stream_id, force=True)
+
+        return attached
+
+    def activate_rendition(self, stream_id, name):
+        """
+        Make sure some worker is encoding rendition `name` of an adaptive
+        stream, starting an extra single-rendition job if none is. Returns
+        False if the stream or rendition doesn't exist.
+        """
+        if name not in HLS_RENDITION_LADDER:
+            return False
+        output_path = hls_output_path(stream_id)
+        try:
+            with stream_lock(output_path, create=False):
+                state = read_stream_state(output_path)
+                if name not in (state.get('ladder') or ()):
+                    return False
+                info = state.setdefault('renditions', {}).get(name) or {}
+                owner_pid = info.get('owner_pid')
+                if info.get('state') == 'done' or (info.get('state') in ('queued', 'running') and owner_pid and pid_alive(owner_pid)):
+                    return True
+                if state.get('state') == 'cancelled':
+                    return False
+
+                shutil.rmtree(os.path.join(output_path, name), ignore_errors=True)
+                self.submit(TranscodeJob(stream_id, state['source'], state.get('fileIndex', 0), state.get('title', ''), [name], primary=False))
+                state['renditions'][name] = {'state': 'queued', 'owner_pid': os.getpid()}
+                write_stream_state(output_path, state)
+                logger.info(f"Started rendition {name} for stream {stream_id} on first request")
+                return True
+        except FileNotFoundError:
+            return False
+
+    def release(self, stream_id):
+        """
+        Drop one viewer. The last viewer out stops the job and deletes the
+        output. Returns True if the stream was removed.
+        """
+        output_path = hls_output_path(stream_id)
+        try:
+            with stream_lock(output_path, create=False):
+                state = read_stream_state(output_path)
+                viewers = max(0, state.get('viewers', 1) - 1)
+                if viewers:
+                    state['viewers'] = viewers
+                    write_stream_state(output_path, state)
+                    return False
+                jobs = self._delete(stream_id)
+        except FileNotFoundError:
+            return False
+        # Killing waits for the processes to exit, so it happens after the
+        # stream lock is released
+        self._stop(jobs)
+        return True
+
+    def remove(self, stream_id):
+        """
+        Stop the stream's job and delete its files. A job owned by another
+        worker notices the directory is gone and stops itself; FFmpeg left
+        behind by a worker that died is killed here.
+        """
+        self._stop(self._delete(stream_id))
+
+    def _delete(self, stream_id):
+        """
+        The quick half of remove(), safe under the stream lock: forget the
+        stream's jobs and delete its files. Returns the jobs to _stop().
+        """
+        jobs = self._detach(stream_id)
+        output_path = hls_output_path(stream_id)
+        self._kill_orphaned_ffmpeg(output_path, read_stream_state(output_path))
+        if os.path.exists(output_path):
+            shutil.rmtree(output_path, ignore_errors=True)
+            logger.info(f"Cleaned up HLS files for stream {stream_id}")
+        with self.lock:
+            self.touched.pop(stream_id, None)
+        return jobs
+
+    def touch(self, stream_id, force=False):
+        """Note that a client used the stream; throttled to one write every few seconds"""
+        now = time.time()
+        with self.lock:
+            if not force and now - self.touched.get(stream_id, 0) < 5:
+                return
+            self.touched[stream_id] = now
+        try:
+            os.utime(os.path.join(hls_output_path(stream_id), '.lock'))
+        except OSError:
+            pass
+
+    def active_streams(self):
+        """Streams that a live worker (of any gunicorn process) is transcoding"""
+        active = 0
+        try:
+            names = os.listdir(HLS_ROOT)
+        except OSError:
+            return active
+        for name in names:
+            if not name.startswith('hls-') or not STREAM_ID_RE.fullmatch(name[len('hls-'):]):
+                continue
+            state = read_stream_state(os.path.join(HLS_ROOT, name))
+            owner_pid = state.get('owner_pid')
+            if state.get('state') in ('queued', 'running') and owner_pid and pid_alive(owner_pid):
+                active += 1
+        return active
+
+    def list_streams(self):
+        """(stream_id, path, bytes, last_access) for every HLS directory on disk"""
+        streams = []
+        try:
+            names = os.listdir(HLS_ROOT)
+        except OSError:
+            return streams
+        for name in names:
+            path = os.path.join(HLS_ROOT, name)
+            # HLS_ROOT may be shared (/tmp), so only touch directories we named
+            if not name.startswith('hls-') or not STREAM_ID_RE.fullmatch(name[len('hls-'):]) or not os.path.isdir(path):
+                continue
+            size = 0
+            last_access = 0
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        stat = entry.stat()
+                        size += stat.st_size if not entry.is_dir() else directory_size(entry.path)
+                        if entry.name == '.lock':
+                            last_access = stat.st_mtime
+                last_access = last_access or os.path.getmtime(path)
+            except OSError:
+                continue
+            streams.append((name[len('hls-'):], path, size, last_access))
+        return streams
+
+    def enforce_disk_budget(self, streams=None):
+        """
+        Evict least recently used streams until HLS output fits the disk
+        budget. Streams used within the last `evict_grace` seconds are kept.
+        """
+        if streams is None:
+            streams = self.list_streams()
+        total = sum(size for _, _, size, _ in streams)
+        if total <= self.disk_budget:
+            return
+        for stream_id, _, size, _ in sorted(streams, key=lambda s: s[3]):
+            if not self._reap(stream_id, lambda state, idle: idle >= self.evict_grace):
+                continue
+            logger.info(f"Evicted HLS stream {stream_id} ({size / 1048576:.0f} MB) to stay under the disk budget")
+            self._count('evicted')
+            total -= size
+            if total <= self.disk_budget:
+                return
+        logger.warning(f"HLS output is {total / 1048576:.0f} MB, over the {self.disk_budget / 1048576:.0f} MB budget, but every stream is in use")
+
+    def start_janitor(self):
+        """
+        Start the background thread that deletes idle, orphaned and over-budget
+        streams. The first sweep runs immediately, cleaning up after workers
+        that crashed. Safe to call repeatedly and after a fork.
+        """
+        if not self.janitor_enabled:
+            return
+        with self.lock:
+            if self.janitor_pid == os.getpid():
+                return
+            self.janitor_pid = os.getpid()
+
+        def run():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.error(f"HLS janitor sweep failed: {e}")
+                time.sleep(self.janitor_interval)
+
+        threading.Thread(target=run, name='hls-janitor', daemon=True).start()
+
+    def sweep(self):
+        """One janitor pass: orphans, then idle streams, then the disk budget"""
+        remaining = []
+        for stream in self.list_streams():
+            stream_id = stream[0]
+            if self._reap(stream_id, self._is_orphan):
+                logger.info(f"Removed orphaned HLS stream {stream_id}")
+                self._count('reaped_orphans')
+            elif self._reap(stream_id, lambda state, idle: idle >= self.idle_ttl):
+                logger.info(f"Removed HLS stream {stream_id}, idle for over {self.idle_ttl:.0f}s")
+                self._count('reaped_idle')
+            else:
+                remaining.append(stream)
+        self.enforce_disk_budget(remaining)
+        self.last_sweep = time.time()
+
+    def _is_orphan(self, state, idle):
+        """
+        A stream whose transcode was owned by a worker that no longer exists,
+        or a directory that never got a state file
+        """
+        if not state:
+            return idle >= self.evict_grace
+        owner_pid = state.get('owner_pid')
+        return state.get('state') in ('queued', 'running') and not (owner_pid and pid_alive(owner_pid))
+
+    def _reap(self, stream_id, condition):
+        """
+        Remove the stream if `condition(state, idle_seconds)` still holds once
+        its lock is held, so a viewer attaching meanwhile keeps it alive
+        """
+        output_path = hls_output_path(stream_id)
+        lock_path = os.path.join(output_path, '.lock')
+        try:
+            # Taking the lock creates a missing lock file (and bumps the
+            # directory mtime), so note how old the directory was first
+            created_at = None if os.path.exists(lock_path) else os.path.getmtime(output_path)
+            with stream_lock(output_path, create=False):
+                idle = time.time() - (created_at or os.path.getmtime(lock_path))
+                if not condition(read_stream_state(output_path), idle):
+                    return False
+                jobs = self._delete(stream_id)
+        except FileNotFoundError:
+            return False
+        self._stop(jobs)
+        return True
+
+    def _kill_orphaned_ffmpeg(self, output_path, state):
+        """Kill FFmpeg processes writing to `output_path` whose worker has died"""
+        for run in (state.get('ffmpeg') or {}).values():
+            pid, owner_pid = run.get('pid'), run.get('owner_pid')
+            if not pid or (owner_pid and pid_alive(owner_pid)) or not pid_alive(pid):
+                continue
+            # Only kill the PID if it is still an FFmpeg writing this stream
+            try:
+                with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                    cmdline = f.read().decode(errors='replace')
+            except OSError:
+                continue
+            if output_path not in cmdline:
+                continue
             try:
-                # Use WebTorrent CLI or aria2c to download and pipe to FFmpeg
-                # For now, we'll create a mock implementation
-                create_mock_hls_playlist(output_path, stream_id)
-                
+                os.killpg(pid, signal.SIGKILL)
+                logger.info(f"Killed orphaned FFmpeg {pid} for {output_path}")
+                self._count('killed_orphan_ffmpeg')
+            except OSError:
+                pass
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            HLS_QUEUE_DEPTH.set(self.queue.qsize())
+            try:
+                if not job.cancel_event.is_set():
+                    with self.slots.hold(job.cancel_event) as acquired:
+                        if acquired:
+                            self._run(job)
             except Exception as e:
-                logger.error(f"Transcoding error: {e}")
-        
-        threading.Thread(target=transcode, daemon=True).start()
-        
-        return {'success': True, 'streamId': stream_id}
-        
-    except Exception as e:
-        logger.error(f"Failed to start HLS transcoding: {e}")
-        return {'success': False, 'error': str(e)}
+                logger.error(f"Transcoding error for stream {job.stream_id}: {e}")
+                self._update(job, state='failed', error=str(e))
+                self._count('failed')
+            finally:
+                self.queue.task_done()
+
+    def _run(self, job):
+        self._update(job, state='running', started_at=time.time())
+
+        outcome = None
+        for attempt in range(self.max_restarts + 1):
+            if attempt:
+                self._count('restarts')
+                logger.warning(f"Restarting transcode for stream {job.stream_id} (attempt {attempt + 1}): {job.error}")
+                if job.cancel_event.wait(min(30, 2 ** attempt)):
+                    break
+                self._reset_output(job)
+            self._update(job, attempts=job.attempts + 1)
+
+            outcome = self._run_once(job)
+            if outcome == 'done' or job.cancel_event.is_set() or outcome == 'fatal':
+                break
+
+        if job.cancel_event.is_set():
+            state = 'cancelled'
+        elif outcome == 'done':
+            state = 'done'
+        else:
+            state = 'failed'
+        self._update(job, state=state, finished_at=time.time())
+        self._count({'done': 'completed', 'failed': 'failed', 'cancelled': 'cancelled'}[job.state])
+        HLS_JOB_SECONDS.labels(job.mode or 'unknown', job.state).observe(job.finished_at - job.started_at)
+        logger.info(f"Transcode for stream {job.stream_id} {job.state} after {job.finished_at - job.started_at:.1f}s")
+
+    def _input(self, job):
+        """FFmpeg input argument and, for magnets, the command that feeds it"""
+        if job.source.startswith('magnet:'):
+            command = [
+                arg.format(magnet=job.source, file_index=int(job.file_index))
+                for arg in shlex.split(TORRENT_STREAM_COMMAND)
+            ]
+            return 'pipe:0', command
+        return job.source, None
+
+    def _hls_output_args(self, segment_pattern, playlist_path):
+        # EVENT playlist: rewritten after every segment so playback can start early
+        return [
+            '-f', 'hls',
+            '-hls_time', str(self.segment_seconds),
+            '-hls_list_size', '0',
+            '-hls_playlist_type', 'event',
+            '-hls_flags', 'independent_segments+temp_file',
+            '-hls_segment_filename', segment_pattern,
+            playlist_path,
+        ]
+
+    def _rendition_command(self, job, input_arg):
+        """
+        One FFmpeg command producing every rendition of the job from a single
+        decode: the video is split once and scaled/encoded per rendition.
+        Key frames are forced on the same schedule so segments line up
+        across renditions and players can switch between them.
+        """
+        job.mode = 'abr'
+        renditions = [HLS_RENDITION_LADDER[name] for name in job.renditions]
+        split = f"[0:v:0]split={len(renditions)}" + ''.join(f'[s{i}]' for i in range(len(renditions)))
+        scales = ';'.join(f'[s{i}]scale=-2:{r.height}[v{i}]' for i, r in enumerate(renditions))
+        command = [FFMPEG, '-hide_banner', '-loglevel', 'error', '-y', '-i', input_arg,
+                   '-filter_complex', f'{split};{scales}']
+        for i, rendition in enumerate(renditions):
+            rendition_path = os.path.join(job.output_path, rendition.name)
+            os.makedirs(rendition_path, exist_ok=True)
+            command += [
+                '-map', f'[v{i}]', '-map', '0:a:0?', '-sn', '-dn',
+                '-c:v', 'libx264', '-preset', self.preset, '-pix_fmt', 'yuv420p',
+                '-b:v', f'{rendition.video_kbps}k', '-maxrate', f'{rendition.video_kbps}k',
+                '-bufsize', f'{rendition.video_kbps * 2}k',
+                '-force_key_frames', f'expr:gte(t,n_forced*{self.segment_seconds})',
+                '-c:a', 'aac', '-b:a', f'{rendition.audio_kbps}k', '-ac', '2',
+            ]
+            command += self._hls_output_args(
+                os.path.join(rendition_path, 'segment%03d.ts'),
+                os.path.join(rendition_path, 'playlist.m3u8')
+            )
+        return command
+
+    def _ffmpeg_command(self, job, input_arg, codecs):
+        """
+        Build the FFmpeg command. Sources that are already H.264 (and AAC/MP3)
+        are only remuxed into segments, which costs almost no CPU.
+        """
+        if job.renditions:
+            return self._rendition_command(job, input_arg)
+
+        copy_video = bool(codecs) and codecs['video'] in HLS_VIDEO_CODECS
+        copy_audio = bool(codecs) and (codecs['audio'] is None or codecs['audio'] in HLS_AUDIO_CODECS)
+        job.mode = 'remux' if copy_video and copy_audio else 'transcode'
+
+        command = [FFMPEG, '-hide_banner', '-loglevel', 'error', '-y', '-i', input_arg,
+                   '-map', '0:v:0', '-map', '0:a:0?', '-sn', '-dn']
+        if copy_video:
+            command += ['-c:v', 'copy']
+        else:
+            command += ['-c:v', 'libx264', '-preset', self.preset, '-crf', '23', '-pix_fmt', 'yuv420p',
+                        '-force_key_frames', f'expr:gte(t,n_forced*{self.segment_seconds})']
+        if copy_audio:
+            command += ['-c:a', 'copy']
+        else:
+            command += ['-c:a', 'aac', '-b:a', '128k', '-ac', '2']
+
+        command += self._hls_output_args(os.path.join(job.output_path, 'segment%03d.ts'), job.playlist_path)
+        return command
+
+    def _run_once(self, job):
+        """
+        Run FFmpeg once and supervise it. Returns 'done', 'retry' or 'fatal'.
+        """
+        input_arg, feeder_command = self._input(job)
+        codecs = self._probe(job, input_arg, feeder_command) if not job.renditions else None
+        if job.cancel_event.is_set():
+            return 'fatal'
+        command = self._ffmpeg_command(job, input_arg, codecs)
+        if job.mode == 'remux':
+            self._count('remuxed')
+
+        log_path = os.path.join(job.output_path, f"ffmpeg-{'+'.join(job.renditions)}.log" if job.renditions else 'ffmpeg.log')
+        with open(log_path, 'wb') as log:
+            feeder = None
+            if feeder_command:
+                feeder = subprocess.Popen(feeder_command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                          start_new_session=True)
+            ffmpeg = subprocess.Popen(command, stdin=feeder.stdout if feeder else subprocess.DEVNULL,
+                                      stdout=subprocess.DEVNULL, stderr=log, start_new_session=True)
+            if feeder:
+                feeder.stdout.close()  # FFmpeg owns the read end now
+            job.processes = [p for p in (feeder, ffmpeg) if p]
+        self._update(job, ffmpeg_pid=ffmpeg.pid)
+
+        deadline = time.monotonic() + self.job_timeout
+        last_progress = time.monotonic()
+        last_mtime = None
+        try:
+            while ffmpeg.poll() is None:
+                if job.cancel_event.wait(1):
+                    return 'fatal'
+                if not os.path.isdir(job.output_path):
+                    # Removed by another worker after its last viewer left
+                    job.cancel_event.set()
+                    return 'fatal'
+                now = time.monotonic()
+                if now > deadline:
+                    job.error = f"timed out after {self.job_timeout}s"
+                    return 'fatal'
+                try:
+                    mtime = os.path.getmtime(job.playlist_path)
+                except OSError:
+                    mtime = None
+                if mtime != last_mtime:
+                    last_mtime, last_progress = mtime, now
+                elif now - last_progress > self.stall_timeout:
+                    job.error = f"no new segments for {self.stall_timeout}s"
+                    return 'retry'
+        finally:
+            self._kill(job)
+            job.ffmpeg_pid = None
+
+        if ffmpeg.returncode == 0:
+            return 'done'
+        try:
+            with open(log_path, 'rb') as f:
+                tail = f.read()[-500:].decode(errors='replace').strip()
+        except OSError:
+            tail = ''
+        job.error = f"ffmpeg exited with {ffmpeg.returncode}" + (f": {tail}" if tail else '')
+        return 'retry'
+
+    def _probe(self, job, input_arg, feeder_command):
+        """
+        Codecs of the job's input. Torrent input is probed through its own
+        run of the torrent command, which ffprobe stops reading after the
+        first few megabytes; cancelling the job kills it like the real run.
+        """
+        if feeder_command is None:
+            return probe_media(input_arg)
+        feeder = subprocess.Popen(feeder_command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                  start_new_session=True)
+        job.processes = [feeder]
+        try:
+            return probe_media(input_arg, stdin=feeder.stdout)
+        finally:
+            feeder.stdout.close()
+            self._kill(job)
+            job.processes = []
+
+    def _kill(self, job):
+        """Terminate a job's processes (and their children), then force-kill stragglers"""
+        processes = [p for p in job.processes if p.poll() is None]
+        for process in processes:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for process in processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                process.wait()
+
+    def _reset_output(self, job):
+        if job.renditions:
+            for name in job.renditions:
+                shutil.rmtree(os.path.join(job.output_path, name), ignore_errors=True)
+        else:
+            self._reset_output_path(job.output_path)
+
+    def _reset_output_path(self, output_path):
+        """Delete media left over from an earlier run, keeping lock, state and log files"""
+        for name in os.listdir(output_path):
+            path = os.path.join(output_path, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif name not in ('.lock', 'stream.json') and not name.endswith('.log'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            states = [job.state for job in self.jobs.values()]
+        stats['queued'] = states.count('queued')
+        stats['running'] = states.count('running')
+        stats['workers'] = self.max_workers
+        stats['encoder_slots'] = self.slots.count
+        stats['encoder_slots_in_use'] = self.slots.in_use()
+        stats['queue_depth'] = self.queue.qsize()
+        stats['queue_capacity'] = self.queue.maxsize
+        stats['active_streams'] = self.active_streams()
+        stats['max_active_streams'] = self.max_active_streams
+        streams = self.list_streams()
+        stats['streams_on_disk'] = len(streams)
+        stats['disk_bytes'] = sum(size for _, _, size, _ in streams)
+        stats['disk_budget_bytes'] = self.disk_budget
+        stats['idle_ttl'] = self.idle_ttl
+        stats['last_sweep'] = self.last_sweep
+        return stats
 
-def create_mock_hls_playlist(output_path, stream_id):
-    """Create a mock HLS playlist for demonstration"""
+# HLS_ENCODER_SLOTS caps FFmpeg jobs on the whole machine (all gunicorn
+# workers together); HLS_MAX_JOBS is how many of them one worker may run
+HLS_ENCODER_SLOTS = int(os.environ.get('HLS_ENCODER_SLOTS', os.cpu_count() or 1))
+
+transcoder = TranscodeManager(
+    max_workers=int(os.environ.get('HLS_MAX_JOBS', HLS_ENCODER_SLOTS or os.cpu_count() or 1)),
+    queue_size=int(os.environ.get('HLS_QUEUE_SIZE', 16)),
+    encoder_slots=EncoderSlots(os.path.join(HLS_ROOT, 'streamvault-encoder-slots'), HLS_ENCODER_SLOTS),
+    segment_seconds=int(os.environ.get('HLS_SEGMENT_SECONDS', 6)),
+    job_timeout=int(os.environ.get('HLS_JOB_TIMEOUT', 4 * 3600)),
+    stall_timeout=int(os.environ.get('HLS_STALL_TIMEOUT', 180)),
+    max_restarts=int(os.environ.get('HLS_MAX_RESTARTS', 2))
+)
+atexit.register(transcoder.shutdown)
+transcoder.start_janitor()
+
+def start_hls_transcoding(magnet, file_name, file_index, stream_id, title, ladder=None):
+    """
+    Attach a viewer to the stream, queueing an FFmpeg HLS transcoding job
+    for the torrent file unless one already exists
+    """
     try:
-        # Create playlist file
-        playlist_content = """#EXTM3U
-#EXT-X-VERSION:3
-#EXT-X-TARGETDURATION:10
-#EXT-X-MEDIA-SEQUENCE:0
-#EXT-X-PLAYLIST-TYPE:VOD
-#EXTINF:10.0,
-segment000.ts
-#EXTINF:10.0,
-segment001.ts
-#EXTINF:10.0,
-segment002.ts
-#EXTINF:10.0,
-segment003.ts
-#EXTINF:10.0,
-segment004.ts
-#EXT-X-ENDLIST
-"""
-        
-        playlist_path = os.path.join(output_path, 'playlist.m3u8')
-        with open(playlist_path, 'w') as f:
-            f.write(playlist_content)
-        
-        # Create mock segment files (empty for now)
-        for i in range(5):
-            segment_path = os.path.join(output_path, f'segment{i:03d}.ts')
-            with open(segment_path, 'wb') as f:
-                f.write(b'') # Empty file for now
-                
+        shared = transcoder.acquire(stream_id, magnet, file_index, title, ladder)
+        return {'success': True, 'streamId': stream_id, 'shared': shared}
+
+    except TranscodeQueueFull as e:
+        logger.warning(f"Rejected HLS transcoding for {title}: {e}")
+        ADMISSION_REJECTED.labels('hls', 'queue_full').inc()
+        raise Overloaded('Too many streams are being prepared, try again shortly', 10)
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected HLS transcoding for {title}: {e}")
+        raise
     except Exception as e:
-        logger.error(f"Error creating mock HLS playlist: {e}")
+        logger.error(f"Failed to start HLS transcoding: {e}")
+        return {'success': False, 'error': str(e)}
 
 def cleanup_hls_files(stream_id):
-    """Clean up HLS files for a stream"""
+    """Clean up HLS files for a stream once its last viewer has left"""
     try:
-        import shutil
-        output_path = f'/tmp/hls-{stream_id}'
-        if os.path.exists(output_path):
-            shutil.rmtree(output_path)
-            logger.info(f"Cleaned up HLS files for stream {stream_id}")
+        transcoder.release(stream_id)
     except Exception as e:
         logger.error(f"Error cleaning up HLS files: {e}")
 
+@app.route('/api/stats')
+def get_stats():
+    """Runtime statistics for capacity planning"""
+    return jsonify({
+        'success': True,
+        'worker': 'gevent' if ASYNC_WORKER else 'sync',
+        'mirrors': scraper.get_mirror_report(),
+        'search_cache': search_cache.stats(),
+        'details_cache': details_cache.stats(),
+        'single_flight': {'search': search_flights.stats(), 'details': details_flights.stats()},
+        'admission': {'rate_limits': rate_limiter.stats(), 'outbound': outbound_gate.stats()},
+        'transcoder': transcoder.stats(),
+        'playlist_cache': playlist_cache.stats(),
+        'proxy_cache': proxy_cache.stats() if proxy_cache else None,
+        'search_index': search_index.stats() if search_index else None,
+        'http_pools': scraper.get_pool_stats()
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics; aggregated over all workers in multiprocess mode"""
+    if prometheus_client is None:
+        return jsonify({'success': False, 'error': 'prometheus_client is not installed'}), 501
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
+
 # Health check endpoint
 @app.route('/health')
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'Backend is running'})
 
+@app.route('/health/mirrors')
+def mirror_health():
+    """Circuit state and rolling health of every mirror"""
+    report = scraper.get_mirror_report()
+    available = sum(1 for mirror in report.values() if mirror['circuit'] != 'open')
+    return jsonify({
+        'status': 'healthy' if available else 'degraded',
+        'available': available,
+        'mirrors': report
+    })
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 8000))  # Render gives us a port
     logger.info(f"Starting StreamVault backend on port {port}...")
@@ -0,0 +1,132 @@
+"""
+Microbenchmark for title classification and query correction.
+
+Compares the original keyword scan (substring checks over four lists,
+rebuilt on every call) with the compiled KeywordClassifier, one title at a
+time and a whole result page at a time, and the original corrections loop
+with QueryCorrector (with and without its query cache, since the sample
+queries repeat):
+
+    python benchmarks/classify.py
+    python benchmarks/classify.py --titles 20000 --page-size 100
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+from common import REPO_ROOT, timed, write_results
+
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault('HLS_JANITOR', '0')
+
+import app  # noqa: E402
+
+WORDS = [
+    'The', 'Last', 'Of', 'Us', 'Dune', 'Part', 'Two', 'Naruto', 'Shippuden', 'Breaking', 'Bad',
+    'Pink', 'Floyd', 'Dark', 'Side', 'Moon', 'Cyberpunk', 'Office', 'Photoshop', 'Ubuntu',
+    'Deep', 'Purple', 'Happy', 'Feet', 'Original', 'Machine', 'Head', 'Kingdom', 'Hearts',
+    '2019', '2021', '2023', 'x264', 'x265', 'HEVC', 'AAC5.1', 'MULTi', 'PROPER', 'REPACK',
+    '1080p', '720p', 'WEBRip', 'BluRay', 'HDTV', 'S01E04', 'FLAC', 'MP3', '320kbps',
+    'FitGirl', 'GOG', 'Portable', 'Setup', 'Linux', 'Album', 'Discography', 'Season',
+]
+
+QUERIES = [
+    'narto shippuden', 'lord of ring', 'spiderman far from home', 'gameofthrone season 8',
+    'avengers end game', 'the office', 'breaking bad s05', 'pink floyd flac', 'harrypoter',
+    'dune part two 2160p', 'starwars andor', 'jumanji jungle', 'ubuntu 24.04 iso',
+]
+
+# The implementations KeywordClassifier and QueryCorrector replaced
+def original_guess_category(title):
+    title_lower = title.lower()
+    video_keywords = [
+        'movie', 'film', '1080p', '720p', '4k', 'bluray', 'dvd', 'mkv', 'mp4',
+        'avi', 'mov', 'wmv', 'flv', 'webm', 'm4v', 'series', 'episode', 'season',
+        'tv', 'show', 'documentary', 'anime', 'cartoon', 'netflix', 'hulu',
+        'amazon', 'disney', 'hbo', 'streaming', 'webrip', 'brrip', 'hdtv'
+    ]
+    audio_keywords = [
+        'album', 'music', 'mp3', 'flac', 'song', 'band', 'artist', 'soundtrack',
+        'audio', 'wav', 'aac', 'ogg', 'vinyl', 'cd', 'single', 'ep', 'lp',
+        'remix', 'live', 'concert', 'acoustic', 'instrumental'
+    ]
+    games_keywords = [
+        'game', 'pc', 'xbox', 'ps4', 'ps5', 'nintendo', 'crack', 'steam',
+        'gaming', 'console', 'playstation', 'switch', 'repack', 'gog',
+        'origin', 'uplay', 'epic', 'rpg', 'fps', 'mmo', 'indie'
+    ]
+    apps_keywords = [
+        'software', 'app', 'program', 'tool', 'windows', 'mac', 'linux',
+        'application', 'utility', 'portable', 'installer', 'setup', 'patch',
+        'update', 'driver', 'plugin', 'extension', 'addon', 'framework'
+    ]
+    if any(word in title_lower for word in video_keywords):
+        return 'Video'
+    elif any(word in title_lower for word in audio_keywords):
+        return 'Audio'
+    elif any(word in title_lower for word in games_keywords):
+        return 'Games'
+    elif any(word in title_lower for word in apps_keywords):
+        return 'Applications'
+    else:
+        return 'Other'
+
+def make_titles(count, seed=1):
+    rng = random.Random(seed)
+    return ['.'.join(rng.choice(WORDS) for _ in range(rng.randint(3, 9))) for _ in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--titles', type=int, default=5000)
+    parser.add_argument('--page-size', type=int, default=30, help='titles per classify_many call')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5, help='best of this many runs')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    titles = make_titles(args.titles)
+    pages = [titles[i:i + args.page_size] for i in range(0, len(titles), args.page_size)]
+    classifier = app.scraper.classifier
+    queries = [QUERIES[i % len(QUERIES)] for i in range(args.queries)]
+    # Corrections used to be an inline dict, so don't count the file read
+    with open(os.path.join(REPO_ROOT, 'corrections.json')) as f:
+        inline_corrections = json.load(f)['corrections']
+
+    uncached = app.load_query_corrector()
+    uncached.cache_size = 0
+
+    def original_queries():
+        for query in queries:
+            processed = query.lower().strip()
+            for wrong, correct in dict(inline_corrections).items():
+                if wrong in processed:
+                    processed = processed.replace(wrong, correct)
+
+    rows = [
+        ('classify: original', args.titles, timed(lambda: [original_guess_category(t) for t in titles], args.repeat)),
+        ('classify: compiled', args.titles, timed(lambda: [classifier.classify(t) for t in titles], args.repeat)),
+        ('classify: per page', args.titles, timed(lambda: [classifier.classify_many(p) for p in pages], args.repeat)),
+        ('correct: original', args.queries, timed(original_queries, args.repeat)),
+        ('correct: compiled', args.queries, timed(lambda: [app.scraper.preprocess_search_query(q) for q in queries], args.repeat)),
+        ('correct: uncached', args.queries, timed(lambda: [uncached.correct(q) for q in queries], args.repeat)),
+    ]
+
+    baseline = {'classify': rows[0][2], 'correct': rows[3][2]}
+    results = []
+    print(f"{'benchmark':>20}  {'items':>8}  {'items_per_sec':>14}  {'speedup':>8}")
+    for label, items, elapsed in rows:
+        speedup = baseline[label.split(':')[0]] / elapsed
+        results.append({'benchmark': label, 'items': items, 'seconds': elapsed, 'items_per_sec': items / elapsed, 'speedup': speedup})
+        print(f"{label:>20}  {items:>8}  {items / elapsed:>14.0f}  {speedup:>7.1f}x")
+
+    # Whole-word matching changes some answers on purpose ('ep' in 'deep')
+    changed = sum(original_guess_category(t) != classifier.classify(t) for t in titles)
+    print(f"\n{changed} of {len(titles)} titles classified differently from the substring scan")
+
+    if args.json:
+        write_results(args.json, 'classify', vars(args), results, changed_categories=changed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Helpers shared by the benchmark scripts: fixture loading, timing,
+percentiles, memory readings and the JSON results format that
+compare.py reads.
+"""
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'fixtures')
+
+def load_fixtures(kind, fixtures_dir=FIXTURES_DIR):
+    """{name: bytes} for the `kind` ('search' or 'details') pages, by name"""
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, f'{kind}-*.html'))):
+        with open(path, 'rb') as f:
+            pages[os.path.basename(path)[:-len('.html')]] = f.read()
+    return pages
+
+def timed(fn, repeat):
+    """Best wall time of `repeat` calls to fn()"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of `pid` and all its descendants (Linux only)"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return total
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def write_results(path, benchmark, parameters, results, **extra):
+    """
+    Save a run as JSON. `results` is a list of flat rows: string fields
+    identify a row, numeric fields are measurements.
+    """
+    document = {
+        'benchmark': benchmark,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'results': results,
+    }
+    document.update(extra)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(f'\nResults written to {path}', file=sys.stderr)
+
+def print_table(rows, columns):
+    print('  '.join(f'{c:>16}' for c in columns))
+    for row in rows:
+        print('  '.join(f'{str(row.get(c)):>16}' for c in columns))
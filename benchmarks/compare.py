@@ -0,0 +1,88 @@
+"""
+Compare two benchmark result files written with --json by classify.py,
+parse.py or load.py, and flag regressions.
+
+Rows are matched on their string fields (plus --key fields such as
+concurrency); every numeric field present in both is compared. Throughput
+style metrics (*_per_sec, speedup) should go up, everything else (times,
+memory, errors) should go down. Exits with status 1 if any metric got
+worse by more than --threshold percent.
+
+    python benchmarks/compare.py before.json after.json
+    python benchmarks/compare.py before.json after.json --threshold 5 --metrics p99_ms rss_peak_mb
+"""
+import argparse
+import json
+import sys
+
+HIGHER_IS_BETTER = ('_per_sec', 'speedup')
+# Sizes of the workload rather than measurements of it
+IGNORED = {'items', 'rows', 'kb', 'requests', 'concurrency'}
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def row_key(row, key_fields):
+    return tuple(sorted(
+        (name, value) for name, value in row.items()
+        if isinstance(value, str) or name in key_fields
+    ))
+
+def change(old, new, metric):
+    """Percentage change, positive meaning better"""
+    if not old:
+        return None
+    delta = (new - old) / abs(old) * 100
+    return delta if metric.endswith(HIGHER_IS_BETTER) else -delta
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='regression threshold in percent')
+    parser.add_argument('--metrics', nargs='+', help='only compare these metrics')
+    parser.add_argument('--key', nargs='+', default=['concurrency'], help='numeric fields that identify a row')
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    if baseline.get('benchmark') != candidate.get('benchmark'):
+        print(f"Warning: comparing {baseline.get('benchmark')} results with {candidate.get('benchmark')} results")
+    for document, path in ((baseline, args.baseline), (candidate, args.candidate)):
+        print(f"{path}: {document.get('benchmark')} at {document.get('git_commit')} ({document.get('created_at')})")
+    print()
+
+    before = {row_key(row, args.key): row for row in baseline['results']}
+    regressions = 0
+    unmatched = 0
+    print(f"{'row':<40}  {'metric':>16}  {'before':>12}  {'after':>12}  {'change':>9}")
+    for row in candidate['results']:
+        key = row_key(row, args.key)
+        old_row = before.pop(key, None)
+        label = ' '.join(str(value) for _, value in key)
+        if old_row is None:
+            unmatched += 1
+            continue
+        for metric, new in row.items():
+            old = old_row.get(metric)
+            if (metric in IGNORED or metric in args.key or isinstance(new, (str, bool))
+                    or not isinstance(new, (int, float)) or not isinstance(old, (int, float))):
+                continue
+            if args.metrics and metric not in args.metrics:
+                continue
+            improvement = change(old, new, metric)
+            flag = ''
+            if improvement is not None and improvement < -args.threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            shown = f'{improvement:+.1f}%' if improvement is not None else 'n/a'
+            print(f'{label[:40]:<40}  {metric:>16}  {old:>12}  {new:>12}  {shown:>9}{flag}')
+
+    unmatched += len(before)
+    if unmatched:
+        print(f'\n{unmatched} rows only appear in one of the files')
+    print(f"\n{regressions} regression{'s' if regressions != 1 else ''} beyond {args.threshold}% (positive change = better)")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
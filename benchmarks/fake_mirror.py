@@ -0,0 +1,197 @@
+"""
+Local stand-in for a Pirate Bay mirror that replays the pages in
+benchmarks/fixtures, so the scraper and the API can be measured without
+touching live mirrors.
+
+    /search/<query>/<page>/<order>/<category>   search fixtures
+    /torrent/<id>/<slug>, /description.php?id=  details fixtures
+
+Full result pages are served for pages 1..--pages, then one short page,
+then empty pages; queries containing "nohits" always get the empty page.
+Infohashes and torrent ids are rewritten per page so results on different
+pages don't collapse into each other when merged. Latency, jitter, error
+rate and slow "drip" bodies can be configured to mimic unhealthy mirrors:
+
+    python benchmarks/fake_mirror.py --port 9000 --latency 0.3 --jitter 0.5
+    python benchmarks/fake_mirror.py --error-rate 0.2 --drip-bytes 1024 --drip-interval 0.05
+
+Then point the app at it with SCRAPER_MIRRORS=http://127.0.0.1:9000.
+"""
+import argparse
+import hashlib
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from common import FIXTURES_DIR, load_fixtures
+
+SEARCH_PATH_RE = re.compile(r'^/search/([^/]+)(?:/(\d+))?')
+DETAILS_PATH_RE = re.compile(r'^/torrent/(\d+)')
+INFOHASH_RE = re.compile(rb'btih:([0-9A-Fa-f]{40})')
+TORRENT_ID_RE = re.compile(rb'/torrent/(\d+)/')
+
+class FakeMirror:
+    """
+    Threaded HTTP server replaying fixture pages. Runs in the background
+    from construction until close(); `url` is its base URL.
+    """
+    def __init__(self, host='127.0.0.1', port=0, fixtures_dir=FIXTURES_DIR, latency=0.0, jitter=0.0,
+                 error_rate=0.0, drip_bytes=0, drip_interval=0.0, pages=3, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drip_bytes = drip_bytes
+        self.drip_interval = drip_interval
+        self.pages = pages
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {'search': 0, 'details': 0, 'not_found': 0, 'errors': 0}
+
+        search = load_fixtures('search', fixtures_dir)
+        self.empty_page = search.pop('search-empty')
+        self.short_page = search.pop('search-short')
+        self.full_pages = [search[name] for name in sorted(search)]
+        self.details_pages = list(load_fixtures('details', fixtures_dir).values())
+        if not self.full_pages or not self.details_pages:
+            raise RuntimeError(f'No fixtures found in {fixtures_dir}')
+        self.rendered = {}  # (fixture index, page) -> body
+
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                mirror.handle(self)
+
+            def do_HEAD(self):
+                mirror.handle(self, head=True)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def _vary(self, body, salt):
+        """`body` with its infohashes and torrent ids made unique to `salt`"""
+        def infohash(match):
+            return b'btih:' + hashlib.sha1(match.group(1) + salt).hexdigest().upper().encode()
+
+        def torrent_id(match):
+            return b'/torrent/%d/' % (zlib.crc32(match.group(1) + salt) % 90000000 + 1000000)
+
+        return TORRENT_ID_RE.sub(torrent_id, INFOHASH_RE.sub(infohash, body))
+
+    def search_body(self, query, page):
+        if 'nohits' in query or page > self.pages + 1:
+            return self.empty_page
+        if page == self.pages + 1:
+            return self.short_page
+        index = zlib.crc32(query.encode()) % len(self.full_pages)
+        key = (index, page)
+        body = self.rendered.get(key)
+        if body is None:
+            body = self.rendered[key] = self._vary(self.full_pages[index], b'%d' % page)
+        return body
+
+    def route(self, path):
+        """(status, body) for a request path"""
+        parsed = urlparse(path)
+        match = SEARCH_PATH_RE.match(parsed.path)
+        if match:
+            self._count('search')
+            return 200, self.search_body(unquote(match.group(1)).lower(), int(match.group(2) or 1))
+
+        match = DETAILS_PATH_RE.match(parsed.path)
+        torrent_id = match.group(1) if match else parse_qs(parsed.query).get('id', [None])[0]
+        if torrent_id and (match or parsed.path == '/description.php'):
+            self._count('details')
+            return 200, self.details_pages[zlib.crc32(torrent_id.encode()) % len(self.details_pages)]
+
+        self._count('not_found')
+        return 404, b'<html><body><h1>Not Found</h1></body></html>'
+
+    def handle(self, handler, head=False):
+        with self.lock:
+            delay = self.latency * (1 + self.random.uniform(-self.jitter, self.jitter)) if self.latency else 0
+            failed = self.error_rate and self.random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+
+        if failed:
+            self._count('errors')
+            status, body = 503, b'<html><body><h1>503 Service Temporarily Unavailable</h1></body></html>'
+        else:
+            status, body = self.route(handler.path)
+
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'text/html; charset=utf-8')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if head:
+            return
+        try:
+            if self.drip_bytes:
+                for offset in range(0, len(body), self.drip_bytes):
+                    handler.wfile.write(body[offset:offset + self.drip_bytes])
+                    handler.wfile.flush()
+                    time.sleep(self.drip_interval)
+            else:
+                handler.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The scraper gave up on us, as it should on a slow mirror
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def add_mirror_arguments(parser):
+    """Mirror behaviour options shared with load.py"""
+    parser.add_argument('--latency', type=float, default=0.3, help='mirror response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random +/- fraction of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--drip-bytes', type=int, default=0, help='send bodies in chunks of this many bytes')
+    parser.add_argument('--drip-interval', type=float, default=0.0, help='pause between dripped chunks in seconds')
+    parser.add_argument('--pages', type=int, default=3, help='full result pages per query')
+    parser.add_argument('--seed', type=int, help='random seed for jitter and errors')
+
+def mirror_from_args(args, port=0):
+    return FakeMirror(
+        port=port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        drip_bytes=args.drip_bytes, drip_interval=args.drip_interval, pages=args.pages, seed=args.seed
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9000)
+    add_mirror_arguments(parser)
+    args = parser.parse_args()
+
+    mirror = mirror_from_args(args, args.port)
+    print(f'Fake mirror serving {mirror.url} (Ctrl+C to stop)')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mirror.close()
+        print(mirror.stats())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Load benchmark for the StreamVault API.
+
+Starts the app under gunicorn once per worker class, points it at a local
+fake mirror replaying the recorded fixtures (see fake_mirror.py), and
+drives it with concurrent clients. Reports requests/sec, latency
+percentiles, requests shed by admission control (429/503) and the peak
+memory of the gunicorn process tree so worker classes and code changes
+can be compared:
+
+    python benchmarks/load.py
+    python benchmarks/load.py --workers sync gevent --concurrency 100 --latency 0.5
+    python benchmarks/load.py --scenarios search --error-rate 0.2 --json after.json
+    python benchmarks/compare.py before.json after.json
+
+Scenarios:
+    search      distinct queries, so every request scrapes the mirror
+    search-hot  a handful of queries repeated, exercising coalescing
+    deep        distinct queries asking for three result pages each
+    details     torrent details pages
+    proxy       the JSON proxy fetching mirror pages
+
+Each worker class is run twice by default: once with the per-mirror
+politeness budget switched off, measuring the app itself, and once
+("polite") with the app's default SCRAPER_HOST_RATE, which is what a
+deployment actually gets and where searches start being shed with 503
+once the budget runs out. --politeness picks one of the two.
+
+To load an already running server instead (memory is then only reported
+with --pid):
+
+    python benchmarks/load.py --url http://localhost:8000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from common import REPO_ROOT, percentile, print_table, process_tree_rss, write_results
+from fake_mirror import add_mirror_arguments, mirror_from_args
+
+SCENARIOS = ('search', 'search-hot', 'deep', 'details', 'proxy')
+
+def start_app(worker_class, port, mirror_url, workers, polite=False):
+    """
+    Run app.py under gunicorn and wait until /health answers. Unless
+    `polite`, the per-mirror request budget is switched off.
+    """
+    state_dir = tempfile.mkdtemp(prefix='streamvault-bench-')
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        GUNICORN_WORKER_CLASS=worker_class,
+        WEB_CONCURRENCY=str(workers),
+        SCRAPER_MIRRORS=mirror_url,
+        # Every request has to reach the mirror
+        SEARCH_CACHE_TTL='0',
+        SEARCH_CACHE_STALE_TTL='0',
+        DETAILS_CACHE_TTL='0',
+        # Every client is 127.0.0.1 here, so per-client budgets would throttle the whole run
+        CLIENT_RATE_LIMITS='',
+        # Keep the index, caches and metrics of each run separate
+        SEARCH_INDEX_DB=os.path.join(state_dir, 'search-index.sqlite'),
+        SEARCH_CACHE_DB=os.path.join(state_dir, 'search-cache.sqlite'),
+        DETAILS_CACHE_DB=os.path.join(state_dir, 'details-cache.sqlite'),
+        PROXY_CACHE_DB=os.path.join(state_dir, 'proxy-cache.sqlite'),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(state_dir, 'metrics'),
+        SINGLE_FLIGHT_DIR=os.path.join(state_dir, 'flights'),
+    )
+    if not polite:
+        env['SCRAPER_HOST_RATE'] = '0'
+    else:
+        env.pop('SCRAPER_HOST_RATE', None)
+        env.pop('SCRAPER_HOST_BURST', None)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + '/health', timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'gunicorn ({worker_class}) did not start')
+
+def scenario_request(scenario, n, base_url, mirror_url):
+    """(url, payload) of the `n`th request of `scenario`"""
+    if scenario == 'search':
+        return base_url + '/api/search', {'query': f'bench movie {n}'}
+    if scenario == 'search-hot':
+        return base_url + '/api/search', {'query': f'bench movie {n % 5}'}
+    if scenario == 'deep':
+        return base_url + '/api/search', {'query': f'bench movie {n}', 'pages': 3}
+    if scenario == 'details':
+        return base_url + '/api/details', {'url': f'{mirror_url}/torrent/{n}/Bench.Movie.{n}'}
+    return base_url + '/api/proxy', {'url': f'{mirror_url}/search/bench{n}/1/99/0'}
+
+def run_load(base_url, scenario, concurrency, duration, mirror_url, pid=None):
+    """
+    Drive `scenario` with `concurrency` clients for `duration` seconds and
+    summarise throughput, latency and (given the server's `pid`) memory
+    """
+    latencies = []
+    errors = [0]
+    shed = [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    counter = [0]
+    rss = [process_tree_rss(pid) if pid else 0]
+
+    def client():
+        session = requests.Session()
+        while time.monotonic() < stop_at:
+            with lock:
+                counter[0] += 1
+                n = counter[0]
+            url, payload = scenario_request(scenario, n, base_url, mirror_url)
+            started = time.monotonic()
+            status = None
+            try:
+                response = session.post(url, json=payload, timeout=60)
+                status = response.status_code
+                ok = status == 200 and response.json().get('success')
+            except (requests.RequestException, ValueError):
+                ok = False
+            elapsed = time.monotonic() - started
+            with lock:
+                latencies.append(elapsed)
+                if status in (429, 503):
+                    shed[0] += 1
+                elif not ok:
+                    errors[0] += 1
+
+    def sample_memory():
+        while time.monotonic() < stop_at:
+            rss[0] = max(rss[0], process_tree_rss(pid))
+            time.sleep(0.25)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    if pid:
+        threads.append(threading.Thread(target=sample_memory))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'shed': shed[0],
+        'requests_per_sec': round(len(latencies) / wall, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        'max_ms': round(latencies[-1] * 1000, 1) if latencies else None,
+        'rss_peak_mb': round(rss[0] / 1024 / 1024, 1) if pid else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='benchmark an already running server instead of starting gunicorn')
+    parser.add_argument('--pid', type=int, help='with --url, the server process to measure memory of')
+    parser.add_argument('--workers', nargs='+', default=['sync', 'gevent'], help='gunicorn worker classes to compare')
+    parser.add_argument('--processes', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--scenarios', nargs='+', default=['search', 'proxy'], choices=SCENARIOS)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--politeness', choices=['off', 'default', 'both'], default='both',
+                        help="run without the per-mirror request budget, with the app's default one, or both")
+    parser.add_argument('--json', help='also write results to this file')
+    add_mirror_arguments(parser)
+    args = parser.parse_args()
+
+    mirror = mirror_from_args(args)
+    rows = []
+    try:
+        if args.url:
+            for scenario in args.scenarios:
+                row = run_load(args.url, scenario, args.concurrency, args.duration, mirror.url, args.pid)
+                rows.append(dict(row, label=args.url))
+        else:
+            modes = {'off': [False], 'default': [True], 'both': [False, True]}[args.politeness]
+            for worker_class in args.workers:
+                for polite in modes:
+                    process, base_url = start_app(worker_class, args.port, mirror.url, args.processes, polite)
+                    label = f'{worker_class} polite' if polite else worker_class
+                    try:
+                        for scenario in args.scenarios:
+                            row = run_load(base_url, scenario, args.concurrency, args.duration, mirror.url, process.pid)
+                            rows.append(dict(row, label=label))
+                    finally:
+                        process.terminate()
+                        process.wait()
+    finally:
+        mirror.close()
+
+    print_table(rows, ['label', 'scenario', 'concurrency', 'requests', 'errors', 'shed', 'requests_per_sec',
+                       'p50_ms', 'p99_ms', 'max_ms', 'rss_peak_mb'])
+    print(f'\nMirror requests: {mirror.stats()}')
+    if args.json:
+        write_results(args.json, 'load', vars(args), rows, mirror=mirror.stats())
+
+if __name__ == '__main__':
+    main()
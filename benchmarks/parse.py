@@ -0,0 +1,108 @@
+"""
+Microbenchmark for search page parsing over the recorded fixtures.
+
+For every search fixture and every installed parser engine, times row
+extraction alone and the full parse (extraction, classification and
+result building), reports pages/sec, rows/sec and peak Python memory per
+parse, and checks that all engines produce identical results. Exits with
+status 1 if they don't.
+
+    python benchmarks/parse.py
+    python benchmarks/parse.py --repeat 20 --json parse.json
+"""
+import argparse
+import logging
+import os
+import sys
+import tracemalloc
+
+from common import REPO_ROOT, load_fixtures, print_table, timed, write_results
+
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault('HLS_JANITOR', '0')
+os.environ.setdefault('SEARCH_INDEX_DB', '')
+
+import app  # noqa: E402
+
+SOURCE_URL = 'https://thepiratebay.org/search/benchmark/1/99/0'
+
+def peak_memory(fn):
+    """Peak bytes allocated by Python while running fn()"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def comparable(results):
+    return [{k: v for k, v in result.items() if k != 'scraped_at'} for result in results]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', nargs='+', default=sorted(app.PARSER_ENGINES), help='parser engines to compare')
+    parser.add_argument('--loops', type=int, default=20, help='parses per timing')
+    parser.add_argument('--repeat', type=int, default=5, help='best of this many timings')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    engines = {}
+    for name in args.engines:
+        engine = app.get_parser_engine(name)
+        if engine.name != name:
+            print(f'Skipping {name}: not installed', file=sys.stderr)
+            continue
+        engines[name] = engine
+
+    scraper = app.scraper
+    rows = []
+    mismatches = []
+    for fixture, content in load_fixtures('search').items():
+        parsed = {}
+        for name, engine in engines.items():
+            parsed[name] = scraper.parse_search_page(content, SOURCE_URL, engine)
+            count = len(parsed[name])
+            extract = timed(lambda: [list(engine.iter_rows(content)) for _ in range(args.loops)], args.repeat) / args.loops
+            full = timed(lambda: [list(scraper.iter_search_page(content, SOURCE_URL, engine)) for _ in range(args.loops)], args.repeat) / args.loops
+            rows.append({
+                'fixture': fixture,
+                'engine': name,
+                'rows': count,
+                'kb': round(len(content) / 1024, 1),
+                'extract_ms': round(extract * 1000, 3),
+                'parse_ms': round(full * 1000, 3),
+                'pages_per_sec': round(1 / full, 1),
+                'rows_per_sec': round(count / full, 1) if count else None,
+                'peak_kb': round(peak_memory(lambda: list(scraper.iter_search_page(content, SOURCE_URL, engine))) / 1024, 1),
+            })
+
+        baseline_name = next(iter(parsed), None)
+        for name, results in parsed.items():
+            if comparable(results) != comparable(parsed[baseline_name]):
+                mismatches.append(f'{fixture}: {name} differs from {baseline_name}')
+
+        if content and parsed:
+            titles = [result['title'] for result in parsed[baseline_name]]
+            if titles:
+                classify = timed(lambda: [scraper.classifier.classify_many(titles) for _ in range(args.loops)], args.repeat) / args.loops
+                rows.append({
+                    'fixture': fixture,
+                    'engine': 'classify',
+                    'rows': len(titles),
+                    'classify_ms': round(classify * 1000, 3),
+                    'rows_per_sec': round(len(titles) / classify, 1),
+                })
+
+    print_table(rows, ['fixture', 'engine', 'rows', 'kb', 'extract_ms', 'parse_ms', 'classify_ms', 'pages_per_sec', 'rows_per_sec', 'peak_kb'])
+    if mismatches:
+        print('\nEngine parity FAILED:\n  ' + '\n  '.join(mismatches))
+    elif len(engines) > 1:
+        print(f"\nEngine parity OK: {', '.join(engines)} agree on every fixture")
+
+    if args.json:
+        write_results(args.json, 'parse', vars(args), rows, parity_failures=mismatches)
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Record live mirror pages into benchmarks/fixtures.
+
+Fetches the search results page for each query from the first mirror that
+answers, plus the details pages of the first few results, and saves them
+as search-<query>.html and details-<query>-<n>.html. fake_mirror.py
+serves every search-*.html page (other than search-empty and
+search-short, which it uses for the end of a result list) and every
+details-*.html page it finds.
+
+    python benchmarks/record.py dune "the last of us" ubuntu
+    python benchmarks/record.py --mirror https://thepiratebay.org --details 3 dune
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+
+from common import FIXTURES_DIR, REPO_ROOT
+
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault('HLS_JANITOR', '0')
+os.environ.setdefault('SEARCH_INDEX_DB', '')
+
+import app  # noqa: E402
+
+def slug(text):
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+
+def save(name, content):
+    path = os.path.join(FIXTURES_DIR, f'{name}.html')
+    with open(path, 'wb') as f:
+        f.write(content)
+    print(f'Saved {path} ({len(content)} bytes)')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('queries', nargs='+')
+    parser.add_argument('--mirror', action='append', help='mirror base URL to try (default: the configured mirrors)')
+    parser.add_argument('--details', type=int, default=2, help='details pages to record per query')
+    args = parser.parse_args()
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    scraper = app.scraper
+    mirrors = args.mirror or scraper.registry.urls()
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    failed = 0
+
+    for query in args.queries:
+        for base_url in mirrors:
+            url = f'{base_url}/search/{scraper.preprocess_search_query(query)}/1/99/0'
+            try:
+                response = scraper.fetch(url)
+            except Exception as e:
+                print(f'{url}: {e}', file=sys.stderr)
+                continue
+            results = scraper.parse_search_page(response.content, url) if response.status_code == 200 else []
+            if not results:
+                print(f'{url}: HTTP {response.status_code}, {len(results)} results', file=sys.stderr)
+                continue
+            save(f'search-{slug(query)}', response.content)
+            for n, result in enumerate(results[:args.details], 1):
+                try:
+                    details = scraper.fetch(result['details_url'])
+                except Exception as e:
+                    print(f"{result['details_url']}: {e}", file=sys.stderr)
+                    continue
+                if details.status_code == 200:
+                    save(f'details-{slug(query)}-{n}', details.content)
+            break
+        else:
+            print(f'No mirror returned results for {query!r}', file=sys.stderr)
+            failed += 1
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Gunicorn settings for StreamVault.
+
+Every endpoint spends its time waiting on mirrors, torrent pages or
+proxied URLs, so by default requests are served from gevent greenlets:
+gunicorn monkey-patches sockets before loading app.py and the existing
+Flask routes and requests-based scraper become non-blocking unchanged.
+Set GUNICORN_WORKER_CLASS=sync to fall back to the old one-request-per-
+worker model.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# Concurrent requests per gevent worker; ignored by sync workers
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+
+# A search can legitimately wait on two rounds of mirror timeouts
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 5
+
+# Workers write their Prometheus samples here so /metrics can aggregate
+# them; the directory is emptied whenever the master starts
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/streamvault-metrics')
+
+# Search and details caches live in sqlite so every worker sees them: a
+# search being scraped by one worker is waited for, not repeated, by the rest
+os.environ.setdefault('SEARCH_CACHE_DB', '/tmp/streamvault-search-cache.sqlite')
+os.environ.setdefault('DETAILS_CACHE_DB', '/tmp/streamvault-details-cache.sqlite')
+
+def on_starting(server):
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        os.remove(os.path.join(metrics_dir, name))
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
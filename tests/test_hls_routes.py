@@ -0,0 +1,73 @@
+"""
+HLS routes only touch directories named after make_stream_id() IDs under
+HLS_ROOT: anything else is rejected before it reaches the filesystem.
+"""
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+os.environ.setdefault('HLS_JANITOR', '0')
+os.environ.setdefault('SEARCH_INDEX_DB', '')
+
+import app  # noqa: E402
+
+MAGNET = 'magnet:?xt=urn:btih:' + 'ab' * 20
+BAD_STREAM_IDS = ['..', '../victim', '0123456789ABCDEF', '0123456789abcdef\n', '0123456789abcde', 'x' * 16, '']
+
+@pytest.fixture
+def hls_root(tmp_path, monkeypatch):
+    root = tmp_path / 'hls'
+    root.mkdir()
+    monkeypatch.setattr(app, 'HLS_ROOT', str(root))
+    # A directory next to HLS_ROOT that a traversal would reach
+    (tmp_path / 'victim').mkdir()
+    return root
+
+@pytest.fixture
+def client(hls_root, monkeypatch):
+    monkeypatch.setattr(app.rate_limiter, 'check', lambda client, endpoint, cost=1: None)
+    return app.app.test_client()
+
+def test_hls_output_path_stays_under_root(hls_root):
+    stream_id = app.make_stream_id(MAGNET, 0)
+    assert app.hls_output_path(stream_id) == os.path.join(os.path.realpath(hls_root), f'hls-{stream_id}')
+
+@pytest.mark.parametrize('stream_id', BAD_STREAM_IDS + [None, 123, ['0123456789abcdef']])
+def test_hls_output_path_rejects_other_ids(hls_root, stream_id):
+    with pytest.raises(ValueError):
+        app.hls_output_path(stream_id)
+
+@pytest.mark.parametrize('stream_id', ['../victim', '../../victim', '0123456789ABCDEF', 123, ['x']])
+def test_cleanup_rejects_invalid_stream_id(client, hls_root, stream_id):
+    response = client.post('/api/cleanup-hls-stream', json={'streamId': stream_id})
+    assert response.status_code == 400
+    assert os.path.isdir(hls_root.parent / 'victim')
+
+@pytest.mark.parametrize('path', [
+    'ABCDEF0123456789/playlist.m3u8',
+    '..%2fvictim/playlist.m3u8',
+    '0123456789abcde/master.m3u8',
+    'not-a-stream/status',
+    'not-a-stream/segment000.ts',
+    'not-a-stream/480p/segment000.ts',
+])
+def test_routes_404_for_invalid_stream_id(client, path):
+    response = client.get(f'/api/hls-stream/{path}')
+    assert response.status_code == 404
+
+def test_rendition_is_not_part_of_the_stream_id(client, monkeypatch):
+    monkeypatch.setattr(app.transcoder, 'missing_tools', lambda source: [])
+    monkeypatch.setattr(app, 'start_hls_transcoding', lambda *args: {'success': True, 'shared': False})
+    stream_ids = set()
+    for rendition in (None, 'default', '../../victim', '1080p'):
+        payload = {'magnet': MAGNET, 'fileIndex': 0}
+        if rendition is not None:
+            payload['rendition'] = rendition
+        response = client.post('/api/create-hls-stream', json=payload)
+        assert response.status_code == 200
+        stream_ids.add(response.json['streamId'])
+    assert stream_ids == {app.make_stream_id(MAGNET, 0)}
@@ -0,0 +1,130 @@
+"""
+HLS transcoding against real FFmpeg: sources are generated with the lavfi
+test source, so these only need an ffmpeg binary (they are skipped without
+one). Covers remux vs transcode, cancelling a running job and the
+machine-wide encoder slot cap.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+os.environ.setdefault('HLS_JANITOR', '0')
+os.environ.setdefault('SEARCH_INDEX_DB', '')
+
+import app  # noqa: E402
+
+pytestmark = pytest.mark.skipif(shutil.which(app.FFMPEG) is None, reason='ffmpeg is not installed')
+
+MAGNET = 'magnet:?xt=urn:btih:' + 'ab' * 20
+
+def lavfi_args(duration):
+    return ['-f', 'lavfi', '-i', f'testsrc=duration={duration}:size=320x240:rate=25',
+            '-f', 'lavfi', '-i', f'sine=duration={duration}']
+
+def make_source(path, video_codec, audio_codec, duration=2):
+    subprocess.run(
+        [app.FFMPEG, '-hide_banner', '-loglevel', 'error', '-y'] + lavfi_args(duration) +
+        ['-c:v', video_codec, '-pix_fmt', 'yuv420p', '-c:a', audio_codec, '-shortest', str(path)],
+        check=True, timeout=60
+    )
+    return str(path)
+
+def torrent_command(duration, realtime=False):
+    """A stand-in for the torrent streamer that writes an H.264 Matroska file to stdout"""
+    return ' '.join(
+        [app.FFMPEG, '-hide_banner', '-loglevel', 'error'] + (['-re'] if realtime else []) + lavfi_args(duration) +
+        ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest',
+         '-f', 'matroska', 'pipe:1']
+    )
+
+@pytest.fixture
+def transcoder(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'HLS_ROOT', str(tmp_path))
+    manager = app.TranscodeManager(
+        max_workers=2, queue_size=4,
+        encoder_slots=app.EncoderSlots(str(tmp_path / 'slots'), 1, poll_interval=0.05),
+        stall_timeout=30, max_restarts=0
+    )
+    yield manager
+    manager.shutdown()
+
+def start(manager, source, file_index=0):
+    stream_id = app.make_stream_id(source, file_index)
+    manager.acquire(stream_id, source, file_index)
+    return stream_id, manager.get(stream_id)
+
+def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.05)
+
+def test_h264_file_is_remuxed(transcoder, tmp_path):
+    source = make_source(tmp_path / 'h264.mp4', 'libx264', 'aac')
+    stream_id, job = start(transcoder, source)
+    wait_for(lambda: not job.active)
+    assert (job.state, job.mode) == ('done', 'remux')
+    assert transcoder.counters['remuxed'] == 1
+    assert os.path.exists(os.path.join(app.hls_output_path(stream_id), 'segment000.ts'))
+
+def test_other_codecs_are_transcoded(transcoder, tmp_path):
+    source = make_source(tmp_path / 'mpeg4.avi', 'mpeg4', 'mp2')
+    stream_id, job = start(transcoder, source)
+    wait_for(lambda: not job.active)
+    assert (job.state, job.mode) == ('done', 'transcode')
+    assert transcoder.counters['remuxed'] == 0
+
+def test_piped_torrent_is_probed_and_remuxed(transcoder, monkeypatch):
+    monkeypatch.setattr(app, 'TORRENT_STREAM_COMMAND', torrent_command(2))
+    stream_id, job = start(transcoder, MAGNET)
+    wait_for(lambda: not job.active)
+    assert (job.state, job.mode) == ('done', 'remux')
+    assert os.path.exists(os.path.join(app.hls_output_path(stream_id), 'playlist.m3u8'))
+
+def test_remove_kills_running_job(transcoder, monkeypatch):
+    monkeypatch.setattr(app, 'TORRENT_STREAM_COMMAND', torrent_command(60, realtime=True))
+    stream_id, job = start(transcoder, MAGNET)
+    wait_for(lambda: job.ffmpeg_pid is not None)
+    processes = list(job.processes)
+
+    transcoder.remove(stream_id)
+    assert all(process.poll() is not None for process in processes)
+    assert job.cancel_event.is_set()
+    assert not os.path.exists(app.hls_output_path(stream_id))
+    wait_for(lambda: job.state == 'cancelled')
+
+def test_job_waits_for_a_free_encoder_slot(transcoder, tmp_path):
+    source = make_source(tmp_path / 'h264.mp4', 'libx264', 'aac')
+    release = threading.Event()
+    held = threading.Event()
+
+    def hold_slot():
+        # Another worker's FFmpeg, as far as the slot files are concerned
+        slots = app.EncoderSlots(transcoder.slots.directory, transcoder.slots.count)
+        with slots.hold(threading.Event()):
+            held.set()
+            release.wait(30)
+
+    holder = threading.Thread(target=hold_slot)
+    holder.start()
+    try:
+        held.wait(5)
+        stream_id, job = start(transcoder, source)
+        time.sleep(0.5)
+        assert job.state == 'queued'
+        assert transcoder.slots.in_use() == 1
+    finally:
+        release.set()
+        holder.join()
+    wait_for(lambda: not job.active)
+    assert job.state == 'done'
+    assert transcoder.slots.in_use() == 0
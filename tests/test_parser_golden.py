@@ -0,0 +1,66 @@
+"""
+Golden-file tests for search page parsing: every parser engine must turn
+the saved mirror pages in tests/fixtures into exactly the results recorded
+next to them.
+
+After an intended parser change, regenerate the expected files with the
+reference (bs4) engine and review the diff:
+
+    UPDATE_GOLDEN=1 python -m pytest tests/test_parser_golden.py
+"""
+import glob
+import json
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(TESTS_DIR, 'fixtures')
+
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+os.environ.setdefault('HLS_JANITOR', '0')
+os.environ.setdefault('SEARCH_INDEX_DB', '')
+
+import app  # noqa: E402
+
+# The mirror each page was saved from; relative detail links resolve against it
+SOURCE_URLS = {
+    'search-proxy-latin1': 'https://tpb.party/search/dune/1/99/0',
+    'search-fonts': 'https://piratebay.party/search/oppenheimer/1/99/0',
+}
+DEFAULT_SOURCE_URL = 'https://thepiratebay.org/search/dune/1/99/0'
+
+FIXTURES = sorted(os.path.basename(path)[:-len('.html')] for path in glob.glob(os.path.join(FIXTURES_DIR, 'search-*.html')))
+
+def installed_engines():
+    return [name for name in sorted(app.PARSER_ENGINES) if app.get_parser_engine(name).name == name]
+
+def parse(fixture, engine_name):
+    with open(os.path.join(FIXTURES_DIR, f'{fixture}.html'), 'rb') as f:
+        content = f.read()
+    engine = app.get_parser_engine(engine_name)
+    results = app.scraper.parse_search_page(content, SOURCE_URLS.get(fixture, DEFAULT_SOURCE_URL), engine)
+    # scraped_at is the time of parsing, not part of the page
+    return [{k: v for k, v in result.items() if k != 'scraped_at'} for result in results]
+
+def expected_path(fixture):
+    return os.path.join(FIXTURES_DIR, f'{fixture}.json')
+
+@pytest.mark.skipif(not os.environ.get('UPDATE_GOLDEN'), reason='set UPDATE_GOLDEN=1 to rewrite the expected results')
+@pytest.mark.parametrize('fixture', FIXTURES)
+def test_update_golden(fixture):
+    with open(expected_path(fixture), 'w', encoding='utf-8') as f:
+        json.dump(parse(fixture, 'bs4'), f, indent=2, ensure_ascii=False)
+        f.write('\n')
+
+@pytest.mark.parametrize('engine', installed_engines())
+@pytest.mark.parametrize('fixture', FIXTURES)
+def test_engine_matches_golden(fixture, engine):
+    with open(expected_path(fixture), encoding='utf-8') as f:
+        expected = json.load(f)
+    assert parse(fixture, engine) == expected
+
+def test_both_engines_installed():
+    # Parity is only checked if lxml is there to compare against bs4
+    assert installed_engines() == ['bs4', 'lxml']
@@ -0,0 +1,54 @@
+"""
+/api/search options: `pages` and `limit` must be positive integers, and
+`limit` caps the results wherever they came from.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(TESTS_DIR, 'fixtures')
+
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+os.environ.setdefault('HLS_JANITOR', '0')
+os.environ.setdefault('SEARCH_INDEX_DB', '')
+
+import app  # noqa: E402
+
+def load_results():
+    with open(os.path.join(FIXTURES_DIR, 'search-classic.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app.search_cache, 'get', lambda key: (None, None))
+    monkeypatch.setattr(app.rate_limiter, 'check', lambda client, endpoint: None)
+    return app.app.test_client()
+
+@pytest.mark.parametrize('cache_state', ['index', None])
+def test_limit_applies_to_every_source(client, monkeypatch, cache_state):
+    monkeypatch.setattr(app, 'scrape_or_index', lambda query, categories: (load_results(), cache_state))
+    response = client.post('/api/search', json={'query': 'dune', 'limit': 2})
+    assert response.status_code == 200
+    assert [r['title'] for r in response.json['results']] == [r['title'] for r in load_results()[:2]]
+
+def test_index_results_are_not_deep_searched(client, monkeypatch):
+    monkeypatch.setattr(app, 'scrape_or_index', lambda query, categories: (load_results(), 'index'))
+    monkeypatch.setattr(app, 'deep_search', lambda *args, **kwargs: pytest.fail('index results were deep searched'))
+    response = client.post('/api/search', json={'query': 'dune', 'pages': 3})
+    assert response.status_code == 200
+    assert response.json['total'] == len(load_results())
+
+@pytest.mark.parametrize('name', ['pages', 'limit'])
+@pytest.mark.parametrize('value', [0, -1, 1.5, '2.5', 'ten', True, [], {}])
+def test_invalid_option_is_rejected(client, monkeypatch, name, value):
+    monkeypatch.setattr(app, 'scrape_or_index', lambda query, categories: pytest.fail('searched with invalid options'))
+    response = client.post('/api/search', json={'query': 'dune', name: value})
+    assert response.status_code == 400
+    assert response.json == {'success': False, 'error': f'{name} must be a positive integer'}
+
+@pytest.mark.parametrize('value, expected', [(None, None), (1, 1), ('3', 3), (2.0, 2)])
+def test_positive_int_option(value, expected):
+    assert app.positive_int_option({'limit': value}, 'limit') == expected